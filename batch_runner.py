@@ -0,0 +1,266 @@
+'''
+Generate and run crews for a batch of objectives, without any interactive review.
+
+Objectives are read from a JSONL file, one per line: {"id": ..., "objective": ..., "tools": [...]}.
+"id" and "tools" are optional ("request_id" and "body" are accepted too), objectives without
+an id are identified by a hash of their text. Results are appended to the output JSONL as each
+objective finishes, so after a crash the same command picks up where it left off and only runs
+the objectives that don't have a successful result yet.
+
+    python batch_runner.py objectives.jsonl --output results.jsonl --workers 4
+
+With --dag --events-dir, each objective's task and tool events are streamed to a JSONL file
+as they happen. Only DAG runs emit events, --events-dir needs --dag.
+'''
+import argparse
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+DEFAULT_TOOLS = ['query_sql_db_tool', 'Python_REPL']
+
+
+def load_objectives(path) -> list:
+    '''The objectives of a JSONL file, with ids filled in and duplicates dropped.'''
+    items, seen = [], set()
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f'Skipping line {line_number} of {path}, it is not valid JSON: {e}')
+                continue
+            objective = entry.get('objective') or entry.get('body')
+            if not objective:
+                print(f'Skipping line {line_number} of {path}, it has no objective')
+                continue
+            item_id = str(entry.get('id') or entry.get('request_id') or hashlib.sha256(objective.encode('utf-8')).hexdigest()[:12])
+            if item_id in seen:
+                continue
+            seen.add(item_id)
+            items.append({'id': item_id, 'objective': objective, 'tools': entry.get('tools', DEFAULT_TOOLS)})
+    return items
+
+def completed_ids(output_path) -> set:
+    '''Ids with a successful result in the output file. A partly written last line is ignored.'''
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('status') == 'ok':
+                done.add(record['id'])
+    return done
+
+def append_record(output_path, record):
+    with open(output_path, 'a') as f:
+        f.write(json.dumps(record, default=str) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _init_worker(workers):
+    '''
+    Runs once in each worker process. The LLM budgets from LLM_RPM / LLM_TPM and the calls in
+    flight from LLM_MAX_CONCURRENT are for the whole batch, so every worker's scheduler gets an
+    even share before data_crew is first imported. The shares are fixed, the workers don't
+    coordinate, so a busy worker can't use what an idle one leaves over.
+    '''
+    # the scheduler's own default, it can't be imported for it before the environment is set
+    os.environ.setdefault('LLM_MAX_CONCURRENT', '8')
+    for name in ('LLM_RPM', 'LLM_TPM', 'LLM_MAX_CONCURRENT'):
+        if os.environ.get(name):
+            os.environ[name] = str(max(1, int(os.environ[name]) // workers))
+    os.environ.setdefault('OTEL_SDK_DISABLED', 'true')
+    import data_crew  # noqa: F401
+
+def _token_totals(token_usage) -> dict:
+    totals = {'calls': 0, 'cache_hits': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+    for usage in token_usage.values():
+        for key in totals:
+            totals[key] += usage[key]
+    return totals
+
+def run_crew_streaming(crew_config, events_path) -> dict:
+    '''
+    Run a crew config as a DAG, appending its events to events_path as they happen, so each
+    task's output can be picked up before the whole crew is done. Token-level events are left out.
+    '''
+    import crew_events
+    import data_crew
+
+    outputs = None
+    with open(events_path, 'a') as f:
+        for event in data_crew.stream_crew_dag(crew_config, verbose=False):
+            if event['type'] in (crew_events.LLM_TOKEN, crew_events.PARTIAL_OUTPUT):
+                continue
+            if event['type'] == crew_events.CREW_FINISHED:
+                outputs = event['outputs']
+            f.write(json.dumps(event, default=str) + '\n')
+            f.flush()
+    return outputs
+
+def run_objective(item, mode='per_item', dag=False, configs_dir=None, log_dir=None, events_dir=None) -> dict:
+    '''
+    Generate and run the crew for one objective, in a worker process. The worker's tools,
+    database engines and LLM clients are reused by every objective it runs, and the LLM
+    response cache and schema profiles are shared with the other workers on disk.
+    With events_dir, DAG runs stream their events to <events_dir>/<id>.events.jsonl.
+    '''
+    import data_crew
+
+    config_path = os.path.join(configs_dir, f'{item["id"]}.json') if configs_dir else None
+    log = open(os.path.join(log_dir, f'{item["id"]}.log'), 'w') if log_dir else open(os.devnull, 'w')
+    record = {'id': item['id'], 'objective': item['objective'], 'pid': os.getpid(), 'started_at': time.time()}
+    tokens_before = _token_totals(data_crew.token_usage)
+    start = time.perf_counter()
+    config_seconds = None
+    try:
+        with log, contextlib.redirect_stdout(log):
+            crew_config = data_crew.create_full_config(
+                objective=item['objective'],
+                tools=item['tools'],
+                review_intermediate=False,
+                review_final=False,
+                mode=mode,
+                # a config saved before a crash is reused rather than generated again
+                previous_config=config_path,
+                save_path=config_path,
+            )
+            config_seconds = time.perf_counter() - start
+            if not dag:
+                result = data_crew.kickoff_with_tracing(data_crew.initialize_from_config(crew_config, verbose=0))
+            else:
+                if events_dir:
+                    outputs = run_crew_streaming(crew_config, os.path.join(events_dir, f'{item["id"]}.events.jsonl'))
+                else:
+                    outputs = data_crew.run_crew_dag(crew_config, verbose=False)
+                record['outputs'] = {name: str(output) for name, output in outputs.items()}
+                result = list(outputs.values())[-1] if outputs else None
+        record.update(status='ok', result=str(result))
+    except Exception as e:
+        record.update(status='error', error=f'{type(e).__name__}: {e}', traceback=traceback.format_exc())
+
+    total_seconds = time.perf_counter() - start
+    tokens_after = _token_totals(data_crew.token_usage)
+    record.update(
+        finished_at=time.time(),
+        timings={
+            'config_seconds': config_seconds,
+            'run_seconds': total_seconds - config_seconds if config_seconds is not None else None,
+            'total_seconds': total_seconds,
+        },
+        config_tokens={key: tokens_after[key] - tokens_before[key] for key in tokens_after},
+    )
+    return record
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+def summarize(records, wall_seconds, skipped=0) -> dict:
+    '''Throughput and latency percentiles of the objectives run in this batch.'''
+    succeeded = [record for record in records if record['status'] == 'ok']
+    summary = {
+        'objectives': len(records),
+        'succeeded': len(succeeded),
+        'failed': len(records) - len(succeeded),
+        'skipped': skipped,
+        'wall_seconds': wall_seconds,
+        'objectives_per_minute': len(succeeded) / wall_seconds * 60 if wall_seconds > 0 else None,
+    }
+    for phase in ('total_seconds', 'config_seconds', 'run_seconds'):
+        values = [record['timings'][phase] for record in succeeded if record['timings'][phase] is not None]
+        summary[phase] = {f'p{int(p * 100)}': percentile(values, p) for p in (0.5, 0.9, 0.99)}
+        summary[phase]['mean'] = sum(values) / len(values) if values else None
+    return summary
+
+def print_summary(summary):
+    print(
+        f"\n{summary['succeeded']} of {summary['objectives']} objectives succeeded, {summary['failed']} failed, "
+        f"{summary['skipped']} already done, in {summary['wall_seconds']:.1f}s"
+    )
+    if summary['objectives_per_minute'] is not None:
+        print(f"throughput: {summary['objectives_per_minute']:.2f} objectives/minute")
+    print(f'{"latency (s)":<16} {"p50":>9} {"p90":>9} {"p99":>9} {"mean":>9}')
+    for phase in ('total_seconds', 'config_seconds', 'run_seconds'):
+        row = summary[phase]
+        cells = ''.join(f'{row[key]:>10.2f}' if row[key] is not None else f'{"-":>10}' for key in ('p50', 'p90', 'p99', 'mean'))
+        print(f'{phase.replace("_seconds", ""):<16}{cells}')
+
+
+def run_batch(input_path, output_path, workers=4, mode='per_item', dag=False, configs_dir=None, log_dir=None, events_dir=None) -> dict:
+    items = load_objectives(input_path)
+    done = completed_ids(output_path)
+    pending = [item for item in items if item['id'] not in done]
+    print(f'{len(items)} objectives in {input_path}, {len(items) - len(pending)} already done, running {len(pending)} on {workers} workers')
+    for directory in (configs_dir, log_dir, events_dir):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    records = []
+    start = time.perf_counter()
+    if pending:
+        # spawn rather than fork, the parent may already hold threads and sqlite connections
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(workers,)) as executor:
+            futures = {
+                executor.submit(run_objective, item, mode, dag, configs_dir, log_dir, events_dir): item
+                for item in pending
+            }
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    # the worker process itself died, e.g. it ran out of memory
+                    record = {'id': item['id'], 'objective': item['objective'], 'status': 'error',
+                              'error': f'{type(e).__name__}: {e}', 'timings': {'config_seconds': None, 'run_seconds': None, 'total_seconds': None}}
+                append_record(output_path, record)
+                records.append(record)
+                total = record['timings']['total_seconds']
+                took = f' in {total:.1f}s' if total is not None else ''
+                print(f"[{len(records)}/{len(pending)}] {item['id']}: {record['status']}{took}" + (f" ({record['error']})" if record['status'] != 'ok' else ''))
+
+    summary = summarize(records, time.perf_counter() - start, skipped=len(items) - len(pending))
+    print_summary(summary)
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='JSONL file of objectives')
+    parser.add_argument('--output', default='batch_results.jsonl', help='JSONL file results are appended to')
+    parser.add_argument('--workers', type=int, default=4, help='worker processes')
+    parser.add_argument('--mode', choices=['per_item', 'batched'], default='per_item', help='config generation mode')
+    parser.add_argument('--dag', action='store_true', help='run tasks as a dependency graph instead of sequentially')
+    parser.add_argument('--configs-dir', default='batch_configs', help='where each objective\'s crew config is saved')
+    parser.add_argument('--log-dir', default='batch_logs', help='where each objective\'s console output goes')
+    parser.add_argument('--events-dir', help='stream each objective\'s task and tool events to JSONL files here (needs --dag)')
+    parser.add_argument('--summary', help='also write the summary to this JSON file')
+    args = parser.parse_args()
+    if args.events_dir and not args.dag:
+        parser.error('--events-dir needs --dag, only DAG runs emit events')
+
+    summary = run_batch(args.input, args.output, workers=args.workers, mode=args.mode, dag=args.dag, configs_dir=args.configs_dir, log_dir=args.log_dir, events_dir=args.events_dir)
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+    sys.exit(1 if summary['failed'] else 0)
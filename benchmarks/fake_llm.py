@@ -0,0 +1,128 @@
+import re
+import sys
+import time
+import types
+from typing import Any, Callable, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+def crew_responder(n_agents=3, n_tasks=6):
+    '''
+    Canned responses for the crew generation prompts, producing a crew of the given size.
+    Returns a function (prompt_template, inputs) -> completion text.
+    '''
+    def agent_config(name, agent_tasks, tool_names):
+        return {
+            'role': f'{name} analyst',
+            'goal': f'Complete {agent_tasks}',
+            'backstory': 'You are a careful data analyst.',
+            'verbose': False,
+            'allow_delegation': False,
+            'tools': list(tool_names),
+        }
+
+    def respond(prompt_template, inputs):
+        if 'Your agent configs' in prompt_template:
+            configs = {
+                name: agent_config(name, tasks, inputs['tool_names'])
+                for name, tasks in inputs['agent_tasks'].items()
+            }
+            return f'```python\n{configs!r}\n```'
+        if 'Your task configs' in prompt_template:
+            configs = {
+                task['task']: {'description': f'Carry out {task["task"]}.', 'agent': task['agent_role']}
+                for task in inputs['tasks']
+            }
+            return f'```python\n{configs!r}\n```'
+        if 'Your crew config' in prompt_template:
+            agents = [f'agent_{i}' for i in range(n_agents)]
+            tasks = [{'task': f'task_{i}', 'agent': agents[i % n_agents]} for i in range(n_tasks)]
+            return f"```python\n{{'agents': {agents!r}, 'tasks': {tasks!r}}}\n```"
+        if 'Your agent config' in prompt_template:
+            config = agent_config(inputs['name'], inputs['agent_tasks'], inputs['tool_names'])
+            return f'```python\n{config!r}\n```'
+        if 'Your task config' in prompt_template:
+            config = {'description': f'Carry out {inputs["task_description"]}.', 'agent': inputs['agent_role']}
+            return f'```python\n{config!r}\n```'
+        return 'OK'
+    return respond
+
+
+class FakeLLMFunction:
+    '''
+    Stand-in for bronco.LLMFunction: sleeps for `latency` seconds, then parses a scripted response.
+    Set FakeLLMFunction.responder and FakeLLMFunction.latency to script it.
+    '''
+
+    responder: Callable = staticmethod(crew_responder())
+    latency: float = 0.0
+    calls: int = 0
+
+    def __init__(self, prompt_template, model_name=None, parser=None, success_func=None, **kwargs):
+        self.prompt_template = prompt_template
+        self.parser = parser or (lambda text: text)
+        self.success_func = success_func
+
+    def generate(self, inputs):
+        type(self).calls += 1
+        time.sleep(self.latency)
+        return self.parser(self.responder(self.prompt_template, inputs))
+
+
+class FakeChatModel(BaseChatModel):
+    '''A chat model that sleeps for `latency` seconds and then returns the next canned response, streamed if streaming=True.'''
+
+    responses: List[str] = ['Final Answer: done']
+    latency: float = 0.0
+    calls: int = 0
+    streaming: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake-chat-model'
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency)
+        response = self.responses[self.calls % len(self.responses)]
+        self.calls += 1
+        if self.streaming and run_manager is not None:
+            # word by word, keeping the whitespace, like a streamed completion
+            for token in re.findall(r'\s*\S+', response):
+                run_manager.on_llm_new_token(token)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=response))])
+
+
+def install_fakes(latency=0.0, responder=None):
+    '''
+    Route the repo's model call sites to the fakes: bronco.LLMFunction and the shared
+    chat model clients handed out by tools.db_registry.get_llm.
+    '''
+    try:
+        from Bronco import bronco
+    except ImportError:
+        # the Bronco submodule isn't checked out, give data_crew something to import
+        bronco = types.ModuleType('Bronco.bronco')
+        bronco.GPT_4 = 'gpt-4'
+        package = types.ModuleType('Bronco')
+        package.bronco = bronco
+        sys.modules['Bronco'] = package
+        sys.modules['Bronco.bronco'] = bronco
+
+    FakeLLMFunction.latency = latency
+    if responder is not None:
+        FakeLLMFunction.responder = staticmethod(responder)
+    bronco.LLMFunction = FakeLLMFunction
+
+    from tools import db_registry
+    db_registry.ScheduledChatOpenAI = lambda model=None, temperature=0, **kwargs: FakeChatModel(latency=latency)
+    db_registry._llms.clear()
@@ -0,0 +1,181 @@
+'''
+A local stand-in for the OpenAI chat completions endpoint that enforces a request-per-second
+limit and answers 429s past it, for exercising the LLM scheduler without a real account.
+Fires the same burst of calls at it through a plain ChatOpenAI and through the scheduler:
+
+    python -m benchmarks.mock_openai --calls 60 --limit 10
+'''
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('OPENAI_API_KEY', 'offline-benchmark')
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    '''
+    Serves POST /v1/chat/completions from a background thread. At most limit requests are
+    accepted per second, later ones get a 429 with a Retry-After; accepted requests take
+    latency seconds and answer with the text of the last message reversed, streamed as
+    server-sent events when the request asks for it. Accepted prompts are kept in order, and
+    early counts the requests that arrived before a Retry-After the server had sent was up.
+    '''
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, limit=10, latency=0.05, port=0):
+        super().__init__(('127.0.0.1', port), MockOpenAIHandler)
+        self.limit = limit
+        self.latency = latency
+        self.accepted = 0
+        self.rejected = 0
+        self.early = 0
+        self.prompts = []
+        self._window = (0, 0)
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/v1'
+
+    def admit(self, prompt=''):
+        '''None if the request is accepted, else the seconds the client should wait.'''
+        now = time.time()
+        second = int(now)
+        with self._lock:
+            if now < self._retry_at:
+                self.early += 1
+            start, count = self._window
+            if start != second:
+                start, count = second, 0
+            if count >= self.limit:
+                self.rejected += 1
+                self._retry_at = max(self._retry_at, second + 1)
+                return second + 1 - now
+            self._window = (start, count + 1)
+            self.accepted += 1
+            self.prompts.append(prompt)
+            return None
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        prompt = request.get('messages', [{}])[-1].get('content', '')
+        wait = self.server.admit(prompt)
+        if wait is not None:
+            # the real API says how long to wait in the same headers, rounded up to whole milliseconds
+            self._send(429, {'error': {
+                'message': 'Rate limit reached for requests', 'type': 'requests', 'code': 'rate_limit_exceeded',
+            }}, {'retry-after-ms': str(math.ceil(wait * 1000))})
+            return
+
+        time.sleep(self.server.latency)
+        content = prompt[::-1]
+        if request.get('stream'):
+            self._stream(request, content)
+            return
+        prompt_tokens = sum(len(message.get('content', '')) for message in request.get('messages', [])) // 4
+        self._send(200, {
+            'id': 'chatcmpl-mock',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'gpt-4'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(content) // 4, 'total_tokens': prompt_tokens + len(content) // 4},
+        })
+
+    def _stream(self, request, content):
+        '''Send the completion as server-sent events, a couple of characters per chunk.'''
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        pieces = [content[i:i + 2] for i in range(0, len(content), 2)]
+        for i, piece in enumerate(pieces + [None]):
+            delta = {'content': piece} if piece is not None else {}
+            if i == 0:
+                delta['role'] = 'assistant'
+            chunk = {
+                'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                'model': request.get('model', 'gpt-4'),
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': None if piece is not None else 'stop'}],
+            }
+            self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def fire(llm, calls, concurrency):
+    '''Send calls prompts through llm from concurrency threads, returns (succeeded, failed, seconds).'''
+    def one(i):
+        try:
+            llm.invoke(f'request {i}')
+            return True
+        except Exception:
+            return False
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(calls)))
+    return results.count(True), results.count(False), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=10, help='requests per second the mock accepts')
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    from langchain_openai import ChatOpenAI
+    from llm_scheduler import LLMScheduler
+    from tools.db_registry import ScheduledChatOpenAI
+
+    with MockOpenAIServer(limit=args.limit, latency=args.latency) as server:
+        plain = ChatOpenAI(openai_api_base=server.base_url, max_retries=2)
+        succeeded, failed, seconds = fire(plain, args.calls, args.concurrency)
+        print(f'ChatOpenAI, client retries:  {succeeded} ok, {failed} failed, {server.rejected} 429s, {seconds:.1f}s')
+
+        server.accepted = server.rejected = server.early = 0
+        # a budget just under the server's, the 429 handling covers the rest
+        scheduler = LLMScheduler(requests_per_minute=args.limit * 60 * 0.9, max_concurrent=args.concurrency)
+        scheduled = ScheduledChatOpenAI(openai_api_base=server.base_url, scheduler=scheduler)
+        succeeded, failed, seconds = fire(scheduled, args.calls, args.concurrency)
+        print(f'ScheduledChatOpenAI:         {succeeded} ok, {failed} failed, {server.rejected} 429s, {seconds:.1f}s')
+        scheduler.print_metrics()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+'''
+Offline benchmarks for data_crew.py and tools/sql_tool.py.
+
+Every model call goes to a deterministic stand-in with a fixed latency, so the numbers only
+move when our own code does. Run from the repo root:
+
+    python -m benchmarks.run_benchmarks --output bench_results.json
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('OPENAI_API_KEY', 'offline-benchmark')
+# crewai's telemetry would otherwise try to reach the network
+os.environ.setdefault('OTEL_SDK_DISABLED', 'true')
+
+from benchmarks.fake_llm import FakeChatModel, crew_responder, install_fakes
+
+
+SOURCE_DB = 'spaceship_titanic.db'
+SOURCE_TABLE = 'spaceship_titanic'
+
+QUERIES = {
+    'select_star': f'SELECT * FROM {SOURCE_TABLE}',
+    'group_by': f'SELECT VIP, AVG(Transported), COUNT(*) FROM {SOURCE_TABLE} GROUP BY VIP',
+    'filter': f"SELECT PassengerId, Age FROM {SOURCE_TABLE} WHERE CryoSleep = 1 AND Age > 30",
+}
+
+
+def time_call(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {
+        'repeats': repeats,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+    }
+
+
+def enlarge_database(source, destination, factor):
+    '''Copy the database and multiply the rows of its table by factor, with unique PassengerIds.'''
+    shutil.copyfile(source, destination)
+    connection = sqlite3.connect(destination)
+    columns = [row[1] for row in connection.execute(f'PRAGMA table_info({SOURCE_TABLE})')]
+    copied_columns = ', '.join(
+        f"PassengerId || '_x' || {'{copy}'}" if column == 'PassengerId' else f'"{column}"'
+        for column in columns
+    )
+    for copy in range(1, factor):
+        connection.execute(
+            f'INSERT INTO {SOURCE_TABLE} SELECT {copied_columns.format(copy=copy)} '
+            f'FROM {SOURCE_TABLE} WHERE PassengerId NOT LIKE \'%\\_x%\' ESCAPE \'\\\''
+        )
+    connection.commit()
+    connection.close()
+
+
+def bench_create_full_config(crew_sizes, latency, repeats, max_workers):
+    install_fakes(latency=latency)
+    import data_crew
+
+    # review_config opens vim, the benchmark skips it
+    data_crew.review_config = lambda config, keep_file=False: config
+
+    class BenchTool:
+        def __init__(self, name):
+            self.name = name
+
+    results = []
+    for n_agents, n_tasks in crew_sizes:
+        install_fakes(latency=latency, responder=crew_responder(n_agents, n_tasks))
+        runs = [('per_item', workers) for workers in sorted({1, max_workers})] + [('batched', max_workers)]
+        for mode, workers in runs:
+            data_crew.token_usage.clear()
+            timing = time_call(
+                lambda: data_crew.create_full_config(
+                    objective='Benchmark objective',
+                    tools=[BenchTool('query_sql_db_tool'), BenchTool('Python_REPL')],
+                    review_intermediate=False,
+                    max_workers=workers,
+                    use_cache=False,
+                    mode=mode
+                ),
+                repeats
+            )
+            usage = data_crew.token_usage.get(mode, {})
+            results.append({
+                'benchmark': 'create_full_config',
+                'params': {'agents': n_agents, 'tasks': n_tasks, 'mode': mode, 'max_workers': workers, 'llm_latency': latency},
+                'llm_calls_per_run': usage.get('calls', 0) / repeats,
+                'prompt_tokens_per_run': usage.get('prompt_tokens', 0) / repeats,
+                'completion_tokens_per_run': usage.get('completion_tokens', 0) / repeats,
+                **timing
+            })
+    return results
+
+
+def bench_initialize_from_config(crew_sizes, repeats):
+    install_fakes()
+    import data_crew
+
+    results = []
+    for n_agents, n_tasks in crew_sizes:
+        responder = crew_responder(n_agents, n_tasks)
+        install_fakes(latency=0.0, responder=responder)
+        data_crew.review_config = lambda config, keep_file=False: config
+
+        class BenchTool:
+            name = 'query_sql_db_tool'
+
+        config = data_crew.create_full_config('Benchmark objective', [BenchTool()], review_intermediate=False, use_cache=False)
+
+        def initialize():
+            fresh_config = json.loads(json.dumps(config))
+            for agent in fresh_config['agents']:
+                agent['llm'] = FakeChatModel()
+            data_crew.initialize_from_config(fresh_config, verbose=0, tools=[])
+
+        results.append({
+            'benchmark': 'initialize_from_config',
+            'params': {'agents': n_agents, 'tasks': n_tasks},
+            **time_call(initialize, repeats)
+        })
+    return results
+
+
+def bench_query_tool(scales, repeats, workdir):
+    from langchain_community.utilities.sql_database import SQLDatabase
+    from tools.sql_tool import QuerySQLLimitedDataBaseTool
+
+    results = []
+    for scale in scales:
+        path = os.path.join(workdir, f'spaceship_titanic_x{scale}.db')
+        enlarge_database(SOURCE_DB, path, scale)
+        db = SQLDatabase.from_uri(f'sqlite:///{path}')
+
+        for cached in (False, True):
+            tool = QuerySQLLimitedDataBaseTool(db=db)
+            if not cached:
+                tool.result_cache = None
+            for query_name, query in QUERIES.items():
+                results.append({
+                    'benchmark': 'query_sql_limited_tool',
+                    'params': {'scale': scale, 'rows': 8693 * scale, 'query': query_name, 'cached': cached},
+                    **time_call(lambda: tool.run(query), repeats)
+                })
+        db._engine.dispose()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='bench_results.json', help='where to write the results')
+    parser.add_argument('--llm-latency', type=float, default=0.05, help='seconds per fake LLM call')
+    parser.add_argument('--crew-sizes', default='2x4,5x10,10x20', help='comma-separated AGENTSxTASKS')
+    parser.add_argument('--scales', default='1,10,100', help='row multipliers for the query benchmarks, e.g. 1,10,100,1000')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--only', choices=['config', 'initialize', 'query'], help='run a single benchmark group')
+    args = parser.parse_args()
+
+    crew_sizes = [tuple(int(n) for n in size.split('x')) for size in args.crew_sizes.split(',')]
+    scales = [int(scale) for scale in args.scales.split(',')]
+
+    results = []
+    if args.only in (None, 'config'):
+        results += bench_create_full_config(crew_sizes, args.llm_latency, args.repeats, args.max_workers)
+    if args.only in (None, 'initialize'):
+        results += bench_initialize_from_config(crew_sizes, args.repeats)
+    if args.only in (None, 'query'):
+        workdir = tempfile.mkdtemp(prefix='crew_bench_')
+        try:
+            results += bench_query_tool(scales, args.repeats, workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for result in results:
+        params = ', '.join(f'{key}={value}' for key, value in result['params'].items())
+        print(f'{result["benchmark"]:<26} {result["median"] * 1000:>10.2f} ms  ({params})')
+    print(f'\nWrote {len(results)} results to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+'''
+Measure the cold-start import cost of data_crew with `python -X importtime`.
+
+    python -m benchmarks.startup                 # the working tree
+    python -m benchmarks.startup --rev HEAD~1    # another git revision, for a before/after comparison
+
+If the Bronco submodule isn't checked out, a stand-in module is put on the path so the
+import can be measured anyway.
+'''
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+BRONCO_STAND_IN = '''GPT_4 = 'gpt-4'
+
+class LLMFunction:
+    def __init__(self, *args, **kwargs):
+        raise RuntimeError('stand-in Bronco module, only used to measure import time')
+'''
+
+
+def export_revision(rev, destination):
+    '''Write the tree at a git revision to destination.'''
+    archive = subprocess.run(['git', 'archive', rev], cwd=REPO_ROOT, check=True, capture_output=True).stdout
+    subprocess.run(['tar', '-x', '-C', destination], input=archive, check=True)
+
+
+def bronco_path(workdir):
+    '''A directory to add to PYTHONPATH if Bronco can't be imported from the repo.'''
+    if os.path.exists(os.path.join(REPO_ROOT, 'Bronco', 'bronco.py')):
+        return None
+    stand_in = os.path.join(workdir, 'stand_in', 'Bronco')
+    os.makedirs(stand_in, exist_ok=True)
+    open(os.path.join(stand_in, '__init__.py'), 'w').close()
+    with open(os.path.join(stand_in, 'bronco.py'), 'w') as f:
+        f.write(BRONCO_STAND_IN)
+    return os.path.dirname(stand_in)
+
+
+def measure(tree, extra_path, module='data_crew'):
+    '''Import module once in a fresh interpreter and parse the -X importtime report.'''
+    env = dict(os.environ, OTEL_SDK_DISABLED='true')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [tree, extra_path, env.get('PYTHONPATH')]))
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=tree, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f'importing {module} failed:\n{completed.stderr[-2000:]}')
+
+    imports = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            # keep the module and its direct imports, their cumulative time includes everything they pull in
+            if len(indent) <= 3:
+                imports[name] = int(cumulative_us) / 1e6
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rev', help='measure this git revision instead of the working tree')
+    parser.add_argument('--module', default='data_crew')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='how many of the slowest imports to show')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='crew_startup_')
+    try:
+        tree = REPO_ROOT
+        if args.rev:
+            tree = os.path.join(workdir, 'tree')
+            os.makedirs(tree)
+            export_revision(args.rev, tree)
+        extra_path = bronco_path(workdir)
+
+        runs = [measure(tree, extra_path, args.module) for _ in range(args.repeats)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    totals = [run.get(args.module, sum(run.values())) for run in runs]
+    slowest = sorted(
+        [(name, seconds) for name, seconds in runs[-1].items() if name != args.module],
+        key=lambda item: item[1],
+        reverse=True
+    )[:args.top]
+
+    print(f'import {args.module} ({args.rev or "working tree"}): median {statistics.median(totals) * 1000:.1f} ms over {args.repeats} runs')
+    for name, seconds in slowest:
+        print(f'{seconds * 1000:>10.1f} ms  {name}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'module': args.module,
+                'rev': args.rev,
+                'median_seconds': statistics.median(totals),
+                'runs_seconds': totals,
+                'slowest_imports': slowest,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
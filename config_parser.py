@@ -0,0 +1,275 @@
+import ast
+import json
+import re
+import threading
+
+
+FENCED_BLOCK = re.compile(r'```(?:python|json|py)?[ \t]*\n?(.*?)(?:```|$)', re.DOTALL)
+# 'tasks': [ 'tasks': [  -> the same key opened twice in a row
+DUPLICATED_KEY = re.compile(r'''(?P<key>(?P<quote>['"])\w+(?P=quote)\s*:\s*)(?P<open>[\[{])\s*(?P=key)(?P=open)''')
+# 'key': 'value, 'next_key':  -> a value whose closing quote is missing
+UNCLOSED_VALUE = re.compile(r''':\s*(?P<quote>['"])(?P<value>[^'"\n]*?),(?P<space>\s*)(?P<next>(?P=quote)\w+(?P=quote)\s*:)''')
+JSON_LITERALS = {'true': 'True', 'false': 'False', 'null': 'None'}
+OPENERS = {'[': ']', '{': '}', '(': ')'}
+CLOSERS = {']': '[', '}': '{', ')': '('}
+
+
+# how the model outputs parsed: cleanly, only after a local repair (a retry avoided), or not at all
+parse_stats = {'clean': 0, 'repaired': 0, 'invalid': 0, 'failed': 0}
+parse_stats_lock = threading.Lock()
+
+def _count(outcome):
+    with parse_stats_lock:
+        parse_stats[outcome] += 1
+
+def retries_avoided() -> int:
+    '''Outputs that only parsed or validated thanks to a local repair, each one an LLM round trip saved.'''
+    return parse_stats['repaired']
+
+
+def extract_code(text) -> str:
+    '''The contents of the first fenced code block, or the whole text if there isn't one.'''
+    match = FENCED_BLOCK.search(text)
+    code = match.group(1) if match else text
+    return code.strip()
+
+def literal(code):
+    '''Parse a Python or JSON literal without executing anything. Raises ValueError.'''
+    try:
+        return ast.literal_eval(code)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError) as python_error:
+        try:
+            return json.loads(code)
+        except ValueError:
+            raise ValueError(str(python_error)) from None
+
+def strip_prefix(code) -> str:
+    '''Drop anything before the first bracket, e.g. the stray `i` in `i{...}` or a leading `config = `.'''
+    starts = [index for index in (code.find('{'), code.find('[')) if index >= 0]
+    return code[min(starts):] if starts else code
+
+def collapse_duplicated_keys(code) -> str:
+    return DUPLICATED_KEY.sub(lambda match: match.group('key') + match.group('open'), code)
+
+def close_unclosed_values(code) -> str:
+    return UNCLOSED_VALUE.sub(
+        lambda match: f": {match.group('quote')}{match.group('value')}{match.group('quote')},{match.group('space')}{match.group('next')}",
+        code
+    )
+
+def balance(code) -> str:
+    '''
+    Repair the structure of a literal in a single pass, outside of strings:
+    drop trailing commas, drop closing brackets that don't match, close brackets and strings
+    left open at the end, and turn JSON's true/false/null into Python literals.
+    '''
+    out = []
+    stack = []
+    i = 0
+    n = len(code)
+    while i < n:
+        char = code[i]
+        if char in '\'"':
+            quote = code[i:i + 3] if code[i:i + 3] in ("'''", '"""') else char
+            end = i + len(quote)
+            while end < n and code[end:end + len(quote)] != quote:
+                end += 2 if code[end] == '\\' else 1
+            if end >= n:
+                # unterminated string, close it
+                out.append(code[i:] + quote)
+                break
+            out.append(code[i:end + len(quote)])
+            i = end + len(quote)
+            continue
+        if char == '#':
+            end = code.find('\n', i)
+            i = n if end < 0 else end
+            continue
+        if char in OPENERS:
+            stack.append(char)
+        elif char in CLOSERS:
+            if not stack or stack[-1] != CLOSERS[char]:
+                i += 1
+                continue
+            stack.pop()
+            # a trailing comma before the closer
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ',':
+                out.pop()
+        elif char.isalpha():
+            match = re.match(r'[^\W\d]\w*', code[i:])
+            word = match.group(0)
+            out.append(JSON_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        out.append(char)
+        i += 1
+
+    repaired = ''.join(out).rstrip()
+    if repaired.endswith(','):
+        repaired = repaired[:-1]
+    return repaired + ''.join(OPENERS[opener] for opener in reversed(stack))
+
+REPAIRS = (strip_prefix, collapse_duplicated_keys, close_unclosed_values, balance)
+
+def parse_literal(text):
+    '''
+    Parse the literal in a model completion, repairing common defects locally.
+    Returns (value, repaired), and raises ValueError if nothing parses.
+    '''
+    code = extract_code(text)
+    try:
+        return literal(code), False
+    except ValueError:
+        pass
+
+    for repair in REPAIRS:
+        code = repair(code)
+        try:
+            return literal(code), True
+        except ValueError:
+            continue
+    raise ValueError(f'could not parse a literal from: {code[:200]!r}')
+
+
+# expected keys and types of each config, (type, required)
+CREW_SCHEMA = {'agents': (list, True), 'tasks': (list, True)}
+CREW_TASK_SCHEMA = {'task': (str, True), 'agent': (str, True), 'depends_on': (list, False)}
+AGENT_SCHEMA = {
+    'role': (str, True),
+    'goal': (str, True),
+    'backstory': (str, True),
+    'verbose': (bool, False),
+    'allow_delegation': (bool, False),
+    'tools': (list, False)
+}
+TASK_SCHEMA = {'description': (str, True), 'agent': (str, True)}
+
+def schema_errors(config, schema) -> list:
+    if not isinstance(config, dict):
+        return [f'expected a dict, got {type(config).__name__}']
+    errors = []
+    for key, (expected_type, required) in schema.items():
+        if key not in config:
+            if required:
+                errors.append(f'missing {key!r}')
+        elif not isinstance(config[key], expected_type):
+            errors.append(f'{key!r} should be a {expected_type.__name__}')
+    return errors
+
+def crew_config_errors(config) -> list:
+    errors = schema_errors(config, CREW_SCHEMA)
+    if errors:
+        return errors
+    if not all(isinstance(agent, str) for agent in config['agents']):
+        errors.append("'agents' should be a list of names")
+    for task in config['tasks']:
+        errors += schema_errors(task, CREW_TASK_SCHEMA)
+    return errors
+
+def is_valid_crew_config(crew_config) -> bool:
+    return not crew_config_errors(crew_config)
+
+def is_valid_agent_config(agent_config) -> bool:
+    return not schema_errors(agent_config, AGENT_SCHEMA)
+
+def is_valid_task_config(task_config) -> bool:
+    return not schema_errors(task_config, TASK_SCHEMA)
+
+
+def unwrap(config):
+    '''The model sometimes nests the config under its name, {'researcher': {...}}.'''
+    if isinstance(config, dict) and len(config) == 1 and isinstance(next(iter(config.values())), dict):
+        return next(iter(config.values()))
+    return config
+
+def normalize_crew_config(config):
+    '''Local fixes that don't need the model: unwrap the config and default depends_on.'''
+    config = unwrap(config)
+    if isinstance(config, dict) and isinstance(config.get('tasks'), list):
+        for task in config['tasks']:
+            if isinstance(task, dict):
+                task.setdefault('depends_on', [])
+    return config
+
+def normalize_agent_config(config):
+    '''Unwrap the config, tools is sometimes given as a comma separated string.'''
+    config = unwrap(config)
+    if isinstance(config, dict) and isinstance(config.get('tools'), str):
+        config['tools'] = [tool.strip() for tool in config['tools'].split(',') if tool.strip()]
+    return config
+
+def normalize_task_config(config):
+    return unwrap(config)
+
+
+def _parse(text, normalize, is_valid):
+    '''
+    Parse and validate a single config. Returns the config, or an error string, which makes
+    generate() go back to the model, so that only happens when no local repair worked.
+    '''
+    try:
+        config, repaired = parse_literal(text)
+    except ValueError as e:
+        _count('failed')
+        return f'Error parsing config: {e}'
+
+    if not is_valid(config):
+        fixed = normalize(config)
+        if not is_valid(fixed):
+            _count('invalid')
+            return f'Error: config does not match the expected schema: {config!r}'[:500]
+        config, repaired = fixed, True
+
+    _count('repaired' if repaired else 'clean')
+    return config
+
+def _parse_batch(text, normalize, is_valid):
+    '''
+    Parse a name -> config mapping, keeping only the entries that validate.
+    The rest are regenerated individually by the caller.
+    '''
+    try:
+        configs, repaired = parse_literal(text)
+    except ValueError as e:
+        _count('failed')
+        return f'Error parsing configs: {e}'
+    if not isinstance(configs, dict):
+        _count('invalid')
+        return f'Error: expected a dict of configs, got {type(configs).__name__}'
+
+    valid = {}
+    for name, config in configs.items():
+        if not is_valid(config):
+            config = normalize(config)
+            repaired = repaired or is_valid(config)
+        if is_valid(config):
+            valid[name] = config
+    _count('repaired' if repaired else 'clean')
+    return valid
+
+def parse_crew_config(text):
+    return _parse(text, normalize_crew_config, is_valid_crew_config)
+
+def parse_agent_config(text):
+    return _parse(text, normalize_agent_config, is_valid_agent_config)
+
+def parse_task_config(text):
+    return _parse(text, normalize_task_config, is_valid_task_config)
+
+def parse_agent_configs_batch(text):
+    return _parse_batch(text, normalize_agent_config, is_valid_agent_config)
+
+def parse_task_configs_batch(text):
+    return _parse_batch(text, normalize_task_config, is_valid_task_config)
+
+def parse_python_literal(text):
+    '''Parse any literal, for prompts without a schema. Returns an error string if it can't be parsed.'''
+    try:
+        value, repaired = parse_literal(text)
+    except ValueError as e:
+        _count('failed')
+        return f'Error evaluating code: {e}'
+    _count('repaired' if repaired else 'clean')
+    return value
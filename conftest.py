@@ -0,0 +1,2 @@
+# Puts the repository root on sys.path, so plain `pytest` can import the top-level modules
+# (config_parser, data_crew...) and the tools and benchmarks packages, like `python -m pytest`.
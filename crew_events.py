@@ -0,0 +1,181 @@
+import contextvars
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+# event types, in the order a task produces them
+TASK_STARTED = 'task_started'
+LLM_TOKEN = 'llm_token'
+PARTIAL_OUTPUT = 'partial_output'
+TOOL_CALL = 'tool_call'
+TASK_FINISHED = 'task_finished'
+TASK_FAILED = 'task_failed'
+CREW_FINISHED = 'crew_finished'
+CREW_FAILED = 'crew_failed'
+
+PREVIEW_CHARS = 500
+# crewai agents put the answer of a task after this marker
+FINAL_ANSWER = 'Final Answer:'
+
+# the task whose events are streamed in this context, and where they go
+_current_task = contextvars.ContextVar('crew_events_task', default=None)
+
+
+def preview(text, limit=PREVIEW_CHARS) -> str:
+    text = str(text)
+    if len(text) <= limit:
+        return text
+    return text[:limit] + f'... ({len(text)} characters)'
+
+def make_event(event_type, **fields) -> dict:
+    return {'type': event_type, 'time': time.time(), **fields}
+
+
+class TaskEventHandler(BaseCallbackHandler):
+    '''
+    Turns the token callbacks of a streaming chat model into events for one task: every
+    token as an llm_token event, and once the agent starts its final answer, the answer
+    so far as partial_output events.
+    '''
+
+    def __init__(self, task: str, emit: Callable[[dict], Any]):
+        self.task = task
+        self.emit = emit
+        self._text = ''
+        self._answer_start = None
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        self._text, self._answer_start = '', None
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], **kwargs: Any) -> None:
+        self._text, self._answer_start = '', None
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.emit(make_event(LLM_TOKEN, task=self.task, delta=token))
+        self._text += token
+        if self._answer_start is None:
+            marker = self._text.find(FINAL_ANSWER)
+            if marker == -1:
+                return
+            self._answer_start = marker + len(FINAL_ANSWER)
+            delta = self._text[self._answer_start:]
+        else:
+            delta = token
+        answer = self._text[self._answer_start:].lstrip()
+        if answer:
+            self.emit(make_event(PARTIAL_OUTPUT, task=self.task, delta=delta, text=answer))
+
+
+class NestedAgentEventHandler(BaseCallbackHandler):
+    '''
+    Callbacks for an agent running inside a tool (e.g. the nested SQL agent): every tool that
+    agent uses becomes a tool_call event of the task, with the outer tool as its parent.
+    '''
+
+    def __init__(self, task: str, emit: Callable[[dict], Any], parent: str):
+        self.task = task
+        self.emit = emit
+        self.parent = parent
+        self._tools = {}
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id, **kwargs: Any) -> None:
+        self._tools[run_id] = (serialized.get('name'), input_str)
+
+    def _emit(self, run_id, result):
+        tool, tool_input = self._tools.pop(run_id, (None, ''))
+        self.emit(make_event(
+            TOOL_CALL, task=self.task, tool=tool, input=preview(tool_input), result=preview(result), parent=self.parent
+        ))
+
+    def on_tool_end(self, output: Any, *, run_id, **kwargs: Any) -> None:
+        self._emit(run_id, output)
+
+    def on_tool_error(self, error: BaseException, *, run_id, **kwargs: Any) -> None:
+        self._emit(run_id, f'Error: {error}')
+
+
+def set_current_task(task: str, emit: Callable[[dict], Any]):
+    '''Mark the task running in this context, so the tools it calls can emit its events.'''
+    return _current_task.set((task, emit))
+
+def nested_callbacks(parent: str) -> Optional[list]:
+    '''Callbacks for an agent nested in the tool parent, or None if no task's events are being streamed.'''
+    current = _current_task.get()
+    if current is None:
+        return None
+    task, emit = current
+    return [NestedAgentEventHandler(task, emit, parent)]
+
+
+def with_handler(llm, handler):
+    '''A copy of a chat model that streams its tokens to handler, the original is shared and left alone.'''
+    values = dict(llm.__dict__, callbacks=list(llm.callbacks or []) + [handler])
+    if 'streaming' in llm.__fields__:
+        values['streaming'] = True
+    # construct rather than copy(), which drops the fields excluded from serialization (tags, the client...)
+    return type(llm).construct(**values)
+
+def step_callback(task: str, emit: Callable[[dict], Any], previous: Optional[Callable] = None):
+    '''A crewai step_callback that emits a tool_call event for every tool the agent used.'''
+    def callback(step_output):
+        if isinstance(step_output, list):
+            for action, observation in step_output:
+                emit(make_event(
+                    TOOL_CALL,
+                    task=task,
+                    tool=getattr(action, 'tool', None),
+                    input=preview(getattr(action, 'tool_input', '')),
+                    result=preview(observation),
+                ))
+        if previous is not None:
+            previous(step_output)
+    return callback
+
+def attach(agent_kwargs: dict, task: str, emit: Callable[[dict], Any]) -> dict:
+    '''
+    Wire the events of a task into the crewai Agent arguments of the agent running it. The
+    events take the place of the agent's console output, so it's made quiet.
+    '''
+    agent_kwargs['llm'] = with_handler(agent_kwargs['llm'], TaskEventHandler(task, emit))
+    agent_kwargs['step_callback'] = step_callback(task, emit, agent_kwargs.get('step_callback'))
+    agent_kwargs['verbose'] = False
+    return agent_kwargs
+
+
+def stream(run, *args, **kwargs):
+    '''
+    Run run(*args, on_event=..., **kwargs) on a background thread and yield its events as
+    they happen, ending with a crew_finished event carrying the return value as 'outputs'.
+    If the run fails, a crew_failed event is yielded and then the exception is raised.
+    Stopping the iteration early doesn't stop the run, its remaining events are dropped.
+    '''
+    events = queue.Queue()
+    done = object()
+    outcome = {}
+
+    def target():
+        try:
+            outcome['outputs'] = run(*args, on_event=events.put, **kwargs)
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            events.put(done)
+
+    start = time.perf_counter()
+    threading.Thread(target=contextvars.copy_context().run, args=(target,), daemon=True, name='crew-stream').start()
+    while True:
+        event = events.get()
+        if event is done:
+            break
+        yield event
+
+    seconds = time.perf_counter() - start
+    if 'error' in outcome:
+        error = outcome['error']
+        yield make_event(CREW_FAILED, error=f'{type(error).__name__}: {error}', seconds=seconds)
+        raise error
+    yield make_event(CREW_FINISHED, outputs=outcome['outputs'], seconds=seconds)
@@ -1,73 +1,195 @@
 import os
-import re
 import sys
+import ast
+import json
+import time
+import hashlib
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 sys.path.append('..')
-from crewai import Agent, Task, Crew, Process
-from langchain.tools import StructuredTool
-from langchain_community.tools import DuckDuckGoSearchRun
-from langchain_community.retrievers import ArxivRetriever
-from langchain_experimental.tools import PythonREPLTool
-from langchain_community.agent_toolkits import SQLDatabaseToolkit
-from langchain.sql_database import SQLDatabase
-from langchain_community.agent_toolkits import create_sql_agent
-from langchain_openai import ChatOpenAI
-from pydantic.v1 import BaseModel, Field
 
 from Bronco import bronco
 from prompts import CrewGenPrompts
+from llm_cache import cache_from_env
+from tool_registry import default_registry
+import config_parser
+from config_parser import is_valid_crew_config, is_valid_agent_config, is_valid_task_config
+import tracing
+import llm_scheduler
 
-from tools.sql_tool import build_sql_tool
+# crewai and the langchain tools are imported lazily (in initialize_from_config and the
+# tool registry), importing them dominates startup and many runs never need all of them
+
+# on-disk cache of parsed LLM responses, shared by all of the config generators
+llm_cache = cache_from_env()
+# completion tokens a config generation is charged by the LLM scheduler up front, corrected once it's done
+GENERATION_TOKEN_ESTIMATE = 1000
+
+def save_config(config, config_file):
+    with open(config_file, 'w') as f:
+        json.dump(config, f, indent=4)
+
+def load_config(config_file):
+    '''
+    Load a saved config. Configs are saved as JSON, older configs saved as
+    Python literals are still read, but with ast.literal_eval rather than eval.
+    '''
+    with open(config_file, 'r') as f:
+        text = f.read()
+    try:
+        return json.loads(text)
+    except ValueError:
+        return ast.literal_eval(text)
 
 def review_config(config, keep_file=False) -> str:
     
     # write the config to a file
-    with open('crew_config.py', 'w') as f:
-        f.write(str(config))
+    save_config(config, 'crew_config.json')
     
     # open the file in vim
-    os.system('vim crew_config.py')
+    os.system('vim crew_config.json')
     
     # read the reviewed file back into memory
-    with open('crew_config.py', 'r') as f:
-        reviewed_config = f.read()
+    reviewed_config = load_config('crew_config.json')
     
     # delete the file
     if not keep_file:
-        os.system('rm crew_config.py')
+        os.remove('crew_config.json')
     
-    return eval(reviewed_config)
+    return reviewed_config
 
 def extract_python_code(text):
-    # Regular expression pattern to find the first code block marked as Python code
-    pattern = r'```python(.*?)```'
-    match = re.search(pattern, text, re.DOTALL)
-    
-    # If a match is not found, return the whole text string
-    if not match:
-        return text
-    
-    code = match.group(1).strip()  # Use .strip() to remove leading/trailing whitespace
+    '''
+    Parse the Python literal in the first ```python block of a completion (or the whole text).
+    Literals are parsed with ast.literal_eval, never executed, and small defects are repaired locally.
+    '''
+    return config_parser.parse_python_literal(text)
+
+# estimated token usage of the config generators, per generation mode ('per_item' or 'batched')
+token_usage = {}
+token_usage_lock = threading.Lock()
+generation_mode = contextvars.ContextVar('generation_mode', default='per_item')
+
+@contextmanager
+def using_generation_mode(mode):
+    token = generation_mode.set(mode)
     try:
-        # Here, eval is not safe to use directly without proper context and validation
-        return eval(code)
-    except Exception as e:
-        return f"Error evaluating code: {e}"
-    
+        yield
+    finally:
+        generation_mode.reset(token)
 
+def record_token_usage(calls=0, cache_hits=0, prompt_tokens=0, completion_tokens=0):
+    with token_usage_lock:
+        usage = token_usage.setdefault(
+            generation_mode.get(),
+            {'calls': 0, 'cache_hits': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        )
+        usage['calls'] += calls
+        usage['cache_hits'] += cache_hits
+        usage['prompt_tokens'] += prompt_tokens
+        usage['completion_tokens'] += completion_tokens
+
+def print_token_usage():
+    print(f'{"mode":<10} {"calls":>6} {"cache hits":>10} {"prompt tokens":>14} {"completion tokens":>18}')
+    for mode, usage in token_usage.items():
+        print(
+            f'{mode:<10} {usage["calls"]:>6} {usage["cache_hits"]:>10} '
+            f'{usage["prompt_tokens"]:>14} {usage["completion_tokens"]:>18}'
+        )
+    stats = config_parser.parse_stats
+    print(
+        f'config parsing: {stats["clean"]} clean, {stats["repaired"]} repaired locally (LLM retries avoided), '
+        f'{stats["invalid"] + stats["failed"]} sent back to the model'
+    )
+
+# bumps whenever any of the crew generation prompts change, so stale configs get regenerated
+PROMPT_VERSION = hashlib.sha256(
+    json.dumps({name: value for name, value in sorted(vars(CrewGenPrompts).items()) if isinstance(value, str)}).encode('utf-8')
+).hexdigest()[:12]
+
+def config_fingerprint(*inputs):
+    '''A hash of everything a generated config entry depends on, including the prompt version.'''
+    payload = json.dumps([PROMPT_VERSION, *inputs], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def prompt_name(prompt_template):
+    '''The CrewGenPrompts attribute name of a prompt template, for tracing.'''
+    for name, value in vars(CrewGenPrompts).items():
+        if value is prompt_template:
+            return name
+    return 'custom_prompt'
 
-def generate_crew_config(objective, tool_names):
-    crew_generator = bronco.LLMFunction(
+def generate(prompt_template, inputs, parser=extract_python_code, success_func=None, model_name=bronco.GPT_4, use_cache=True):
+    '''
+    Run a bronco.LLMFunction, answering from the on-disk LLM response cache when possible.
+    Pass use_cache=False (or set LLM_CACHE_BYPASS=1) to always call the model.
+    '''
+    with tracing.span('llm.generate', prompt=prompt_name(prompt_template), model=model_name) as span:
+        cache = llm_cache if use_cache else None
+        if cache is not None:
+            key = cache.make_key(prompt_template, inputs, model_name, parser)
+            hit, value = cache.get(key)
+            if hit:
+                span.set(cache='hit')
+                record_token_usage(cache_hits=1)
+                return value
+        span.set(cache='miss' if cache is not None else 'bypass')
+        
+        # keep the raw completions so we can count their tokens, bronco may retry several times
+        completions = []
+        def tracked_parser(text):
+            completions.append(text)
+            return parser(text)
+        
+        generator_kwargs = {
+            'prompt_template': prompt_template,
+            'model_name': model_name,
+            'parser': tracked_parser
+        }
+        if success_func is not None:
+            generator_kwargs['success_func'] = success_func
+        try:
+            prompt_tokens = tracing.estimate_tokens(prompt_template.format(**inputs))
+        except (KeyError, IndexError, ValueError):
+            prompt_tokens = tracing.estimate_tokens(prompt_template)
+        
+        # config generation is background work, crew steps waiting on the model go first
+        def used_tokens(result):
+            return prompt_tokens * max(len(completions), 1) + sum(tracing.estimate_tokens(text) for text in completions)
+        result = llm_scheduler.shared_scheduler.call(
+            lambda: bronco.LLMFunction(**generator_kwargs).generate(inputs),
+            priority=llm_scheduler.BACKGROUND,
+            estimated_tokens=prompt_tokens + GENERATION_TOKEN_ESTIMATE,
+            used_tokens=used_tokens,
+        )
+        
+        prompt_tokens *= max(len(completions), 1)
+        completion_tokens = sum(tracing.estimate_tokens(text) for text in completions)
+        record_token_usage(calls=max(len(completions), 1), prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        span.set(attempts=len(completions), prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        
+        # only cache results that parsed, parse errors come back as strings
+        if cache is not None and isinstance(result, (dict, list)):
+            if success_func is None or success_func(result):
+                cache.set(key, result)
+        
+        return result
+
+def generate_crew_config(objective, tool_names, use_cache=True):
+    return generate(
         prompt_template=CrewGenPrompts.generate_crew_config_prompt,
-        model_name=bronco.GPT_4,
-        parser=extract_python_code
-     )
-    
-    return crew_generator.generate({
-        'objective': objective,
-        'tool_names': tool_names
-    })
+        inputs={
+            'objective': objective,
+            'tool_names': tool_names
+        },
+        parser=config_parser.parse_crew_config,
+        success_func=is_valid_crew_config,
+        use_cache=use_cache
+    )
 
-def generate_agent_config(name, objective, agent_tasks, tool_names):
+def generate_agent_config(name, objective, agent_tasks, tool_names, use_cache=True):
     """
     Generates an agent configuration for a Senior Research Analyst role with specific tasks and tools.
     
@@ -75,33 +197,33 @@ def generate_agent_config(name, objective, agent_tasks, tool_names):
     - name (str): The name of the agent.
     - agent_tasks (list): A list of tasks that the agent is responsible for.
     - tool_names (list): A list of tools that the agent has access to.
+    - use_cache (bool): Whether to use the on-disk LLM response cache.
     
     Returns:
     - dict: The generated agent configuration.
     """
 
-    
-    agent_config_generator = bronco.LLMFunction(
+    # Generating agent configuration using the extracted values
+    agent_config = generate(
         prompt_template=CrewGenPrompts.gen_agent_config_prompt,
-        model_name=bronco.GPT_4,
-        parser=extract_python_code,
+        inputs={
+            'name': name,
+            'objective': objective,
+            'agent_tasks': agent_tasks,
+            'tool_names': tool_names
+        },
+        parser=config_parser.parse_agent_config,
+        success_func=is_valid_agent_config,
+        use_cache=use_cache
     )
         
-    # Generating agent configuration using the extracted values
-    agent_config = agent_config_generator.generate({
-        'name': name,
-        'objective': objective,
-        'agent_tasks': agent_tasks,
-        'tool_names': tool_names
-    })
-        
     agent_config.update({'name': name})
     
     print(agent_config['name'])
     
     return agent_config
 
-def generate_task_config(task_description, objective, agent_dict):
+def generate_task_config(task_description, objective, agent_dict, use_cache=True):
     """
     Generates a task configuration for creating a report on houseplant trends in the US in 2023.
     
@@ -109,6 +231,7 @@ def generate_task_config(task_description, objective, agent_dict):
     - task_description (str): A brief description of the task.
     - objective (str): A detailed objective of what the report should cover.
     - agent_dict (dict): A dictionary containing the agent data.
+    - use_cache (bool): Whether to use the on-disk LLM response cache.
     
     Returns:
     - dict: The generated task configuration.
@@ -119,95 +242,348 @@ def generate_task_config(task_description, objective, agent_dict):
     agent_role = agent_dict['role']
     tool_names = agent_dict.get('tool_names', [])
     
-    task_config_generator = bronco.LLMFunction(
+    # Generating task configuration using the extracted values
+    task_config = generate(
         prompt_template=CrewGenPrompts.gen_task_config_prompt,
-        model_name=bronco.GPT_4,
-        parser=extract_python_code,
-        success_func=lambda x: 'description' in x and 'agent' in x
+        inputs={
+            'task_description': task_description,
+            'agent_role': agent_role,
+            'objective': objective,
+            'tool_names': tool_names
+        },
+        parser=config_parser.parse_task_config,
+        success_func=is_valid_task_config,
+        use_cache=use_cache
     )
     
-    # Generating task configuration using the extracted values
-    task_config = task_config_generator.generate({
-        'task_description': task_description,
-        'agent_role': agent_role,
-        'objective': objective,
-        'tool_names': tool_names
-    })
-    
     task_config.update({'name': agent_name})
     
     return task_config
 
-def create_full_config(objective, tools, review_intermediate=True, keep_final_config=False):
+def generate_agent_configs_batch(objective, agent_tasks, tool_names, use_cache=True):
     '''
-    Create a full config for a crew based on an objective and a list of tools.
+    Generate the configs for all agents in a single completion.
+    
+    Parameters:
+    - objective (str): The overall objective of the crew.
+    - agent_tasks (dict): Agent name -> list of the tasks that agent is responsible for.
+    - tool_names (list): A list of tools that the agents have access to.
+    
+    Returns:
+    - dict: Agent name -> generated config, for the entries that could be parsed. Entries may still need validating.
     '''
-    tool_names = [tool.name for tool in tools]
+    agent_configs = generate(
+        prompt_template=CrewGenPrompts.gen_agent_configs_batch_prompt,
+        inputs={
+            'objective': objective,
+            'agent_tasks': agent_tasks,
+            'tool_names': tool_names
+        },
+        parser=config_parser.parse_agent_configs_batch,
+        use_cache=use_cache
+    )
+    return agent_configs if isinstance(agent_configs, dict) else {}
+
+def generate_task_configs_batch(objective, tasks, agents, use_cache=True):
+    '''
+    Generate the configs for all tasks in a single completion.
     
-    print('Generating crew config...')
-    crew_config = generate_crew_config(objective, tool_names)
+    Parameters:
+    - objective (str): The overall objective of the crew.
+    - tasks (list): The crew plan's tasks, dicts with 'task' and 'agent' keys.
+    - agents (dict): Agent name -> agent config.
     
-    if review_intermediate:
-        crew_config = review_config(crew_config)
-        
-    # Create a config for each agent in the config
-    agents = []
-    for agent_name in crew_config['agents']:
-        print(f'Generating agent config for {agent_name}...')
-        agent_tasks = [task['task'] for task in crew_config['tasks'] if task['agent'] == agent_name]
-        agent_config = generate_agent_config(
-            name=agent_name, 
-            objective=objective,
-            agent_tasks=agent_tasks, 
-            tool_names=tool_names
+    Returns:
+    - dict: Task name -> generated config, for the entries that could be parsed. Entries may still need validating.
+    '''
+    task_configs = generate(
+        prompt_template=CrewGenPrompts.gen_task_configs_batch_prompt,
+        inputs={
+            'objective': objective,
+            'tasks': [
+                {
+                    'task': task['task'],
+                    'agent_role': agents[task['agent']]['role'],
+                    'tool_names': agents[task['agent']].get('tool_names', [])
+                }
+                for task in tasks
+            ]
+        },
+        parser=config_parser.parse_task_configs_batch,
+        use_cache=use_cache
+    )
+    return task_configs if isinstance(task_configs, dict) else {}
+
+def run_concurrently(func, kwargs_list, max_workers=4, retries=2, retry_delay=1.0):
+    '''
+    Call func once per kwargs dict in kwargs_list on a bounded thread pool.
+    
+    Results are returned in the same order as kwargs_list. Each call is retried
+    on its own, so one failing call doesn't affect the others; if a call still
+    fails after all retries, its exception is raised once every call has finished.
+    '''
+    
+    def call_with_retries(kwargs):
+        for attempt in range(retries + 1):
+            try:
+                return func(**kwargs)
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                print(f'{func.__name__} failed ({e}), retrying...')
+                time.sleep(retry_delay * (2 ** attempt))
+    
+    if max_workers <= 1:
+        return [call_with_retries(kwargs) for kwargs in kwargs_list]
+    
+    # each call runs in a copy of the caller's context, so trace spans nest under the caller's span
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, call_with_retries, kwargs)
+            for kwargs in kwargs_list
+        ]
+    
+    # the executor has joined, so every call has either succeeded or exhausted its retries
+    return [future.result() for future in futures]
+
+def regenerate_invalid(batch_results, keys, func, kwargs_list, is_valid, max_workers, retries):
+    '''
+    Take the valid entries of a batched generation, and regenerate only the missing or
+    invalid ones one at a time (concurrently). Returns the configs in the order of keys.
+    '''
+    configs = [batch_results.get(key) for key in keys]
+    invalid = [i for i, config in enumerate(configs) if not (isinstance(config, dict) and is_valid(config))]
+    if invalid:
+        print(f'Regenerating {len(invalid)} of {len(keys)} entries individually: {[keys[i] for i in invalid]}')
+        regenerated = run_concurrently(
+            func,
+            [kwargs_list[i] for i in invalid],
+            max_workers=max_workers,
+            retries=retries
         )
-        agents.append(agent_config)
+        for i, config in zip(invalid, regenerated):
+            configs[i] = config
+    return configs
+
+def generate_missing(missing, keys, generate_one, kwargs_list, generate_batch, is_valid, mode, max_workers, retries):
+    '''
+    Generate the config entries at the indices in missing, one per completion or batched.
+    Returns a dict of index -> config.
+    '''
+    if not missing:
+        return {}
+    
+    missing_keys = [keys[i] for i in missing]
+    missing_kwargs = [kwargs_list[i] for i in missing]
+    if mode == 'batched':
+        configs = regenerate_invalid(
+            generate_batch(missing_keys),
+            missing_keys,
+            generate_one,
+            missing_kwargs,
+            is_valid,
+            max_workers,
+            retries
+        )
+    else:
+        configs = run_concurrently(generate_one, missing_kwargs, max_workers=max_workers, retries=retries)
+    return dict(zip(missing, configs))
+
+def reuse_previous(fingerprints, previous_entries):
+    '''Copies of the previous entries whose fingerprint matches, None where an entry has to be regenerated.'''
+    previous = {entry.get('fingerprint'): entry for entry in previous_entries}
+    return [
+        json.loads(json.dumps(previous[fingerprint])) if fingerprint in previous else None
+        for fingerprint in fingerprints
+    ]
+
+def create_full_config(objective, tools, review_intermediate=True, keep_final_config=False, max_workers=4, retries=2, use_cache=True, mode='per_item', previous_config=None, save_path=None, review_final=True):
+    '''
+    Create a full config for a crew based on an objective and a list of tools.
+    tools can be tool objects or tool names, names don't need the tools to be built.
+    
+    In 'per_item' mode, agent configs are generated concurrently, then task configs are generated
+    concurrently, using at most max_workers simultaneous LLM calls. Set max_workers=1 to generate them one at a time.
+    In 'batched' mode, all agent configs are generated in one completion and all task configs in another,
+    and only the entries that fail validation are regenerated individually.
+    Estimated token usage per mode is kept in token_usage.
+    Set use_cache=False to bypass the on-disk LLM response cache.
+    
+    Every entry of the config carries a fingerprint of its inputs (objective, task names, tool names
+    and prompt version). Given a previous_config (a config or the path of a saved one), entries whose
+    fingerprint is unchanged are reused and only the rest are regenerated. If save_path is given,
+    the final config is saved there as JSON.
+    
+    The final config is opened in an editor for review unless review_final=False, together with
+    review_intermediate=False that makes the whole call non-interactive.
+    '''
+    if mode not in ('per_item', 'batched'):
+        raise ValueError(f"mode must be 'per_item' or 'batched', not {mode!r}")
+    if isinstance(previous_config, str):
+        previous_config = load_config(previous_config) if os.path.exists(previous_config) else None
+    previous_config = previous_config or {}
+    
+    with tracing.span('create_full_config', objective=objective[:80], max_workers=max_workers, mode=mode), using_generation_mode(mode):
+        tool_names = [getattr(tool, 'name', tool) for tool in tools]
         
-    if review_intermediate:
-        agents = review_config(agents)
-                    
-    # Create a config for each task in the config
-    tasks = []
-    for task in crew_config['tasks']:
-        print(f'Generating task config for {task["task"]}...')
-        task_agent = [agent for agent in agents if agent['name'] == task['agent']][0]
-        task_description = task['task']
+        plan_fingerprint = config_fingerprint('crew', objective, tool_names)
+        previous_plan = previous_config.get('crew_plan', {})
+        if previous_plan.get('fingerprint') == plan_fingerprint:
+            print('Reusing crew config...')
+            crew_config = {'agents': previous_plan['agents'], 'tasks': previous_plan['tasks']}
+        else:
+            print('Generating crew config...')
+            crew_config = generate_crew_config(objective, tool_names, use_cache=use_cache)
+    
+        if review_intermediate:
+            crew_config = review_config(crew_config)
+        crew_plan = {'fingerprint': plan_fingerprint, **crew_config}
         
-        task_config = generate_task_config(
-            task_description=task_description,
-            objective=objective, 
-            agent_dict=task_agent
+        # Create a config for each agent in the config
+        agent_names = crew_config['agents']
+        agent_tasks = {
+            agent_name: [task['task'] for task in crew_config['tasks'] if task['agent'] == agent_name]
+            for agent_name in agent_names
+        }
+        agent_kwargs = [
+            {
+                'name': agent_name,
+                'objective': objective,
+                'agent_tasks': agent_tasks[agent_name],
+                'tool_names': tool_names,
+                'use_cache': use_cache
+            }
+            for agent_name in agent_names
+        ]
+        agent_fingerprints = [
+            config_fingerprint('agent', objective, agent_name, agent_tasks[agent_name], tool_names)
+            for agent_name in agent_names
+        ]
+        agents = reuse_previous(agent_fingerprints, previous_config.get('agents', []))
+        missing = [i for i, agent in enumerate(agents) if agent is None]
+        print(f'Generating agent configs for {[agent_names[i] for i in missing]}, reusing {len(agents) - len(missing)}...')
+        generated = generate_missing(
+            missing,
+            agent_names,
+            generate_agent_config,
+            agent_kwargs,
+            lambda names: generate_agent_configs_batch(
+                objective, {name: agent_tasks[name] for name in names}, tool_names, use_cache=use_cache
+            ),
+            is_valid_agent_config,
+            mode,
+            max_workers,
+            retries
         )
+        for i, agent_config in generated.items():
+            agent_config.update({'name': agent_names[i], 'fingerprint': agent_fingerprints[i]})
+            agents[i] = agent_config
         
+        if review_intermediate:
+            agents = review_config(agents)
+                    
+        # Create a config for each task in the config
+        task_names = [task['task'] for task in crew_config['tasks']]
+        task_agents = [
+            [agent for agent in agents if agent['name'] == task['agent']][0]
+            for task in crew_config['tasks']
+        ]
+        task_kwargs = [
+            {
+                'task_description': task['task'],
+                'objective': objective,
+                'agent_dict': task_agent,
+                'use_cache': use_cache
+            }
+            for task, task_agent in zip(crew_config['tasks'], task_agents)
+        ]
+        task_fingerprints = [
+            config_fingerprint('task', objective, task['task'], task_agent.get('fingerprint'), task_agent['role'])
+            for task, task_agent in zip(crew_config['tasks'], task_agents)
+        ]
+        tasks = reuse_previous(task_fingerprints, previous_config.get('tasks', []))
+        missing = [i for i, task in enumerate(tasks) if task is None]
+        print(f'Generating task configs for {[task_names[i] for i in missing]}, reusing {len(tasks) - len(missing)}...')
+        generated = generate_missing(
+            missing,
+            task_names,
+            generate_task_config,
+            task_kwargs,
+            lambda names: generate_task_configs_batch(
+                objective,
+                [task for task in crew_config['tasks'] if task['task'] in names],
+                {agent['name']: agent for agent in agents},
+                use_cache=use_cache
+            ),
+            is_valid_task_config,
+            mode,
+            max_workers,
+            retries
+        )
+        for i, task_config in generated.items():
+            task_config.update({'fingerprint': task_fingerprints[i]})
+            tasks[i] = task_config
+    
         # string agent names need to be replaced with pointers to the agent objects
         # occurs during crew initialization, to ensure that we have a serializable config
-        task_config.update({'agent': task_agent['name']})
-                
-        tasks.append(task_config)
-    
-    if review_intermediate:
-        tasks = review_config(tasks)
-    # create the full config
-    crew_config = {
-        'agents': agents,
-        'tasks': tasks
-    }
-    
-    # Allow the user to review the fully formed config
-    review_config(crew_config, keep_file=keep_final_config)
+        for task_config, task, task_agent in zip(tasks, crew_config['tasks'], task_agents):
+            task_config.update({
+                'name': task_agent['name'],
+                'agent': task_agent['name'],
+                'task': task['task'],
+                'depends_on': task.get('depends_on', [])
+            })
+    
+        if review_intermediate:
+            tasks = review_config(tasks)
+        # create the full config
+        crew_config = {
+            'crew_plan': crew_plan,
+            'agents': agents,
+            'tasks': tasks
+        }
+    
+        # Allow the user to review the fully formed config
+        if review_final:
+            crew_config = review_config(crew_config, keep_file=keep_final_config)
+        
+        if save_path is not None:
+            save_config(crew_config, save_path)
     
-    return crew_config
+        return crew_config
+
+
+# keys the generated configs use for bookkeeping, they aren't crewai arguments
+CONFIG_ONLY_KEYS = ('task', 'depends_on', 'fingerprint')
 
+def crewai_kwargs(config_entry):
+    return {key: value for key, value in config_entry.items() if key not in CONFIG_ONLY_KEYS}
 
-def initialize_from_config(config, verbose=2):
+def agent_kwargs(agent_config):
+    '''crewai Agent arguments for an agent config, with a client that goes through the LLM scheduler unless the config brings its own.'''
+    kwargs = crewai_kwargs(agent_config)
+    if 'llm' not in kwargs:
+        from tools.db_registry import get_llm
+        # the model and temperature crewai agents default to
+        kwargs['llm'] = get_llm(os.environ.get('OPENAI_MODEL_NAME', 'gpt-4'), temperature=0.7)
+    return kwargs
+
+def initialize_from_config(config, verbose=2, tools=None, registry=default_registry):
     '''
     Initialize a Crew object from a configuration dictionary.
+    
+    Agent tools are looked up in tools if given, otherwise they're built lazily from the
+    registry, so only the tools an agent config references are ever imported or constructed.
     '''
+    from crewai import Agent, Task, Crew
     
     # agent tools need to be a pointer to the object, not a string
     for agent in config['agents']:
-        agent['tools'] = [tool for tool in tools if tool.name in agent['tools']]
-    agent_objects = [Agent(**agent) for agent in config['agents']]
+        if tools is not None:
+            agent['tools'] = [tool for tool in tools if tool.name in agent['tools']]
+        else:
+            agent['tools'] = registry.resolve(agent['tools'])
+    agent_objects = [Agent(**agent_kwargs(agent)) for agent in config['agents']]
     
     # the task agent needs to pe a pointer to the object, not a string
     agent_string_to_object = {}
@@ -215,7 +591,7 @@ def initialize_from_config(config, verbose=2):
         agent_string_to_object[agent_str['name']] = agent_obj
     for task in config['tasks']:
         task['agent'] = agent_string_to_object[task['agent']]
-    task_objects = [Task(**task) for task in config['tasks']]
+    task_objects = [Task(**crewai_kwargs(task)) for task in config['tasks']]
     
     crew = Crew(
         agents=agent_objects, 
@@ -225,11 +601,194 @@ def initialize_from_config(config, verbose=2):
     
     return crew
 
-def initialize_crew_from_saved_config(config_file, verbose=2):
-    with open(config_file, 'r') as f:
-        config = f.read()
+def task_dependencies(config) -> dict:
+    '''
+    Map each task name to the names of the tasks it depends on.
+    Unknown dependencies are dropped, and a cycle raises a ValueError.
+    '''
+    names = [task.get('task', f'task_{i}') for i, task in enumerate(config['tasks'])]
+    dependencies = {}
+    for name, task in zip(names, config['tasks']):
+        unknown = [dep for dep in task.get('depends_on', []) if dep not in names]
+        if unknown:
+            print(f'Ignoring unknown dependencies {unknown} of task {name}')
+        dependencies[name] = [dep for dep in task.get('depends_on', []) if dep in names and dep != name]
+    
+    # depth-first search for cycles
+    state = {}
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f'Task dependencies contain a cycle: {" -> ".join(path + [name])}')
+        state[name] = 'visiting'
+        for dep in dependencies[name]:
+            visit(dep, path + [name])
+        state[name] = 'done'
+    for name in names:
+        visit(name, [])
+    
+    return dependencies
+
+def run_crew_dag(config, max_workers=4, verbose=True, tools=None, registry=default_registry, on_event=None):
+    '''
+    Run the tasks of a crew config as a dependency graph instead of one after another.
+    
+    A task starts as soon as every task in its 'depends_on' list has finished, and receives their
+    outputs as context. Independent tasks run concurrently on up to max_workers threads, so
+    wall-clock time follows the critical path rather than the number of tasks.
+    Returns a dict of task name -> output, in config order.
+    
+    on_event, if given, is called with a dict for everything that happens along the way (see
+    crew_events): tasks starting, finishing and failing, tool calls, and the agents' tokens and
+    partial answers as they stream in, including the steps of agents nested in tools (the SQL
+    tool's). It's called from the task threads. Only DAG runs emit events, crews run with
+    kickoff_with_tracing just print their progress.
+    '''
+    from crewai import Agent, Task
+    if on_event is not None:
+        import crew_events
+    
+    dependencies = task_dependencies(config)
+    task_configs = {
+        task.get('task', f'task_{i}'): task for i, task in enumerate(config['tasks'])
+    }
+    agent_configs = {agent['name']: agent for agent in config['agents']}
+    
+    def build_task(name):
+        # every task gets its own agent object, crewai agents aren't safe to share across threads
+        agent_config = dict(agent_configs[task_configs[name]['agent']])
+        if tools is not None:
+            agent_config['tools'] = [tool for tool in tools if tool.name in agent_config['tools']]
+        else:
+            agent_config['tools'] = registry.resolve(agent_config['tools'])
+        task_config = crewai_kwargs(task_configs[name])
+        kwargs = agent_kwargs(agent_config)
+        if on_event is not None:
+            kwargs = crew_events.attach(kwargs, name, on_event)
+        task_config['agent'] = Agent(**kwargs)
+        return Task(**task_config)
+    
+    def run_task(name, context):
+        with tracing.span('crew.task', task=name, depends_on=dependencies[name]):
+            if verbose:
+                print(f'Starting task {name}...')
+            if on_event is not None:
+                # each task runs in its own copy of the context, the tools it calls see this
+                crew_events.set_current_task(name, on_event)
+                on_event(crew_events.make_event(
+                    crew_events.TASK_STARTED, task=name, agent=task_configs[name]['agent'], depends_on=dependencies[name]
+                ))
+            start = time.perf_counter()
+            try:
+                output = build_task(name).execute(context=context)
+            except Exception as e:
+                if on_event is not None:
+                    on_event(crew_events.make_event(crew_events.TASK_FAILED, task=name, error=f'{type(e).__name__}: {e}'))
+                raise
+            if on_event is not None:
+                on_event(crew_events.make_event(
+                    crew_events.TASK_FINISHED, task=name, output=output, seconds=time.perf_counter() - start
+                ))
+            if verbose:
+                print(f'Finished task {name}')
+            return output
+    
+    outputs = {}
+    pending = dict(dependencies)
+    with tracing.span('crew.run_dag', tasks=len(pending), max_workers=max_workers):
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+            error = None
+            while pending or running:
+                if error is None:
+                    ready = [name for name, deps in pending.items() if all(dep in outputs for dep in deps)]
+                    for name in ready:
+                        context = '\n\n'.join(
+                            f'Output of {dep}:\n{outputs[dep]}' for dep in dependencies[name]
+                        ) or None
+                        future = executor.submit(contextvars.copy_context().run, run_task, name, context)
+                        running[future] = name
+                        del pending[name]
+                elif not running:
+                    break
+                
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        outputs[name] = future.result()
+                    except Exception as e:
+                        # let the running tasks finish, but don't start anything new
+                        print(f'Task {name} failed: {e}')
+                        error = error or e
+            
+            if error is not None:
+                raise error
+    
+    return {name: outputs[name] for name in task_configs}
+
+def stream_crew_dag(config, **kwargs):
+    '''
+    Run a crew config like run_crew_dag, yielding its events as they happen instead of
+    returning at the end. Streaming always runs the config as a DAG. The last event is
+    crew_finished, with the task outputs:
     
-    return initialize_from_config(eval(config), verbose=verbose)
+        for event in stream_crew_dag(crew_config):
+            if event['type'] == 'task_finished':
+                handle_section(event['task'], event['output'])
+    '''
+    import crew_events
+    # the events say when tasks start and finish, printing it too would mix into the stream
+    kwargs.setdefault('verbose', False)
+    return crew_events.stream(run_crew_dag, config, **kwargs)
+
+def kickoff_with_tracing(crew):
+    '''
+    Run crew.kickoff() inside a trace span, recording a span per finished task and per agent step.
+    
+    crewai only tells us when a task or step has finished, so each one is timed from the end
+    of the one before it. That's exact for the sequential process.
+    '''
+    if not tracing.is_enabled():
+        return crew.kickoff()
+    
+    with tracing.span('crew.kickoff', tasks=len(crew.tasks)):
+        last_task_end = [time.perf_counter()]
+        last_step_end = [last_task_end[0]]
+        
+        def step_callback(step_output):
+            now = time.perf_counter()
+            attributes = {}
+            if isinstance(step_output, list) and step_output:
+                action, observation = step_output[-1]
+                attributes = {'tool': getattr(action, 'tool', None), 'observation_tokens': tracing.estimate_tokens(observation)}
+            tracing.record_span('crew.agent_step', last_step_end[0], now, **attributes)
+            last_step_end[0] = now
+        
+        def make_task_callback(task, previous_callback):
+            def task_callback(output):
+                now = time.perf_counter()
+                tracing.record_span(
+                    'crew.task', last_task_end[0], now,
+                    agent=task.agent.role if task.agent is not None else None,
+                    description=task.description[:80],
+                    output_tokens=tracing.estimate_tokens(output.result)
+                )
+                last_task_end[0] = now
+                last_step_end[0] = now
+                if previous_callback is not None:
+                    previous_callback(output)
+            return task_callback
+        
+        crew.step_callback = step_callback
+        for task in crew.tasks:
+            task.callback = make_task_callback(task, task.callback)
+        
+        return crew.kickoff()
+
+def initialize_crew_from_saved_config(config_file, verbose=2, tools=None):
+    return initialize_from_config(load_config(config_file), verbose=verbose, tools=tools)
 
 
 
@@ -242,23 +801,36 @@ if __name__ == '__main__':
         '\n- cabin class'
     )
     
-    sql_agent_tool = build_sql_tool(
-        db_uri='sqlite:///./spaceship_titanic.db', 
-        name='query_sql_db_tool', 
-        description='Runs a sql query against the spaceship titanic database and returns the results.'
-    )
-    tools = [sql_agent_tool, PythonREPLTool()]
+    # tools are declared by name, they're only built when the crew is initialized
+    tools = ['query_sql_db_tool', 'Python_REPL']
     
     print('Objective: ', objective)
-    print('Tools: ', [tool.name for tool in tools])
+    print('Tools: ', tools)
         
     crew_config = create_full_config(
         objective=objective,
         tools=tools, 
         review_intermediate=False,
-        keep_final_config=True
+        keep_final_config=True,
+        # only regenerate the parts of the last config whose inputs changed
+        previous_config='crew_config.json',
+        save_path='crew_config.json'
     )
     
-    crew = initialize_from_config(crew_config)
-    
-    crew.kickoff()
\ No newline at end of file
+    if llm_cache is not None:
+        print('LLM cache: ', llm_cache.stats())
+    print_token_usage()
+    
+    if '--dag' in sys.argv:
+        # run independent tasks in parallel, following the generated task dependencies
+        outputs = run_crew_dag(crew_config)
+        print(list(outputs.values())[-1])
+    else:
+        crew = initialize_from_config(crew_config)
+        kickoff_with_tracing(crew)
+    llm_scheduler.shared_scheduler.print_metrics()
+    
+    if tracing.is_enabled():
+        tracing.export_jsonl('crew_trace.jsonl')
+        tracing.export_chrome_trace('crew_trace.json')
+        tracing.print_summary()
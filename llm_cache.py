@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def _callable_identity(func) -> str:
+    '''A stable name for a parser/callable, used as part of the cache key.'''
+    if func is None:
+        return 'None'
+    module = getattr(func, '__module__', None) or ''
+    name = getattr(func, '__qualname__', None) or getattr(func, '__name__', None) or repr(func)
+    return f'{module}.{name}'
+
+
+class LLMResponseCache:
+    '''
+    Persistent, content-addressed cache of parsed LLM responses, stored in a local SQLite file.
+
+    Entries are keyed on the prompt template, the rendered inputs, the model name and the parser,
+    so any change to one of them is a miss. The cache is kept under max_entries / max_bytes by
+    evicting the least recently used entries, and entries older than max_age_seconds are dropped.
+    '''
+
+    def __init__(self, path='.llm_cache.sqlite', max_entries=5000, max_bytes=100 * 1024 * 1024, max_age_seconds=30 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+                'created_at REAL NOT NULL, last_access REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+            conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    def _connect(self):
+        # a short-lived connection per operation keeps the cache safe to share across threads and processes
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def make_key(prompt_template, inputs, model_name, parser=None) -> str:
+        '''Hash everything that determines the parsed response.'''
+        payload = json.dumps(
+            {
+                'prompt_template': prompt_template,
+                'inputs': inputs,
+                'model_name': model_name,
+                'parser': _callable_identity(parser),
+            },
+            sort_keys=True,
+            default=repr
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _count(self, conn, name):
+        conn.execute(
+            'INSERT INTO counters (name, value) VALUES (?, 1) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + 1',
+            (name,)
+        )
+
+    def get(self, key):
+        '''Return (hit, value) for a key.'''
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                'SELECT value FROM responses WHERE key = ? AND created_at >= ?',
+                (key, now - self.max_age_seconds)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                self._count(conn, 'misses')
+                return False, None
+            conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+            self.hits += 1
+            self._count(conn, 'hits')
+        return True, json.loads(row[0])
+
+    def set(self, key, value):
+        '''Store a value. Values that can't be serialized to JSON are not cached.'''
+        try:
+            serialized = json.dumps(value)
+        except (TypeError, ValueError):
+            return
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO responses (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)',
+                (key, serialized, len(serialized), now, now)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute('DELETE FROM responses WHERE created_at < ?', (now - self.max_age_seconds,))
+
+        count, total_size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        if count <= self.max_entries and total_size <= self.max_bytes:
+            return
+
+        # walk from most to least recently used, and drop everything past the limits
+        kept_count, kept_size, evict = 0, 0, []
+        for key, size in conn.execute('SELECT key, size FROM responses ORDER BY last_access DESC'):
+            if kept_count + 1 > self.max_entries or kept_size + size > self.max_bytes:
+                evict.append((key,))
+            else:
+                kept_count += 1
+                kept_size += size
+        conn.executemany('DELETE FROM responses WHERE key = ?', evict)
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute('DELETE FROM responses')
+
+    def stats(self) -> dict:
+        '''Hit/miss counters for this session, plus the totals persisted across runs.'''
+        with self._connect() as conn:
+            totals = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+            entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'total_hits': totals.get('hits', 0),
+            'total_misses': totals.get('misses', 0),
+            'entries': entries,
+            'bytes': size,
+        }
+
+
+def cache_from_env():
+    '''Build the default cache, or return None if caching is bypassed with LLM_CACHE_BYPASS=1.'''
+    if os.environ.get('LLM_CACHE_BYPASS') == '1':
+        return None
+    return LLMResponseCache(path=os.environ.get('LLM_CACHE_PATH', '.llm_cache.sqlite'))
@@ -0,0 +1,392 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import tracing
+
+
+# lower runs first: crew steps someone is waiting on go ahead of background config generation
+PRIORITIES = {'interactive': 0, 'background': 1}
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+
+def status_code(error):
+    code = getattr(error, 'status_code', None)
+    if code is None:
+        code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return code
+
+def is_rate_limit_error(error) -> bool:
+    '''A 429 from the API, except running out of quota, which no amount of waiting fixes.'''
+    if getattr(error, 'code', None) == 'insufficient_quota':
+        return False
+    return status_code(error) == 429 or type(error).__name__ == 'RateLimitError'
+
+def is_retryable(error) -> bool:
+    '''Rate limits, server errors and dropped connections are worth another try.'''
+    if is_rate_limit_error(error):
+        return True
+    code = status_code(error)
+    if isinstance(code, int) and code >= 500:
+        return True
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError', 'Timeout', 'ServiceUnavailableError')
+
+def retry_after(error):
+    '''Seconds the server asked us to wait, from the Retry-After headers, or None.'''
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    for name, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        try:
+            return float(headers[name]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+class TokenBucket:
+    '''
+    Refills continuously at per_minute units a minute. It holds burst_seconds worth at most:
+    the API enforces its per-minute limits over much shorter windows, so a full minute's
+    budget sent at once gets rate limited anyway.
+    '''
+
+    def __init__(self, per_minute, burst_seconds=1.0):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.perf_counter()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now) -> float:
+        '''Seconds until amount units are available, requests bigger than the bucket wait for a full one.'''
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount, now):
+        self._refill(now)
+        # may go negative when a call used more than estimated, later calls then wait it off
+        self.level -= amount
+
+
+class LLMScheduler:
+    '''
+    Admits model calls from every call site in priority order, within request- and
+    token-per-minute budgets and at most max_concurrent at a time.
+
+    Calls wait in a single queue, interactive ones ahead of background ones and first come
+    first served within a class. Tokens are charged up front from the caller's estimate and
+    corrected once the call reports what it used. A 429 pauses the whole queue for the
+    server's Retry-After, or an exponential backoff with jitter, instead of letting every
+    waiting caller hit the API again; the failed call then retries from its old place in
+    the queue. Server errors and dropped connections are retried the same way, without the
+    pause. Either budget can be None for no limit.
+    '''
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_concurrent=8, max_retries=6, base_delay=1.0, max_delay=60.0, burst_seconds=1.0, max_samples=10000):
+        self.requests = TokenBucket(requests_per_minute, burst_seconds) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.tokens_used = 0
+        self._delays = {name: deque(maxlen=max_samples) for name in PRIORITIES}
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+        self._async_waiters = []
+
+    def _delay(self, now, tokens) -> float:
+        delay = self._paused_until - now
+        if self.requests is not None:
+            delay = max(delay, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.wait_time(tokens, now))
+        return delay
+
+    def _notify(self):
+        '''Wake every waiter to recheck its turn, threads and event loops alike. Call with the lock held.'''
+        self._condition.notify_all()
+        for loop, event in self._async_waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def _admit(self, ticket, tokens):
+        '''
+        With the lock held: admit ticket if it's its turn and the budgets allow, returning 0.
+        Otherwise the seconds to wait before checking again, None to wait for a wake-up.
+        '''
+        if self._waiting[0] != ticket or self._active >= self.max_concurrent:
+            return None
+        now = time.perf_counter()
+        delay = self._delay(now, tokens)
+        if delay > 0:
+            return delay
+        self._active += 1
+        if self.requests is not None:
+            self.requests.take(1, now)
+        if self.tokens is not None:
+            self.tokens.take(tokens, now)
+        return 0
+
+    def _enqueue(self, priority, sequence):
+        if sequence is None:
+            sequence = next(self._sequence)
+        ticket = (PRIORITIES[priority], sequence)
+        heapq.heappush(self._waiting, ticket)
+        self._notify()
+        return ticket
+
+    def _dequeue(self, ticket, priority, start, tokens, admitted):
+        self._waiting.remove(ticket)
+        heapq.heapify(self._waiting)
+        self._notify()
+        if admitted:
+            end = time.perf_counter()
+            self._delays[priority].append(end - start)
+            if end - start > 0.001:
+                tracing.record_span('llm.queue', start, end, priority=priority, tokens=tokens)
+
+    def acquire(self, priority=BACKGROUND, tokens=0, sequence=None) -> int:
+        '''
+        Block until the call may go ahead. Returns its place in the queue, pass it back
+        when retrying to keep that place. Every acquire needs a release.
+        '''
+        start = time.perf_counter()
+        admitted = False
+        with self._condition:
+            ticket = self._enqueue(priority, sequence)
+            try:
+                while not admitted:
+                    delay = self._admit(ticket, tokens)
+                    admitted = delay == 0
+                    if not admitted:
+                        self._condition.wait(delay)
+            finally:
+                self._dequeue(ticket, priority, start, tokens, admitted)
+        return ticket[1]
+
+    async def aacquire(self, priority=BACKGROUND, tokens=0, sequence=None) -> int:
+        '''acquire for coroutines, waiting on the event loop instead of blocking a thread.'''
+        start = time.perf_counter()
+        admitted = False
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._condition:
+            ticket = self._enqueue(priority, sequence)
+            self._async_waiters.append(waiter)
+        try:
+            while not admitted:
+                with self._condition:
+                    # cleared under the lock, so a wake-up after the check below isn't lost
+                    waiter[1].clear()
+                    delay = self._admit(ticket, tokens)
+                admitted = delay == 0
+                if not admitted:
+                    try:
+                        await asyncio.wait_for(waiter[1].wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            with self._condition:
+                self._async_waiters.remove(waiter)
+                self._dequeue(ticket, priority, start, tokens, admitted)
+        return ticket[1]
+
+    def release(self, estimated_tokens=0, used_tokens=None):
+        with self._condition:
+            self._active -= 1
+            self.calls += 1
+            if used_tokens is not None:
+                self.tokens_used += used_tokens
+                if self.tokens is not None:
+                    self.tokens.level -= used_tokens - estimated_tokens
+            else:
+                self.tokens_used += estimated_tokens
+            self._notify()
+
+    def backoff(self, error, attempt) -> float:
+        '''Seconds to wait before retrying after error on the given attempt (0-based).'''
+        delay = retry_after(error)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+            # half fixed, half random, so callers that failed together don't retry together
+            delay = delay / 2 + random.uniform(0, delay / 2)
+        return delay
+
+    def _retry_delay(self, error, attempt):
+        '''
+        Record a failed call and pause the queue on a rate limit. Returns the seconds
+        the caller itself should wait before retrying, or None to give up.
+        '''
+        if attempt >= self.max_retries or not is_retryable(error):
+            with self._condition:
+                self.failures += 1
+            return None
+        delay = self.backoff(error, attempt)
+        with self._condition:
+            self.retries += 1
+            if is_rate_limit_error(error):
+                self.rate_limited += 1
+                self._paused_until = max(self._paused_until, time.perf_counter() + delay)
+                self._notify()
+                delay = 0.0
+        return delay
+
+    def call(self, func, priority=BACKGROUND, estimated_tokens=0, used_tokens=None):
+        '''
+        Run func() when the scheduler admits it, retrying rate limits and transient errors.
+        used_tokens, if given, maps the result to the number of tokens the call actually used.
+        '''
+        sequence = None
+        for attempt in itertools.count():
+            sequence = self.acquire(priority, estimated_tokens, sequence)
+            try:
+                result = func()
+            except Exception as e:
+                self.release(estimated_tokens)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.release(estimated_tokens, used_tokens(result) if used_tokens is not None else None)
+            return result
+
+    async def acall(self, coroutine_func, priority=BACKGROUND, estimated_tokens=0, used_tokens=None):
+        '''Like call, for a function returning a coroutine.'''
+        sequence = None
+        for attempt in itertools.count():
+            sequence = await self.aacquire(priority, estimated_tokens, sequence)
+            try:
+                result = await coroutine_func()
+            except Exception as e:
+                self.release(estimated_tokens)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.release(estimated_tokens, used_tokens(result) if used_tokens is not None else None)
+            return result
+
+    def stream(self, func, priority=BACKGROUND, estimated_tokens=0):
+        '''
+        Like call, for a function returning an iterator of chunks: the slot is held until the
+        iteration ends. Only failures before the first chunk are retried, after that the
+        consumer has already seen part of the output.
+        '''
+        sequence = None
+        for attempt in itertools.count():
+            sequence = self.acquire(priority, estimated_tokens, sequence)
+            started = released = False
+            try:
+                for chunk in func():
+                    started = True
+                    yield chunk
+            except Exception as e:
+                self.release(estimated_tokens)
+                released = True
+                delay = self._retry_delay(e, self.max_retries if started else attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            finally:
+                if not released:
+                    self.release(estimated_tokens)
+            return
+
+    async def astream(self, func, priority=BACKGROUND, estimated_tokens=0):
+        '''Like stream, for a function returning an async iterator.'''
+        sequence = None
+        for attempt in itertools.count():
+            sequence = await self.aacquire(priority, estimated_tokens, sequence)
+            started = released = False
+            try:
+                async for chunk in func():
+                    started = True
+                    yield chunk
+            except Exception as e:
+                self.release(estimated_tokens)
+                released = True
+                delay = self._retry_delay(e, self.max_retries if started else attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                if not released:
+                    self.release(estimated_tokens)
+            return
+
+    def metrics(self) -> dict:
+        '''Call and retry counts, plus queueing delay percentiles in seconds per priority.'''
+        def summary(delays):
+            delays = sorted(delays)
+            if not delays:
+                return {'count': 0}
+            def percentile(p):
+                return delays[min(len(delays) - 1, int(p * len(delays)))]
+            return {
+                'count': len(delays),
+                'mean': sum(delays) / len(delays),
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': delays[-1],
+            }
+        with self._condition:
+            return {
+                'calls': self.calls,
+                'retries': self.retries,
+                'rate_limited': self.rate_limited,
+                'failures': self.failures,
+                'tokens': self.tokens_used,
+                'in_flight': self._active,
+                'waiting': len(self._waiting),
+                'queue_delay': {name: summary(delays) for name, delays in self._delays.items()},
+            }
+
+    def print_metrics(self):
+        metrics = self.metrics()
+        print(
+            f"LLM scheduler: {metrics['calls']} calls, {metrics['retries']} retries "
+            f"({metrics['rate_limited']} rate limited), {metrics['failures']} failed, ~{metrics['tokens']} tokens"
+        )
+        for name, delay in metrics['queue_delay'].items():
+            if delay['count']:
+                print(
+                    f"  {name}: {delay['count']} admitted, queue delay mean {delay['mean']:.3f}s, "
+                    f"p50 {delay['p50']:.3f}s, p95 {delay['p95']:.3f}s, max {delay['max']:.3f}s"
+                )
+
+
+def scheduler_from_env() -> LLMScheduler:
+    '''The default scheduler, with budgets from LLM_RPM / LLM_TPM and LLM_MAX_CONCURRENT calls at a time.'''
+    def number(name, default=None):
+        value = os.environ.get(name)
+        return int(value) if value else default
+    return LLMScheduler(
+        requests_per_minute=number('LLM_RPM'),
+        tokens_per_minute=number('LLM_TPM'),
+        max_concurrent=number('LLM_MAX_CONCURRENT', 8),
+    )
+
+
+# every model call in the process goes through this one, so the budgets hold across call sites
+shared_scheduler = scheduler_from_env()
@@ -38,7 +38,7 @@ class CrewGenPrompts:
     generate_crew_config_prompt = '''
     Here's an example of configs for a simple agent and a simple task:
     ```python
-    i{{
+    {{
         'agents': [
             'content_writer',  # Writes engaging descriptions for plants and company info.
             'web_designer',  # Creates the layout and design for the landing page.
@@ -46,16 +46,14 @@ class CrewGenPrompts:
             'seo_specialist'  # Optimizes content for search engines to increase visibility.
         ],
         'tasks': [
-             'tasks': [
-            {{'task': 'write_plant_descriptions', 'agent': 'content_writer'}},
-            {{'task': 'design_page_layout', 'agent': 'web_designer'}},
-            {{'task': 'select_images', 'agent': 'web_designer'}},
-            {{'task': 'write_about_us', 'agent': 'content_writer'}},
-            {{'task': 'build_webpage', 'agent': 'web_developer'}},
-            {{'task': 'implement_seo_practices', 'agent': 'seo_specialist'}},
-            {{'task': 'setup_contact_form', 'agent': 'web_developer'}},
-            {{'task': 'launch_page_review', 'agent': 'web_designer'}}
-    ]
+            {{'task': 'write_plant_descriptions', 'agent': 'content_writer', 'depends_on': []}},
+            {{'task': 'design_page_layout', 'agent': 'web_designer', 'depends_on': []}},
+            {{'task': 'select_images', 'agent': 'web_designer', 'depends_on': []}},
+            {{'task': 'write_about_us', 'agent': 'content_writer', 'depends_on': []}},
+            {{'task': 'build_webpage', 'agent': 'web_developer', 'depends_on': ['write_plant_descriptions', 'design_page_layout', 'select_images', 'write_about_us']}},
+            {{'task': 'implement_seo_practices', 'agent': 'seo_specialist', 'depends_on': ['build_webpage']}},
+            {{'task': 'setup_contact_form', 'agent': 'web_developer', 'depends_on': ['build_webpage']}},
+            {{'task': 'launch_page_review', 'agent': 'web_designer', 'depends_on': ['implement_seo_practices', 'setup_contact_form']}}
         ]
     }}
     ```
@@ -69,6 +67,7 @@ class CrewGenPrompts:
 
     Ensure that the agents and tasks are relevant to the objective and that the agents have the necessary skills to complete the tasks.
     Remember that each task must be delegated to an agent. Do not create a task that cannot be completed by any of the agents.
+    Each task lists the names of the tasks whose output it needs in 'depends_on'. Only add a dependency when the task really needs that output, tasks without dependencies between them can run in parallel.
     Tasks and agent capabilities should be within the abilities that can be completed by a python coder with access to the internet and a powerful LLM AI.
     
     # Available tools
@@ -126,6 +125,69 @@ class CrewGenPrompts:
     # Your task config for {task_description}
     '''
 
+    gen_agent_configs_batch_prompt = '''
+
+    # Instructions
+    The overall objective of the larger program is: {objective}
+    Create a config for each of the agents below, in the format below.
+    Each agent name is followed by the tasks that agent will have to complete: {agent_tasks}
+    The agents may make use of any of the following tools: {tool_names}
+    
+    ENSURE THAT YOUR OUTPUT IS A SINGLE DICTIONARY MAPPING EACH AGENT NAME TO ITS CONFIG, WITH THE KEYS BELOW.
+    Here's an example for two simple agents:
+    ```python
+    {{
+        'unicorn_hunter': {{
+            'role': 'Unicorn Hunter',
+            'goal': 'Discover and capture mythical unicorns for study and conservation',
+            'backstory': \'''You are part of an ancient society dedicated to the preservation and study of unicorns. Your skills in tracking, magical lore, and non-lethal capture techniques are unparalleled.\''',
+            'verbose': True,
+            'allow_delegation': False,
+            'tools': ['enchanted_net', 'ancient_tome_of_lore']
+        }},
+        'potion_brewer': {{
+            'role': 'Potion Brewer',
+            'goal': 'Brew the potions the expedition needs',
+            'backstory': \'''You have brewed potions for wizards for decades and know every recipe by heart.\''',
+            'verbose': True,
+            'allow_delegation': False,
+            'tools': ['potion_brewing_kit']
+        }}
+    }}
+    ```
+    
+    Do not duplicate tasks. Each task belongs only to the agent it is listed under.
+    
+    # Your agent configs
+    '''
+
+    gen_task_configs_batch_prompt = '''
+    # Instructions
+    The overall objective of the larger program is: {objective}
+    Create a config for each of the tasks below. Each task is listed with the role of the agent it is delegated to and the tools that agent can use:
+    {tasks}
+
+    ENSURE THAT YOUR OUTPUT IS A SINGLE PYTHON DICTIONARY MAPPING EACH TASK NAME TO A DICTIONARY with the keys 'description' and 'agent' only.
+    Here's an example for two simple tasks:
+    ```python
+    {{
+    'research_ai_trends': {{
+        'description': \'''Conduct a comprehensive analysis of the latest advancements in AI in 2024.
+        Identify key trends, breakthrough technologies, and potential industry impacts.
+        Your final answer MUST be a full analysis report\''',
+        'agent': 'researcher'
+    }},
+    'write_blog_post': {{
+        'description': \'''Using the analysis report, write an engaging blog post about the most significant AI advancements.
+        Your final answer MUST be the full blog post of at least 4 paragraphs\''',
+        'agent': 'writer'
+    }}
+    }}
+    ```
+    
+    # Your task configs
+    '''
+
     code_fixer_prompt = '''
     # Task
     Refine the formatting and fix any error in the given code snippet.
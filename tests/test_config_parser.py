@@ -0,0 +1,92 @@
+import pytest
+
+import config_parser
+from config_parser import (
+    balance,
+    parse_agent_config,
+    parse_agent_configs_batch,
+    parse_crew_config,
+    parse_literal,
+    parse_python_literal,
+    parse_task_config,
+)
+
+
+AGENT = "{'role': 'analyst', 'goal': 'Find trends', 'backstory': 'Careful.', 'verbose': True, 'tools': ['Python_REPL']}"
+
+
+@pytest.fixture(autouse=True)
+def reset_stats():
+    for key in config_parser.parse_stats:
+        config_parser.parse_stats[key] = 0
+
+
+def test_clean_output_is_not_counted_as_repaired():
+    assert parse_literal(f'```python\n{AGENT}\n```') == (eval(AGENT), False)
+    assert parse_agent_config(AGENT)['role'] == 'analyst'
+    assert config_parser.parse_stats['clean'] == 1 and config_parser.retries_avoided() == 0
+
+
+@pytest.mark.parametrize('text, expected', [
+    # a stray character or assignment before the literal
+    ("i{'a': 1}", {'a': 1}),
+    ("config = {'a': [1, 2]}", {'a': [1, 2]}),
+    # trailing commas and JSON literals
+    ('{"a": [1, 2,], "b": true, "c": null,}', {'a': [1, 2], 'b': True, 'c': None}),
+    # the same key opened twice in a row
+    ("{'tasks': [ 'tasks': [1, 2]]}", {'tasks': [1, 2]}),
+    # a value whose closing quote is missing
+    ("{'role': 'analyst, 'goal': 'g'}", {'role': 'analyst', 'goal': 'g'}),
+    # cut off in the middle: brackets and strings left open
+    ("{'a': [1, 2, {'b': 'text", {'a': [1, 2, {'b': 'text'}]}),
+    # closing brackets that don't match anything
+    ("{'a': [1, 2]]}", {'a': [1, 2]}),
+])
+def test_repairs(text, expected):
+    assert parse_literal(text) == (expected, True)
+
+
+def test_unterminated_fence_needs_no_repair():
+    assert parse_literal("```python\n{'a': 1}") == ({'a': 1}, False)
+
+
+def test_repaired_output_counts_as_a_retry_avoided():
+    assert parse_agent_config(AGENT[:-1] + ',')['tools'] == ['Python_REPL']
+    assert config_parser.parse_stats['repaired'] == 1 and config_parser.retries_avoided() == 1
+
+
+def test_balance_leaves_strings_alone():
+    assert balance("{'a': 'x, ] } true', 'b': true}") == "{'a': 'x, ] } true', 'b': True}"
+    assert balance("{'a': 1} # closing ]") == "{'a': 1}"
+
+
+def test_nothing_is_executed():
+    assert parse_python_literal("__import__('os').system('true')").startswith('Error evaluating code')
+    assert config_parser.parse_stats['failed'] == 1
+
+
+def test_schema_errors_go_back_to_the_model():
+    assert parse_task_config("{'description': 'd'}").startswith('Error: config does not match')
+    assert parse_crew_config("{'agents': ['a'], 'tasks': [{'task': 't1'}]}").startswith('Error')
+    assert config_parser.parse_stats['invalid'] == 2
+
+
+def test_normalization_fixes_the_schema_locally():
+    crew = parse_crew_config("{'crew': {'agents': ['a'], 'tasks': [{'task': 't1', 'agent': 'a'}]}}")
+    assert crew == {'agents': ['a'], 'tasks': [{'task': 't1', 'agent': 'a', 'depends_on': []}]}
+    agent = parse_agent_config("{'researcher': {'role': 'r', 'goal': 'g', 'backstory': 'b', 'tools': 'a, b'}}")
+    assert agent['tools'] == ['a', 'b']
+    assert config_parser.retries_avoided() == 2
+
+
+def test_batch_keeps_the_valid_entries():
+    configs = parse_agent_configs_batch(f"{{'good': {AGENT}, 'bad': {{'role': 'r'}}}}")
+    assert list(configs) == ['good']
+    assert parse_agent_configs_batch('[1, 2]').startswith('Error: expected a dict')
+
+
+@pytest.mark.parametrize('text', ["{'a': éclair}", "{'a': 1, 'b': naïve}"])
+def test_non_ascii_words_fail_cleanly(text):
+    with pytest.raises(ValueError):
+        parse_literal(text)
+    assert parse_python_literal(text).startswith('Error evaluating code')
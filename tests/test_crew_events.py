@@ -0,0 +1,60 @@
+import contextvars
+
+import pytest
+from benchmarks.fake_llm import FakeChatModel
+from langchain_core.tools import Tool
+
+import crew_events
+
+
+def test_partial_output_starts_at_the_final_answer():
+    events = []
+    handler = crew_events.TaskEventHandler('t1', events.append)
+    for token in ['Thought: done\n', 'Final ', 'Answer:', ' The VIP', ' rate']:
+        handler.on_llm_new_token(token)
+    partial = [event for event in events if event['type'] == crew_events.PARTIAL_OUTPUT]
+    assert [event['text'] for event in partial] == ['The VIP', 'The VIP rate']
+    assert sum(event['type'] == crew_events.LLM_TOKEN for event in events) == 5
+
+
+def test_nested_agent_tools_become_tool_calls():
+    assert crew_events.nested_callbacks('query_sql_db_tool') is None
+    events = []
+
+    def in_task():
+        crew_events.set_current_task('t1', events.append)
+        callbacks = crew_events.nested_callbacks('query_sql_db_tool')
+        Tool(name='sql_db_query', func=lambda query: '[(8693,)]', description='').run('SELECT count(*) FROM passengers', callbacks=callbacks)
+
+    contextvars.copy_context().run(in_task)
+    # the task is only current in its own context
+    assert crew_events.nested_callbacks('query_sql_db_tool') is None
+    assert [(event['task'], event['tool'], event['input'], event['result'], event['parent']) for event in events] == [
+        ('t1', 'sql_db_query', 'SELECT count(*) FROM passengers', '[(8693,)]', 'query_sql_db_tool')
+    ]
+
+
+def test_attach_makes_the_agent_quiet():
+    llm = FakeChatModel(responses=['ok'])
+    kwargs = crew_events.attach({'llm': llm, 'verbose': True}, 't1', lambda event: None)
+    assert kwargs['verbose'] is False
+    assert kwargs['llm'] is not llm and not llm.callbacks
+
+
+def test_stream_yields_events_then_the_outcome():
+    def run(n, on_event):
+        for i in range(n):
+            on_event(crew_events.make_event(crew_events.TASK_FINISHED, task=f't{i}', output=i))
+        return {'t0': 0, 't1': 1}
+
+    events = list(crew_events.stream(run, 2))
+    assert [event['type'] for event in events] == [crew_events.TASK_FINISHED] * 2 + [crew_events.CREW_FINISHED]
+    assert events[-1]['outputs'] == {'t0': 0, 't1': 1}
+
+    def fail(on_event):
+        raise RuntimeError('no tasks')
+
+    events = crew_events.stream(fail)
+    assert next(events)['type'] == crew_events.CREW_FAILED
+    with pytest.raises(RuntimeError):
+        next(events)
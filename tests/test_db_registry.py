@@ -0,0 +1,78 @@
+import asyncio
+import gc
+import threading
+
+import pytest
+
+from tools.db_registry import DatabaseBusyError, DatabaseExecutor, executor_from_env
+
+
+def test_limits_go_away_with_their_loop():
+    executor = DatabaseExecutor()
+
+    async def query():
+        return await executor.run('db', lambda: 1)
+
+    for _ in range(3):
+        assert asyncio.run(query()) == 1
+    gc.collect()
+    assert len(executor._limits) == 0
+
+
+def test_busy_database_rejects_extra_callers():
+    executor = DatabaseExecutor(max_concurrent=1, max_pending=1)
+    release = threading.Event()
+
+    async def main():
+        first = asyncio.ensure_future(executor.run('db', release.wait))
+        second = asyncio.ensure_future(executor.run('db', lambda: 2))
+        await asyncio.sleep(0.05)
+        assert executor.in_flight('db') == 2
+        with pytest.raises(DatabaseBusyError):
+            await executor.run('db', lambda: 3)
+        # other databases have their own limit
+        assert await executor.run('other', lambda: 4) == 4
+        release.set()
+        return await first, await second
+
+    assert asyncio.run(main()) == (True, 2)
+
+
+def test_busy_timeout_waits_for_room():
+    executor = DatabaseExecutor(max_concurrent=1, max_pending=0, busy_timeout=5)
+    release = threading.Event()
+
+    async def main():
+        first = asyncio.ensure_future(executor.run('db', release.wait))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(executor.run('db', lambda: 2))
+        await asyncio.sleep(0.05)
+        # waiting for room, not counted yet
+        assert executor.in_flight('db') == 1
+        release.set()
+        return await first, await second
+
+    assert asyncio.run(main()) == (True, 2)
+
+
+def test_busy_timeout_expires():
+    executor = DatabaseExecutor(max_concurrent=1, max_pending=0, busy_timeout=0.05)
+    release = threading.Event()
+
+    async def main():
+        first = asyncio.ensure_future(executor.run('db', release.wait))
+        await asyncio.sleep(0.05)
+        with pytest.raises(DatabaseBusyError):
+            await executor.run('db', lambda: 2)
+        release.set()
+        return await first
+
+    assert asyncio.run(main()) is True
+
+
+def test_limits_from_env(monkeypatch):
+    monkeypatch.setenv('SQL_MAX_CONCURRENT', '2')
+    monkeypatch.setenv('SQL_MAX_PENDING', '200')
+    monkeypatch.setenv('SQL_BUSY_TIMEOUT', '1.5')
+    executor = executor_from_env()
+    assert (executor.max_concurrent, executor.max_pending, executor.busy_timeout) == (2, 200, 1.5)
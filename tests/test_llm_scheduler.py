@@ -0,0 +1,151 @@
+import asyncio
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault('OPENAI_API_KEY', 'offline-test')
+
+from benchmarks.mock_openai import MockOpenAIServer
+from llm_scheduler import BACKGROUND, INTERACTIVE, LLMScheduler, TokenBucket, is_rate_limit_error, retry_after
+from tools.db_registry import ScheduledChatOpenAI
+
+
+@pytest.fixture
+def server():
+    # one request a second, so a handful of calls is enough to hit the limit
+    with MockOpenAIServer(limit=1, latency=0.01) as server:
+        yield server
+
+
+def scheduled_llm(server, scheduler, **kwargs):
+    return ScheduledChatOpenAI(openai_api_base=server.base_url, scheduler=scheduler, **kwargs)
+
+
+def assert_rate_limits_handled(server, scheduler, calls):
+    metrics = scheduler.metrics()
+    assert server.rejected >= 1
+    assert metrics['failures'] == 0
+    # every 429 the server sent was seen, counted and retried once
+    assert metrics['rate_limited'] == metrics['retries'] == server.rejected
+    assert metrics['calls'] == calls + server.rejected
+    # and nothing came back before the Retry-After was up
+    assert server.early == 0
+
+
+def test_call_retries_rate_limits(server):
+    scheduler = LLMScheduler(max_concurrent=1)
+    llm = scheduled_llm(server, scheduler)
+    answers = [llm.invoke(f'call {i}').content for i in range(3)]
+    assert answers == [f'call {i}'[::-1] for i in range(3)]
+    assert_rate_limits_handled(server, scheduler, 3)
+
+
+def test_stream_retries_rate_limits(server):
+    scheduler = LLMScheduler(max_concurrent=1)
+    llm = scheduled_llm(server, scheduler, streaming=True)
+    for i in range(3):
+        chunks = [chunk.content for chunk in llm.stream(f'stream {i}')]
+        assert len(chunks) > 1 and ''.join(chunks) == f'stream {i}'[::-1]
+    assert_rate_limits_handled(server, scheduler, 3)
+
+
+def test_async_call_retries_rate_limits(server):
+    scheduler = LLMScheduler(max_concurrent=1)
+    llm = scheduled_llm(server, scheduler)
+
+    async def main():
+        return await asyncio.gather(*(llm.ainvoke(f'async {i}') for i in range(3)))
+
+    assert sorted(answer.content for answer in asyncio.run(main())) == sorted(f'async {i}'[::-1] for i in range(3))
+    assert_rate_limits_handled(server, scheduler, 3)
+
+
+def test_retry_after_pauses_the_queue():
+    scheduler = LLMScheduler(max_concurrent=2)
+    RateLimitError = type('RateLimitError', (Exception,), {'response': SimpleNamespace(headers={'retry-after-ms': '300'})})
+    attempts = []
+
+    def flaky():
+        attempts.append(time.perf_counter())
+        if len(attempts) == 1:
+            raise RateLimitError()
+        return 'ok'
+
+    start = time.perf_counter()
+    first = threading.Thread(target=scheduler.call, args=(flaky,))
+    first.start()
+    while not attempts:
+        time.sleep(0.001)
+    # a call queued after the 429 waits out the pause too, it doesn't hit the API meanwhile
+    other = []
+    second = threading.Thread(target=lambda: other.append(scheduler.call(time.perf_counter)))
+    second.start()
+    first.join()
+    second.join()
+    assert attempts[1] - start >= 0.3 and other[0] - start >= 0.3
+    assert scheduler.metrics()['rate_limited'] == 1 and scheduler.metrics()['failures'] == 0
+
+
+def test_interactive_calls_go_first(server):
+    server.limit = 100
+    scheduler = LLMScheduler(max_concurrent=1)
+    release = threading.Event()
+    holder = threading.Thread(target=scheduler.call, args=(release.wait,))
+    holder.start()
+    while scheduler.metrics()['in_flight'] != 1:
+        time.sleep(0.01)
+
+    threads = []
+    for priority, name in [(BACKGROUND, 'b0'), (BACKGROUND, 'b1'), (INTERACTIVE, 'i0'), (INTERACTIVE, 'i1')]:
+        llm = scheduled_llm(server, scheduler, priority=priority)
+        threads.append(threading.Thread(target=llm.invoke, args=(name,)))
+        threads[-1].start()
+        # wait for each call to take its place in the queue
+        while scheduler.metrics()['waiting'] != len(threads):
+            time.sleep(0.01)
+
+    release.set()
+    for thread in [holder] + threads:
+        thread.join(timeout=10)
+    assert server.prompts == ['i0', 'i1', 'b0', 'b1']
+    metrics = scheduler.metrics()
+    assert metrics['failures'] == 0 and metrics['rate_limited'] == 0
+    assert metrics['queue_delay'][BACKGROUND]['count'] == 3 and metrics['queue_delay'][INTERACTIVE]['count'] == 2
+
+
+def test_retry_after_headers():
+    def error(headers, status=429):
+        return SimpleNamespace(status_code=status, response=SimpleNamespace(headers=headers))
+
+    assert retry_after(error({'retry-after-ms': '250'})) == 0.25
+    assert retry_after(error({'retry-after': '2'})) == 2.0
+    assert retry_after(error({})) is None
+    assert LLMScheduler().backoff(error({'retry-after-ms': '1500'}), attempt=5) == 1.5
+    assert is_rate_limit_error(error({}))
+    quota = error({})
+    quota.code = 'insufficient_quota'
+    assert not is_rate_limit_error(quota)
+
+
+def test_gives_up_on_errors_that_are_not_transient():
+    scheduler = LLMScheduler()
+
+    def fail():
+        raise ValueError('bad request')
+
+    with pytest.raises(ValueError):
+        scheduler.call(fail)
+    assert scheduler.metrics()['failures'] == 1 and scheduler.metrics()['retries'] == 0
+
+
+def test_token_bucket_burst():
+    bucket = TokenBucket(per_minute=600, burst_seconds=0.5)
+    assert bucket.capacity == 5
+    now = bucket.updated
+    for _ in range(5):
+        assert bucket.wait_time(1, now) == 0
+        bucket.take(1, now)
+    assert bucket.wait_time(1, now) == pytest.approx(0.1)
@@ -0,0 +1,122 @@
+import sqlite3
+
+import pytest
+from langchain_community.utilities.sql_database import SQLDatabase
+
+from tools.query_advisor import QueryAdvisor, QueryLog, QueryRewriter, expression_key
+from tools.query_cache import database_version, sql_tokens
+from tools.sql_tool import QuerySQLLimitedDataBaseTool
+
+
+@pytest.fixture
+def people_db(tmp_path):
+    path = tmp_path / 'people.db'
+    with sqlite3.connect(path) as connection:
+        connection.execute('CREATE TABLE people (Name TEXT, Cabin TEXT, Age REAL)')
+        connection.executemany('INSERT INTO people VALUES (?, ?, ?)', [
+            ('Ann Smith', 'A/1/P', 30), ('Bob smith', 'B/2/S', 40), ('Cy Smalls', 'A/3/S', 50),
+            ('Dee Jones', 'C/4/P', 60), ('Ed sm', 'B/5/P', 20),
+        ])
+    return SQLDatabase.from_uri(f'sqlite:///{path}')
+
+
+def advisor_for(db, queries, repeat=3):
+    log = QueryLog()
+    advisor = QueryAdvisor(db, log=log, rewriter=QueryRewriter())
+    for query in queries:
+        for _ in range(repeat):
+            log.record(advisor.database, query, 0.01)
+    return advisor
+
+
+def test_expression_key_keeps_literals():
+    assert expression_key(sql_tokens("INSTR(Name,'Sm')")) == "instr(name,'Sm')"
+
+
+def test_mixed_case_literal_survives_rewrite(people_db):
+    query = "SELECT count(*) FROM people WHERE instr(Name, 'Sm') > 0"
+    expected = people_db._engine.connect().exec_driver_sql(query).scalar()
+    advisor = advisor_for(people_db, [query])
+
+    recommendations = [r for r in advisor.recommend() if r['kind'] == 'generated_column']
+    assert len(recommendations) == 1
+    assert "GENERATED ALWAYS AS (instr(Name,'Sm'))" in recommendations[0]['statements'][0]
+
+    report = advisor.apply(recommendations)
+    rewritten = report[0]['queries'][0]['rewritten']
+    assert rewritten is not None and recommendations[0]['name'] in rewritten
+    with sqlite3.connect(advisor.db_path) as connection:
+        assert connection.execute(rewritten).fetchone()[0] == expected == 2
+
+
+def test_literal_case_distinguishes_expressions(people_db):
+    advisor = advisor_for(people_db, [
+        "SELECT count(*) FROM people WHERE instr(Name, 'Sm') > 0",
+        "SELECT count(*) FROM people WHERE instr(name, 'sm') > 0",
+    ])
+    expressions = sorted(r['rule']['expression'] for r in advisor.recommend() if r['kind'] == 'generated_column')
+    assert expressions == ["instr(name,'Sm')", "instr(name,'sm')"]
+
+
+def test_known_expression_names_and_index(people_db):
+    advisor = advisor_for(people_db, ["SELECT Name FROM people WHERE substr(Cabin, 1, 1) = 'A'"])
+    recommendation = [r for r in advisor.recommend() if r['kind'] == 'generated_column'][0]
+    assert recommendation['name'] == 'cabin_deck'
+    assert any(statement.startswith('CREATE INDEX') for statement in recommendation['statements'])
+
+
+def test_summary_table_rewrite(people_db):
+    query = 'SELECT Cabin, avg(Age) FROM people GROUP BY Cabin'
+    advisor = advisor_for(people_db, [query])
+    report = advisor.apply([r for r in advisor.recommend() if r['kind'] == 'summary_table'])
+    rewritten = report[0]['queries'][0]['rewritten']
+    assert 'summary_people_by_Cabin' in rewritten
+    with sqlite3.connect(advisor.db_path) as connection:
+        assert sorted(connection.execute(rewritten).fetchall()) == sorted(connection.execute(query).fetchall())
+
+
+def test_summary_rule_stops_when_data_changes(people_db):
+    query = 'SELECT Cabin, count(*) FROM people GROUP BY Cabin'
+    advisor = advisor_for(people_db, [query])
+    advisor.apply([r for r in advisor.recommend() if r['kind'] == 'summary_table'])
+    with sqlite3.connect(advisor.db_path) as connection:
+        connection.execute("INSERT INTO people VALUES ('Fay', 'A/6/P', 33)")
+    assert advisor._executed(query) == query
+
+
+def test_rules_are_saved_with_the_database(people_db):
+    query = "SELECT count(*) FROM people WHERE instr(Name, 'Sm') > 0"
+    advisor = advisor_for(people_db, [query, 'SELECT Cabin, count(*) FROM people GROUP BY Cabin'])
+    advisor.apply()
+    expected = {rule['column'] for rule in advisor.rewriter.rules(advisor.database) if rule['kind'] == 'expression'}
+
+    # a later process starts with no rules in memory
+    fresh = QueryRewriter()
+    assert fresh.rewrite(advisor.database, query) is None
+    fresh.load(people_db)
+    rewritten = fresh.rewrite(advisor.database, query, database_version(people_db))
+    assert rewritten is not None and any(column in rewritten for column in expected)
+    assert fresh.rewrite(advisor.database, 'SELECT Cabin, count(*) FROM people GROUP BY Cabin', database_version(people_db))
+
+
+def test_sql_tool_loads_saved_rules(people_db):
+    query = "SELECT count(*) FROM people WHERE instr(Name, 'Sm') > 0"
+    advisor_for(people_db, [query]).apply()
+
+    log = QueryLog()
+    tool = QuerySQLLimitedDataBaseTool(db=people_db, rewriter=QueryRewriter(), query_log=log, result_cache=None, sample_store=None)
+    assert '2' in tool.run(query)
+    assert log.entries()[-1]['rewritten'] is not None
+
+
+def test_stale_summary_rules_are_not_revived(people_db):
+    query = 'SELECT Cabin, count(*) FROM people GROUP BY Cabin'
+    advisor = advisor_for(people_db, [query])
+    advisor.apply([r for r in advisor.recommend() if r['kind'] == 'summary_table'])
+    with sqlite3.connect(advisor.db_path) as connection:
+        connection.execute("INSERT INTO people VALUES ('Fay', 'A/6/P', 33)")
+
+    # a second apply changes the database again, the old summary must stay stale
+    other = advisor_for(people_db, ["SELECT Name FROM people WHERE substr(Cabin, 1, 1) = 'A'"])
+    other.apply()
+    assert other._executed(query) == query
@@ -0,0 +1,127 @@
+import random
+import re
+import sqlite3
+
+import pytest
+from langchain_community.utilities.sql_database import SQLDatabase
+
+from tools.sampling import SampleStore, weighted_aggregate, wants_exact
+from tools.schema_profile import SchemaProfileStore
+
+
+class CountingProfileStore(SchemaProfileStore):
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def get(self, db):
+        self.calls += 1
+        return super().get(db)
+
+
+@pytest.fixture
+def trips_db(tmp_path):
+    path = tmp_path / 'trips.db'
+    rng = random.Random(7)
+    with sqlite3.connect(path) as connection:
+        connection.execute('CREATE TABLE trips (city TEXT, fare REAL)')
+        connection.execute('CREATE TABLE cities (city TEXT)')
+        connection.executemany('INSERT INTO trips VALUES (?, ?)', [
+            (city, rng.uniform(5, 50)) for city in ['a'] * 4000 + ['b'] * 900 + ['c'] * 100
+        ])
+        connection.executemany('INSERT INTO cities VALUES (?)', [('a',), ('b',), ('c',)])
+    return SQLDatabase.from_uri(f'sqlite:///{path}')
+
+
+@pytest.fixture
+def store():
+    return SampleStore(profile_store=CountingProfileStore(), threshold_rows=1000, sample_rows=500, min_per_stratum=20)
+
+
+def exact(db, query):
+    with db._engine.connect() as connection:
+        return connection.exec_driver_sql(query).fetchall()
+
+
+def run_plan(plan):
+    with plan['sample']['db']._engine.connect() as connection:
+        result = connection.exec_driver_sql(plan['query'])
+        return list(result.keys()), result.fetchall()
+
+
+def test_small_tables_skip_the_profile(trips_db, store):
+    assert store.plan(trips_db, 'SELECT count(*) FROM cities') is None
+    assert store.plan(trips_db, 'SELECT count(*) FROM missing') is None
+    assert store.profile_store.calls == 0
+
+
+def test_estimated_rows(trips_db, store):
+    path = store.sidecar_path(trips_db)[0]
+    assert store.estimated_rows(path, 'TRIPS') == 5000
+    assert store.estimated_rows(path, 'missing') is None
+
+
+def test_exact_marker(trips_db, store):
+    assert wants_exact('SELECT count(*) FROM trips -- exact')
+    assert store.plan(trips_db, 'SELECT count(*) FROM trips -- exact') is None
+    assert store.exact_queries == 1
+
+
+def test_sample_is_stratified_and_weighted(trips_db, store):
+    plan = store.plan(trips_db, 'SELECT city, count(*) FROM trips GROUP BY city')
+    sample = plan['sample']
+    assert sample['strata'] == ['city'] and sample['rows'] == 5000
+    assert sample['sample_rows'] < 1000
+    # every stratum keeps at least min_per_stratum rows, and the weights add up to the stratum sizes
+    columns, rows = run_plan(plan)
+    columns, rows = store.attach_bounds(plan, columns, rows, lambda value: f'{value:.1f}')
+    assert columns == ['city', 'count(*)']
+    counts = {city: value.split(' ± ') for city, value in rows}
+    assert {city: round(float(estimate)) for city, (estimate, margin) in counts.items()} == {'a': 4000, 'b': 900, 'c': 100}
+    assert exact(sample['db'], "SELECT count(*) FROM trips WHERE city = 'c'")[0][0] >= 20
+
+
+def test_sum_and_avg_bounds_cover_the_truth(trips_db, store):
+    plan = store.plan(trips_db, 'SELECT sum(fare), avg(fare), max(fare) FROM trips')
+    assert plan['bounded'] == {0: 0, 1: 1} and plan['variance_columns'] == 2
+    columns, rows = store.attach_bounds(plan, *run_plan(plan))
+    assert len(columns) == 3
+    true_sum, true_avg, true_max = exact(trips_db, 'SELECT sum(fare), avg(fare), max(fare) FROM trips')[0]
+    for value, truth in zip(rows[0][:2], (true_sum, true_avg)):
+        estimate, margin = map(float, value.split(' ± '))
+        assert margin > 0
+        # far outside the 95% interval would mean a broken estimate, not bad luck
+        assert abs(estimate - truth) < 4 * margin
+    # max has no bound and is at most the true max
+    assert isinstance(rows[0][2], float) and rows[0][2] <= true_max
+
+
+def test_weighted_aggregates():
+    assert weighted_aggregate('count', '*') == ('total("_weight")', 'total("_weight"*("_weight"-1))')
+    assert weighted_aggregate('min', 'fare') == (None, None)
+    assert weighted_aggregate('count', 'distinct city') == (None, None)
+    estimate, variance = weighted_aggregate('avg', 'fare')
+    assert re.search(r'total\(\(fare\)\*"_weight"\)', estimate) and variance.startswith('((')
+
+
+def test_unsampled_rows_have_no_variance(trips_db):
+    # with the whole table in the sample every weight is 1 and the bounds are 0
+    store = SampleStore(profile_store=CountingProfileStore(), threshold_rows=1000, sample_rows=10000)
+    plan = store.plan(trips_db, 'SELECT count(*), sum(fare) FROM trips')
+    columns, rows = store.attach_bounds(plan, *run_plan(plan))
+    count, total = rows[0]
+    assert count == '5000.0 ± 0.0'
+    assert abs(float(total.split(' ± ')[0]) - exact(trips_db, 'SELECT sum(fare) FROM trips')[0][0]) < 1e-6
+
+
+def test_sql_tool_runs_exactly_when_sampling_fails(trips_db, store, monkeypatch):
+    from tools.sql_tool import QuerySQLLimitedDataBaseTool
+
+    def unwritable(*args, **kwargs):
+        raise sqlite3.OperationalError('unable to open database file')
+
+    monkeypatch.setattr(store, '_build', unwritable)
+    tool = QuerySQLLimitedDataBaseTool(db=trips_db, sample_store=store, result_cache=None, query_log=None)
+    output = tool.run('SELECT count(*) FROM trips')
+    assert '5000' in output and 'Approximate' not in output
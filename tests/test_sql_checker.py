@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+from langchain_community.utilities.sql_database import SQLDatabase
+
+from langchain_community.chat_models.fake import FakeListChatModel
+from tools.schema_profile import SchemaProfileStore
+from tools.sql_checker import INVALID, UNRESOLVED, VALID, check_query
+from tools.sql_tool import LocalQuerySQLCheckerTool
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = tmp_path / 'titanic.db'
+    with sqlite3.connect(path) as connection:
+        connection.execute('CREATE TABLE passengers (PassengerId TEXT, HomePlanet TEXT, VIP INTEGER, Transported INTEGER)')
+        connection.execute("INSERT INTO passengers VALUES ('0001_01', 'Europa', 0, 1)")
+    return SQLDatabase.from_uri(f'sqlite:///{path}')
+
+
+@pytest.fixture
+def profile(db):
+    return SchemaProfileStore().get(db)
+
+
+def check(db, profile, query):
+    with db._engine.connect() as connection:
+        return check_query(connection, query, profile)
+
+
+def test_valid_query_is_returned_cleaned_up(db, profile):
+    assert check(db, profile, ' SELECT avg(Transported) FROM passengers WHERE VIP = 1; ') == (
+        VALID, 'SELECT avg(Transported) FROM passengers WHERE VIP = 1'
+    )
+
+
+def test_unknown_names_get_suggestions(db, profile):
+    status, message = check(db, profile, 'SELECT count(*) FROM passenger')
+    assert status == INVALID and 'no such table: passenger' in message and "Did you mean 'passengers'" in message
+    status, message = check(db, profile, 'SELECT homeplanet, Transport FROM passengers')
+    assert status == INVALID and "Did you mean 'Transported'" in message
+
+
+def test_syntax_errors_are_explained(db, profile):
+    assert check(db, profile, 'SELEC * FROM passengers') == (INVALID, 'Error: near "SELEC": syntax error.')
+    assert check(db, profile, '') == (INVALID, 'The query is empty.')
+    assert check(db, profile, 'SELECT * FROM passengers WHERE sum(VIP) > 1')[0] == INVALID
+
+
+def test_unexplained_errors_are_unresolved(db, profile):
+    status, message = check(db, profile, 'SELECT * FROM passengers WHERE VIP IN (SELECT 1, 2)')
+    assert status == UNRESOLVED and message.startswith('Error:')
+
+
+def test_the_query_is_only_planned(db, profile):
+    check(db, profile, "DELETE FROM passengers WHERE HomePlanet = 'Europa'")
+    assert db.run('SELECT count(*) FROM passengers') == '[(1,)]'
+
+
+def test_checker_tool_only_asks_the_llm_when_unresolved(db):
+    llm = FakeListChatModel(responses=['SELECT * FROM passengers WHERE VIP IN (SELECT 1)'])
+    tool = LocalQuerySQLCheckerTool(db=db, llm=llm, profile_store=SchemaProfileStore())
+
+    assert tool.run('SELECT VIP FROM passengers') == 'SELECT VIP FROM passengers'
+    assert tool.run('SELECT VIPs FROM passengers').endswith('Rewrite the query and check it again.')
+    assert tool.llm_checks_avoided == 2 and tool.llm_checks == 0
+
+    assert tool.run('SELECT * FROM passengers WHERE VIP IN (SELECT 1, 2)') == 'SELECT * FROM passengers WHERE VIP IN (SELECT 1)'
+    assert tool.llm_checks == 1
@@ -0,0 +1,74 @@
+import threading
+
+
+class ToolRegistry:
+    '''
+    Tools declared by name, each with a factory that imports and builds the tool.
+
+    Nothing is imported or constructed until a tool is first asked for, so crews only pay
+    for the tools their agent configs actually reference.
+    '''
+
+    def __init__(self):
+        self._factories = {}
+        self._tools = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        '''Declare a tool. factory is called with no arguments the first time the tool is needed.'''
+        self._factories[name] = factory
+
+    def names(self) -> list:
+        return list(self._factories)
+
+    def is_constructed(self, name) -> bool:
+        return name in self._tools
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._tools:
+                if name not in self._factories:
+                    raise KeyError(f'No tool named {name!r} is registered. Known tools: {self.names()}')
+                self._tools[name] = self._factories[name]()
+            return self._tools[name]
+
+    def resolve(self, names) -> list:
+        '''Build (or reuse) the tools for a list of names, skipping names that aren't registered.'''
+        tools = []
+        for name in names:
+            if name in self._factories:
+                tools.append(self.get(name))
+            else:
+                print(f'Skipping unknown tool {name!r}')
+        return tools
+
+
+def build_spaceship_titanic_sql_tool():
+    from tools.sql_tool import build_sql_tool
+    return build_sql_tool(
+        db_uri='sqlite:///./spaceship_titanic.db',
+        name='query_sql_db_tool',
+        description='Runs a sql query against the spaceship titanic database and returns the results.'
+    )
+
+def build_python_repl_tool():
+    from tools.python_tool import build_python_tool
+    return build_python_tool(
+        datasets={'spaceship_titanic': ('./spaceship_titanic.db', 'spaceship_titanic')},
+        name='Python_REPL'
+    )
+
+def build_duckduckgo_search_tool():
+    from langchain_community.tools import DuckDuckGoSearchRun
+    return DuckDuckGoSearchRun()
+
+def build_arxiv_tool():
+    from langchain_community.tools.arxiv.tool import ArxivQueryRun
+    return ArxivQueryRun()
+
+
+default_registry = ToolRegistry()
+default_registry.register('query_sql_db_tool', build_spaceship_titanic_sql_tool)
+default_registry.register('Python_REPL', build_python_repl_tool)
+default_registry.register('duckduckgo_search', build_duckduckgo_search_tool)
+default_registry.register('arxiv', build_arxiv_tool)
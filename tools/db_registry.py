@@ -0,0 +1,264 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from langchain_community.utilities.sql_database import SQLDatabase
+from langchain_openai import ChatOpenAI
+
+import tracing
+from llm_scheduler import shared_scheduler, INTERACTIVE
+
+
+# 256MB of memory-mapped reads and a 64MB page cache per connection
+SQLITE_READ_PRAGMAS = {
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'query_only': 1,
+    'temp_store': 'MEMORY',
+}
+
+
+def read_only_sqlite_url(db_uri, immutable=False) -> str:
+    '''
+    Rewrite a sqlite:/// uri to open the file read-only.
+
+    immutable=True also tells SQLite the file can never change, which skips locking entirely,
+    but then changes to the file won't be noticed, so only use it for frozen databases.
+    '''
+    url = make_url(db_uri)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return db_uri
+    if url.database.startswith('file:'):
+        return db_uri
+
+    query = {'mode': 'ro', 'uri': 'true'}
+    if immutable:
+        query['immutable'] = '1'
+    return url.set(database=f'file:{url.database}', query=query).render_as_string(hide_password=False)
+
+
+class DatabaseRegistry:
+    '''
+    Process-wide registry handing out one pooled SQLDatabase per uri.
+
+    At most max_open databases are kept open, the least recently used one is disposed of
+    when the limit is reached. SQLite databases are opened read-only with read-friendly pragmas.
+    '''
+
+    def __init__(self, max_open=8):
+        self.max_open = max_open
+        self._databases = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _create(self, db_uri, read_only, immutable) -> SQLDatabase:
+        url = make_url(db_uri)
+        if url.get_backend_name() != 'sqlite':
+            return SQLDatabase.from_uri(db_uri)
+
+        engine = create_engine(read_only_sqlite_url(db_uri, immutable=immutable) if read_only else db_uri)
+        pragmas = SQLITE_READ_PRAGMAS if read_only else {}
+
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma, value in pragmas.items():
+                cursor.execute(f'PRAGMA {pragma} = {value}')
+            cursor.close()
+
+        return SQLDatabase(engine)
+
+    def get(self, db_uri, read_only=True, immutable=False) -> SQLDatabase:
+        key = (db_uri, read_only, immutable)
+        with self._lock:
+            if key in self._databases:
+                self._databases.move_to_end(key)
+                return self._databases[key]
+
+            db = self._create(db_uri, read_only, immutable)
+            self._databases[key] = db
+            while len(self._databases) > self.max_open:
+                _, evicted = self._databases.popitem(last=False)
+                evicted._engine.dispose()
+            return db
+
+    def close_all(self):
+        with self._lock:
+            for db in self._databases.values():
+                db._engine.dispose()
+            self._databases.clear()
+
+
+class DatabaseBusyError(RuntimeError):
+    pass
+
+
+class DatabaseExecutor:
+    '''
+    Runs blocking database work for async callers on a bounded thread pool.
+
+    At most max_concurrent calls run against any one database at a time, and at most
+    max_pending more wait for it. A caller beyond that waits up to busy_timeout seconds for
+    room and then gets a DatabaseBusyError, instead of queueing without bound; with the
+    default busy_timeout of 0 it fails right away. The caller's context (e.g. the current
+    trace span) is carried over to the worker thread.
+    '''
+
+    def __init__(self, max_workers=32, max_concurrent=4, max_pending=64, busy_timeout=0.0):
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self.busy_timeout = busy_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db')
+        # loop -> database -> limit, a loop's limits go away with the loop
+        self._limits = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _limit(self, database):
+        '''The semaphore and waiting count for a database on the running event loop.'''
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            limits = self._limits.setdefault(loop, {})
+            if database not in limits:
+                limits[database] = {
+                    'semaphore': asyncio.Semaphore(self.max_concurrent),
+                    'pending': 0,
+                    'room': asyncio.Condition(),
+                }
+            return limits[database]
+
+    async def _reserve(self, database, limit):
+        '''Count the caller as pending, waiting up to busy_timeout for room if the database is full.'''
+        full = lambda: limit['pending'] >= self.max_concurrent + self.max_pending
+        if full() and self.busy_timeout > 0:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.busy_timeout
+            async with limit['room']:
+                while full() and loop.time() < deadline:
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(limit['room'].wait(), deadline - loop.time())
+        if full():
+            raise DatabaseBusyError(f'Too many queries waiting for {database}, try again shortly.')
+        limit['pending'] += 1
+
+    async def run(self, database, func, *args, **kwargs):
+        limit = self._limit(database)
+        await self._reserve(database, limit)
+        try:
+            async with limit['semaphore']:
+                call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+                return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+        finally:
+            limit['pending'] -= 1
+            async with limit['room']:
+                limit['room'].notify_all()
+
+    def in_flight(self, database) -> int:
+        '''Calls running or waiting for a database on the running event loop.'''
+        return self._limit(database)['pending']
+
+
+class ScheduledChatOpenAI(ChatOpenAI):
+    '''
+    A ChatOpenAI whose requests wait their turn in an LLMScheduler (the shared one by default).
+    The scheduler retries rate limits and server errors, so the client's own retries are off.
+    '''
+
+    priority: str = INTERACTIVE
+    scheduler: Any = None
+    max_retries: int = 0
+
+    def _estimate_tokens(self, messages) -> int:
+        return sum(tracing.estimate_tokens(message.content) for message in messages) + (self.max_tokens or 256)
+
+    @staticmethod
+    def _used_tokens(result):
+        usage = (result.llm_output or {}).get('token_usage') or {}
+        return usage.get('total_tokens')
+
+    def _streams(self, kwargs) -> bool:
+        # ChatOpenAI's _generate streams through _stream, which is scheduled on its own
+        return kwargs.get('stream') if kwargs.get('stream') is not None else self.streaming
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self._streams(kwargs):
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        scheduler = self.scheduler or shared_scheduler
+        return scheduler.call(
+            lambda: super(ScheduledChatOpenAI, self)._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            priority=self.priority,
+            estimated_tokens=self._estimate_tokens(messages),
+            used_tokens=self._used_tokens,
+        )
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self._streams(kwargs):
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        scheduler = self.scheduler or shared_scheduler
+        return await scheduler.acall(
+            lambda: super(ScheduledChatOpenAI, self)._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            priority=self.priority,
+            estimated_tokens=self._estimate_tokens(messages),
+            used_tokens=self._used_tokens,
+        )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        # crewai agents call the model through stream(), which comes here rather than _generate
+        scheduler = self.scheduler or shared_scheduler
+        return scheduler.stream(
+            lambda: super(ScheduledChatOpenAI, self)._stream(messages, stop=stop, run_manager=run_manager, **kwargs),
+            priority=self.priority,
+            estimated_tokens=self._estimate_tokens(messages),
+        )
+
+    def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        scheduler = self.scheduler or shared_scheduler
+        return scheduler.astream(
+            lambda: super(ScheduledChatOpenAI, self)._astream(messages, stop=stop, run_manager=run_manager, **kwargs),
+            priority=self.priority,
+            estimated_tokens=self._estimate_tokens(messages),
+        )
+
+
+def executor_from_env() -> DatabaseExecutor:
+    '''
+    The default executor, running SQL_MAX_CONCURRENT queries per database at a time with
+    SQL_MAX_PENDING more waiting, and making callers beyond that wait up to SQL_BUSY_TIMEOUT seconds.
+    '''
+    def number(name, default, kind=int):
+        value = os.environ.get(name)
+        return kind(value) if value else default
+    return DatabaseExecutor(
+        max_concurrent=number('SQL_MAX_CONCURRENT', 4),
+        max_pending=number('SQL_MAX_PENDING', 64),
+        busy_timeout=number('SQL_BUSY_TIMEOUT', 0.0, float),
+    )
+
+
+database_registry = DatabaseRegistry()
+# shared by the async paths of the SQL tools, so the limits hold across all of them
+database_executor = executor_from_env()
+
+_llms = {}
+_llms_lock = threading.Lock()
+
+
+def get_database(db_uri, read_only=True, immutable=False) -> SQLDatabase:
+    '''Get the shared SQLDatabase for a uri, creating it on first use.'''
+    return database_registry.get(db_uri, read_only=read_only, immutable=immutable)
+
+
+def get_llm(model='gpt-4', temperature=0, priority=INTERACTIVE) -> ChatOpenAI:
+    '''Get a shared chat model client, creating it on first use. Its calls go through the shared LLM scheduler.'''
+    key = (model, temperature, priority)
+    with _llms_lock:
+        if key not in _llms:
+            _llms[key] = ScheduledChatOpenAI(model=model, temperature=temperature, priority=priority)
+        return _llms[key]
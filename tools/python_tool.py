@@ -0,0 +1,55 @@
+from typing import Any, Optional
+
+from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.tools import BaseTool
+
+from tools.python_worker import PythonWorkerPool
+
+
+def sanitize_input(query: str) -> str:
+    '''Strip whitespace, backticks and a leading `python` from model-written code.'''
+    query = query.strip().strip('`')
+    if query.startswith('python'):
+        query = query[len('python'):]
+    return query.strip()
+
+
+class PersistentPythonTool(BaseTool):
+    """A Python shell backed by long-lived workers with the datasets already loaded."""
+
+    name: str = "Python_REPL"
+    description: str = (
+        "A Python shell. Use this to execute python commands. "
+        "Input should be a valid python command. "
+        "If you want to see the output of a value, you should print it out "
+        "with `print(...)`."
+    )
+    pool: Any = None
+    sanitize_input: bool = True
+
+    def _run(
+        self,
+        query: str,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        """Run the snippet on a warm worker."""
+        if self.sanitize_input:
+            query = sanitize_input(query)
+        return self.pool.run(query)
+
+
+def build_python_tool(datasets=None, name='Python_REPL', **pool_kwargs) -> PersistentPythonTool:
+    '''
+    Builds a Python tool whose snippets run on a PythonWorkerPool. datasets maps a variable
+    name to a (sqlite path, table) pair, each is available to snippets as a DataFrame.
+    '''
+    pool = PythonWorkerPool(datasets=datasets, **pool_kwargs)
+    description = PersistentPythonTool.__fields__['description'].default
+    if datasets:
+        description += (
+            " pandas is imported as pd and numpy as np. These tables are already loaded as pandas DataFrames, "
+            "use them by name instead of reading the database: "
+            + ", ".join(f"{variable} (table {table})" for variable, (path, table) in datasets.items())
+            + ". Variables you define are kept between calls."
+        )
+    return PersistentPythonTool(name=name, description=description, pool=pool)
@@ -0,0 +1,263 @@
+import ast
+import atexit
+import contextlib
+import importlib
+import io
+import multiprocessing
+import os
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+
+import tracing
+
+
+MAX_OUTPUT_CHARS = 10000
+
+
+def _limit_memory(memory_limit_mb):
+    if not memory_limit_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows, snippets run without a memory limit there
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def load_dataset(db_path, table):
+    '''
+    Load a table as a DataFrame. With pyarrow installed the table is snapshotted to a
+    Feather file next to the database once, and memory-mapped from there after that.
+    '''
+    import pandas as pd
+
+    snapshot = f'{db_path}.{table}.feather'
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        snapshot = None
+
+    if snapshot and os.path.exists(snapshot) and os.path.getmtime(snapshot) >= os.path.getmtime(db_path):
+        return pd.read_feather(snapshot, memory_map=True)
+
+    connection = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        frame = pd.read_sql_query(f'SELECT * FROM "{table}"', connection)
+    finally:
+        connection.close()
+    if snapshot:
+        try:
+            frame.to_feather(snapshot)
+        except Exception:
+            # the snapshot is only a cache: an unwritable directory or a column Arrow can't
+            # type (mixed values in a SQLite column) must not stop the dataset from loading
+            with contextlib.suppress(OSError):
+                os.remove(snapshot)
+    return frame
+
+def execute(code, namespace) -> str:
+    '''Run a snippet in namespace and return what it printed, plus the value of a trailing expression.'''
+    tree = ast.parse(code, mode='exec')
+    trailing = None
+    if tree.body and isinstance(tree.body[-1], ast.Expr):
+        trailing = ast.Expression(tree.body.pop().value)
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        exec(compile(tree, '<snippet>', 'exec'), namespace)
+        if trailing is not None:
+            value = eval(compile(trailing, '<snippet>', 'eval'), namespace)
+            if value is not None:
+                print(repr(value))
+    return output.getvalue()
+
+def format_snippet_error(error) -> str:
+    '''The traceback of an exception raised by a snippet, without the worker's own frames.'''
+    tb = error.__traceback__
+    while tb is not None and tb.tb_frame.f_code.co_filename != '<snippet>':
+        tb = tb.tb_next
+    return ''.join(traceback.format_exception(type(error), error, tb))
+
+def _worker_main(connection, preload, datasets, memory_limit_mb):
+    '''Runs in the worker process: warm up, then execute snippets until told to stop.'''
+    namespace = {'__name__': '__main__'}
+    for module_name in preload:
+        try:
+            namespace[module_name.split('.')[-1]] = importlib.import_module(module_name)
+        except ImportError:
+            pass
+    if 'pandas' in namespace:
+        namespace['pd'] = namespace.pop('pandas')
+    if 'numpy' in namespace:
+        namespace['np'] = namespace.pop('numpy')
+
+    loaded = []
+    for name, (db_path, table) in datasets.items():
+        try:
+            namespace[name] = load_dataset(db_path, table)
+            loaded.append(name)
+        except Exception as e:
+            print(f'Could not load dataset {name!r}: {e}')
+
+    # the limit applies to snippets, not to the warm-up above
+    _limit_memory(memory_limit_mb)
+    connection.send(('ready', loaded))
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        try:
+            connection.send(('ok', execute(message, namespace)))
+        except MemoryError:
+            connection.send(('error', f'MemoryError: the snippet went over the {memory_limit_mb} MB memory limit'))
+        except BaseException as e:
+            connection.send(('error', format_snippet_error(e)))
+
+
+class PythonWorker:
+    '''A warm Python process with its own persistent namespace.'''
+
+    def __init__(self, context, preload, datasets, memory_limit_mb):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_connection, preload, datasets, memory_limit_mb),
+            daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+        self.datasets = None
+        self.ready = threading.Event()
+
+    def wait_ready(self, timeout=None) -> bool:
+        if not self.ready.is_set():
+            if not self.connection.poll(timeout):
+                return False
+            try:
+                status, self.datasets = self.connection.recv()
+            except EOFError:
+                # the worker died while warming up
+                return False
+            self.ready.set()
+        return True
+
+    def run(self, code, timeout):
+        '''Returns (status, output), status is 'ok', 'error', 'timeout' or 'crashed'.'''
+        try:
+            self.connection.send(code)
+            if not self.connection.poll(timeout):
+                return 'timeout', None
+            return self.connection.recv()
+        except (EOFError, BrokenPipeError, OSError):
+            return 'crashed', None
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class PythonWorkerPool:
+    '''
+    A small pool of long-lived Python workers for running analysis snippets.
+
+    Each worker imports the preload modules and loads the datasets (name -> (sqlite path, table))
+    as DataFrames once at startup, so snippets only pay for their own work. Snippets over timeout
+    seconds are stopped by killing their worker and swapping in a spare that's kept warm in the
+    background; the memory limit is enforced inside the worker, so hitting it only fails the snippet.
+    Variables a snippet defines stay around for later snippets run on the same worker.
+    '''
+
+    def __init__(self, datasets=None, preload=('pandas', 'numpy'), size=1, timeout=60, memory_limit_mb=4096):
+        self.datasets = dict(datasets or {})
+        self.preload = tuple(preload)
+        self.size = size
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.restarts = 0
+        self.snippets = 0
+        # spawn rather than fork, the parent has threads and sqlite connections
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._spare = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+        for _ in range(size):
+            self._idle.put(self._start_worker())
+        self._spare = self._start_worker()
+        atexit.register(self.close)
+
+    def _start_worker(self) -> PythonWorker:
+        return PythonWorker(self._context, self.preload, self.datasets, self.memory_limit_mb)
+
+    def _replacement(self) -> PythonWorker:
+        '''Hand out the warm spare and start warming the next one.'''
+        with self._lock:
+            worker, self._spare = self._spare, self._start_worker()
+        self.restarts += 1
+        return worker
+
+    def dataset_names(self) -> list:
+        return list(self.datasets)
+
+    def run(self, code, timeout=None) -> str:
+        timeout = self.timeout if timeout is None else timeout
+        worker = self._idle.get()
+        with tracing.span('python.run', code=code[:200]) as span:
+            try:
+                start = time.perf_counter()
+                if not worker.wait_ready():
+                    worker.stop()
+                    worker = self._replacement()
+                    return 'Error: the Python worker failed to start, try again.'
+                span.set(warmup_wait=time.perf_counter() - start)
+
+                status, output = worker.run(code, timeout)
+                self.snippets += 1
+                span.set(status=status)
+                if status == 'timeout':
+                    worker.process.kill()
+                    worker.stop()
+                    worker = self._replacement()
+                    return (
+                        f'Error: the snippet did not finish within {timeout} seconds and was stopped. '
+                        'Variables defined by earlier snippets were lost, the datasets are still loaded.'
+                    )
+                if status == 'crashed':
+                    worker.stop()
+                    worker = self._replacement()
+                    return 'Error: the Python worker crashed and was restarted, variables defined by earlier snippets were lost.'
+                if len(output) > MAX_OUTPUT_CHARS:
+                    output = output[:MAX_OUTPUT_CHARS] + f'\n... (output truncated, {len(output)} characters in total)'
+                return output
+            finally:
+                self._idle.put(worker)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        workers = [self._spare]
+        while not self._idle.empty():
+            workers.append(self._idle.get_nowait())
+        for worker in workers:
+            if worker is not None:
+                worker.stop()
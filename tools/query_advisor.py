@@ -0,0 +1,668 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+
+from tools.query_cache import normalize_sql, sql_tokens, database_identity, database_version, sqlite_path, quote_identifier
+
+
+AGGREGATES = {'count', 'sum', 'avg', 'min', 'max', 'total'}
+SCALAR_FUNCTIONS = {
+    'substr', 'substring', 'instr', 'lower', 'upper', 'trim', 'ltrim', 'rtrim', 'replace',
+    'length', 'cast', 'abs', 'round', 'strftime', 'date', 'coalesce', 'ifnull',
+}
+CLAUSES = ('select', 'from', 'where', 'group', 'having', 'order', 'limit')
+NOT_SIMPLE = {'join', 'union', 'intersect', 'except', 'with', 'over', 'window'}
+
+# well known ways of slicing a 'deck/num/side' column, named after the part they extract
+KNOWN_EXPRESSIONS = (
+    (re.compile(r"^substr\((?P<column>\w+),1,(?:1|instr\((?P=column),'/'\)-1)\)$"), 'deck'),
+    (re.compile(r"^substr\((?P<column>\w+),(?:-1|length\((?P=column)\))(?:,1)?\)$"), 'side'),
+    (re.compile(r"^(?:cast\()?substr\((?P<column>\w+),(?:3|instr\((?P=column),'/'\)\+1)"), 'num'),
+)
+
+
+def _unquote(identifier: str) -> str:
+    if identifier[:1] in ('"', '`', '[') and len(identifier) > 1:
+        return identifier[1:-1]
+    return identifier
+
+def token_text(tokens) -> str:
+    return ''.join(value for kind, value in tokens)
+
+def expression_key(tokens) -> str:
+    '''The text of an expression with identifiers and keywords lowercased, string literals as written.'''
+    return ''.join(value if kind == 'string' else value.lower() for kind, value in tokens)
+
+def strip_spaces(tokens) -> list:
+    start, end = 0, len(tokens)
+    while start < end and tokens[start][0] == 'space':
+        start += 1
+    while end > start and tokens[end - 1][0] == 'space':
+        end -= 1
+    return tokens[start:end]
+
+
+class QueryLog:
+    '''
+    Timings of the queries run by the SQL tools, kept in memory (the last max_entries)
+    and, if path is set, appended to a JSONL file so the advisor can use them later.
+    '''
+
+    def __init__(self, max_entries=10000, path=None):
+        self.path = path
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, max_entries=10000):
+        log = cls(max_entries=max_entries, path=path)
+        if os.path.exists(path):
+            with open(path) as f:
+                log._entries.extend(json.loads(line) for line in f if line.strip())
+        return log
+
+    def record(self, database, query, seconds, rows=None, error=None, rewritten=None):
+        entry = {
+            'database': database,
+            'query': query,
+            'normalized': normalize_sql(query),
+            'seconds': seconds,
+            'rows': rows,
+            'error': error,
+            'rewritten': rewritten,
+            'timestamp': time.time(),
+        }
+        with self._lock:
+            self._entries.append(entry)
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+
+    def entries(self, database=None) -> list:
+        with self._lock:
+            return [entry for entry in self._entries if database is None or entry['database'] == database]
+
+    def shapes(self, database=None) -> dict:
+        '''Successful queries grouped by their normalized text: count, total seconds and an example.'''
+        shapes = {}
+        for entry in self.entries(database):
+            if entry['error']:
+                continue
+            shape = shapes.setdefault(entry['normalized'], {'count': 0, 'seconds': 0.0, 'query': entry['query']})
+            shape['count'] += 1
+            shape['seconds'] += entry['seconds']
+        return shapes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def parse_simple_select(query):
+    '''
+    Split a single-table SELECT into its clauses, as lists of tokens of the normalized query.
+    Returns None for anything more complex (joins, subqueries, unions, CTEs).
+    '''
+    clauses = {}
+    current = None
+    depth = 0
+    tokens = sql_tokens(normalize_sql(query))
+    i = 0
+    while i < len(tokens):
+        kind, value = tokens[i]
+        lower = value.lower()
+        if value == '(':
+            depth += 1
+        elif value == ')':
+            depth -= 1
+        elif kind == 'word':
+            if lower in NOT_SIMPLE or (lower == 'select' and current is not None):
+                return None
+            if depth == 0 and lower in CLAUSES:
+                if lower in clauses:
+                    return None
+                current = lower
+                clauses[current] = []
+                i += 1
+                if lower in ('group', 'order'):
+                    # skip the 'by'
+                    while i < len(tokens) and tokens[i][1].lower() != 'by':
+                        i += 1
+                    i += 1
+                continue
+        if current is None:
+            return None
+        clauses[current].append((kind, value))
+        i += 1
+
+    clauses = {name: strip_spaces(clause_tokens) for name, clause_tokens in clauses.items()}
+    if 'select' not in clauses or len(clauses.get('from', [])) != 1:
+        return None
+    return clauses
+
+def render(clauses) -> str:
+    keywords = {'group': 'group by', 'order': 'order by'}
+    return ' '.join(f'{keywords.get(name, name)} {token_text(clauses[name])}' for name in CLAUSES if name in clauses)
+
+def table_of(clauses) -> str:
+    return _unquote(clauses['from'][0][1])
+
+def columns_in(tokens, table_columns) -> list:
+    '''The table columns referenced in a clause, in order of first use.'''
+    found = []
+    for kind, value in tokens:
+        if kind in ('word', 'quoted'):
+            column = table_columns.get(_unquote(value).lower())
+            if column is not None and column not in found:
+                found.append(column)
+    return found
+
+def calls_in(tokens, functions) -> list:
+    '''(start, end) spans of the outermost calls to any of functions in a token list.'''
+    spans = []
+    i = 0
+    while i < len(tokens) - 1:
+        kind, value = tokens[i]
+        if kind == 'word' and value.lower() in functions and tokens[i + 1][1] == '(':
+            depth = 0
+            for j in range(i + 1, len(tokens)):
+                if tokens[j][1] == '(':
+                    depth += 1
+                elif tokens[j][1] == ')':
+                    depth -= 1
+                    if depth == 0:
+                        break
+            spans.append((i, j + 1))
+            i = j + 1
+            continue
+        i += 1
+    return spans
+
+def group_columns(clauses, table_columns):
+    '''The GROUP BY columns, or None if the query isn't grouped by plain columns.'''
+    if 'group' not in clauses:
+        return None
+    items = [strip_spaces(item) for item in split_items(clauses['group'])]
+    columns = [table_columns.get(_unquote(item[0][1]).lower()) if len(item) == 1 else None for item in items]
+    return None if None in columns else columns
+
+def split_items(tokens) -> list:
+    items, current, depth = [], [], 0
+    for token in tokens:
+        if token[1] == '(':
+            depth += 1
+        elif token[1] == ')':
+            depth -= 1
+        if token[1] == ',' and depth == 0:
+            items.append(current)
+            current = []
+        else:
+            current.append(token)
+    items.append(current)
+    return items
+
+def _replace_calls(tokens, replacements, alias=False) -> list:
+    '''
+    Replace calls whose expression_key is in replacements with a column name. With alias,
+    a call that's a whole select item keeps its original name in the output.
+    '''
+    out = []
+    last = 0
+    for start, end in calls_in(tokens, SCALAR_FUNCTIONS | AGGREGATES):
+        original = token_text(tokens[start:end])
+        column = replacements.get(expression_key(tokens[start:end]))
+        if column is None:
+            continue
+        out += tokens[last:start]
+        following = strip_spaces(tokens[end:])
+        whole_item = not following or following[0][1] == ','
+        replacement = quote_identifier(column) + (f' as {quote_identifier(original)}' if alias and whole_item else '')
+        out.append(('quoted', replacement))
+        last = end
+    return out + tokens[last:]
+
+
+class QueryRewriter:
+    '''
+    Rewrites queries to use the generated columns and summary tables the advisor created.
+
+    Rules are kept per database. Rules that depend on the data (summary tables) carry the
+    database version they were built at and stop applying as soon as the database changes.
+    For SQLite files the rules are saved next to the database, so they outlive the process
+    that created them: load() picks them up, and again whenever the file changes.
+    '''
+
+    def __init__(self):
+        self._rules = defaultdict(list)
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _rules_path(db):
+        path = sqlite_path(db)
+        return path + '.rewrites.json' if path is not None else None
+
+    def load(self, db):
+        '''Replace the rules of a database with the ones saved next to it, if they changed since the last load.'''
+        path = self._rules_path(db)
+        if path is None:
+            return
+        try:
+            stamp = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        database = database_identity(db)
+        with self._lock:
+            if self._loaded.get(database) == stamp:
+                return
+            try:
+                with open(path, 'r') as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                return
+            self._rules[database] = saved.get('rules', [])
+            self._loaded[database] = stamp
+
+    def save(self, db):
+        path = self._rules_path(db)
+        if path is None:
+            return
+        database = database_identity(db)
+        with self._lock:
+            saved = {'database': database, 'version': database_version(db), 'rules': self._rules.get(database, [])}
+            try:
+                with open(path + '.tmp', 'w') as f:
+                    json.dump(saved, f)
+                os.replace(path + '.tmp', path)
+                self._loaded[database] = os.stat(path).st_mtime_ns
+            except OSError:
+                pass
+
+    def add(self, database, rule, version=None):
+        with self._lock:
+            self._rules[database].append(dict(rule, version=version))
+
+    def restamp(self, database, version, current):
+        '''
+        Mark the rules stamped with one of the current versions as up to date at version, after
+        the advisor changed the database itself. Rules that were already stale stay stale.
+        '''
+        with self._lock:
+            for rule in self._rules[database]:
+                if rule['version'] is not None and rule['version'] in current:
+                    rule['version'] = version
+
+    def rules(self, database) -> list:
+        with self._lock:
+            return list(self._rules.get(database, []))
+
+    def clear(self, database=None):
+        '''Forget rules in memory, saved rules are loaded again on the next load().'''
+        with self._lock:
+            if database is None:
+                self._rules.clear()
+                self._loaded.clear()
+            else:
+                self._rules.pop(database, None)
+                self._loaded.pop(database, None)
+
+    def rewrite(self, database, query, version=None):
+        '''The rewritten query, or None if no rule applies.'''
+        rules = [rule for rule in self.rules(database) if rule['version'] in (None, version)]
+        if not rules:
+            return None
+        clauses = parse_simple_select(query)
+        if clauses is None:
+            return None
+        table = table_of(clauses).lower()
+        rules = [rule for rule in rules if rule['table'].lower() == table]
+
+        expressions = {rule['expression']: rule['column'] for rule in rules if rule['kind'] == 'expression'}
+        rewritten = {
+            name: _replace_calls(clause_tokens, expressions, alias=name == 'select')
+            for name, clause_tokens in clauses.items()
+        }
+
+        for rule in rules:
+            if rule['kind'] == 'summary' and self._matches_summary(rewritten, rule):
+                rewritten = {
+                    name: _replace_calls(clause_tokens, rule['aggregates'], alias=name == 'select')
+                    for name, clause_tokens in rewritten.items()
+                }
+                rewritten['from'] = [('quoted', quote_identifier(rule['summary_table']))]
+                break
+
+        query = render(rewritten)
+        return query if query != render(clauses) else None
+
+    @staticmethod
+    def _matches_summary(clauses, rule) -> bool:
+        if 'where' in clauses or 'group' not in clauses:
+            return False
+        group = [_unquote(value).lower() for kind, value in strip_spaces(clauses['group']) if kind in ('word', 'quoted')]
+        if group != rule['group']:
+            return False
+        for name in ('select', 'having', 'order'):
+            for start, end in calls_in(clauses.get(name, []), AGGREGATES):
+                if expression_key(clauses[name][start:end]) not in rule['aggregates']:
+                    return False
+        return True
+
+
+class QueryAdvisor:
+    '''
+    Reads the query log for a SQLite database and proposes indexes on frequently filtered and
+    grouped columns, generated columns for frequently computed expressions (e.g. the deck, num
+    and side parts of Cabin) and pre-aggregated summary tables for repeated GROUP BY queries.
+
+    apply() creates them through a separate writable connection, registers (and saves) rewrite rules
+    so the SQL tools use them, and reports the latency of the affected queries before and after.
+    Indexes that made their queries slower are dropped again.
+    '''
+
+    def __init__(self, db, log=None, rewriter=None, min_count=3, db_path=None):
+        self.db = db
+        self.database = database_identity(db)
+        self.log = log if log is not None else shared_query_log
+        self.rewriter = rewriter if rewriter is not None else shared_query_rewriter
+        self.min_count = min_count
+        self.db_path = db_path or self._sqlite_path(db)
+
+    @staticmethod
+    def _sqlite_path(db) -> str:
+        path = sqlite_path(db)
+        if path is None:
+            raise ValueError('QueryAdvisor only supports SQLite database files')
+        return path
+
+    def _connect(self, read_only=False):
+        if read_only:
+            return sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True)
+        return sqlite3.connect(self.db_path)
+
+    @staticmethod
+    def table_columns(connection, table) -> dict:
+        '''Lowercased name -> name, including generated columns.'''
+        return {row[1].lower(): row[1] for row in connection.execute(f'PRAGMA table_xinfo({quote_identifier(table)})')}
+
+    @staticmethod
+    def indexed_prefixes(connection, table) -> list:
+        '''The lowercased column lists of a table's indexes.'''
+        prefixes = []
+        for index in connection.execute(f'PRAGMA index_list({quote_identifier(table)})').fetchall():
+            columns = connection.execute(f'PRAGMA index_info({quote_identifier(index[1])})').fetchall()
+            prefixes.append([(column[2] or '').lower() for column in columns])
+        return prefixes
+
+    @staticmethod
+    def expression_column_name(expression, taken) -> str:
+        for pattern, part in KNOWN_EXPRESSIONS:
+            match = pattern.match(expression)
+            if match:
+                name = f'{match.group("column")}_{part}'
+                break
+        else:
+            name = '_'.join(re.findall(r'[a-z0-9]+', expression.lower()))[:40] or 'expr'
+        candidate, n = name, 2
+        while candidate.lower() in taken:
+            candidate, n = f'{name}_{n}', n + 1
+        return candidate
+
+    def recommend(self) -> list:
+        '''Recommendations, most time-consuming query shapes first.'''
+        expressions = {}
+        filters = {}
+        groupings = {}
+        summaries = {}
+
+        with self._connect(read_only=True) as connection:
+            table_columns = {}
+            for normalized, shape in self.log.shapes(self.database).items():
+                clauses = parse_simple_select(shape['query'])
+                if clauses is None:
+                    continue
+                table = table_of(clauses)
+                if table.lower() not in table_columns:
+                    try:
+                        table_columns[table.lower()] = self.table_columns(connection, table)
+                    except sqlite3.Error:
+                        continue
+                columns = table_columns[table.lower()]
+                if not columns:
+                    continue
+
+                def count(candidates, key, **info):
+                    candidate = candidates.setdefault(key, {'count': 0, 'seconds': 0.0, 'queries': [], **info})
+                    candidate['count'] += shape['count']
+                    candidate['seconds'] += shape['seconds']
+                    candidate['queries'].append(shape['query'])
+                    return candidate
+
+                # expressions computed from columns, in any clause
+                for name, clause_tokens in clauses.items():
+                    for start, end in calls_in(clause_tokens, SCALAR_FUNCTIONS):
+                        call = clause_tokens[start:end]
+                        if columns_in(call, columns) and not calls_in(call, AGGREGATES):
+                            candidate = count(expressions, (table, expression_key(call)), filtered=False, expression=token_text(call))
+                            candidate['filtered'] |= name in ('where', 'group')
+
+                where_columns = columns_in(clauses.get('where', []), columns)
+                if where_columns:
+                    count(filters, (table, tuple(where_columns[:3])))
+
+                grouped_by = group_columns(clauses, columns)
+                if grouped_by is None:
+                    continue
+                aggregates = {
+                    expression_key(clause_tokens[start:end]): token_text(clause_tokens[start:end])
+                    for name in ('select', 'having', 'order')
+                    for clause_tokens in [clauses.get(name, [])]
+                    for start, end in calls_in(clause_tokens, AGGREGATES)
+                }
+                bare_columns = set(columns_in(
+                    [token for i, token in enumerate(clauses['select'])
+                     if not any(start <= i < end for start, end in calls_in(clauses['select'], AGGREGATES))],
+                    columns
+                ))
+                if 'where' not in clauses and aggregates and bare_columns <= set(grouped_by):
+                    candidate = count(summaries, (table, tuple(grouped_by)), aggregates={})
+                    candidate['aggregates'].update(aggregates)
+                else:
+                    count(groupings, (table, tuple(grouped_by)))
+
+            recommendations = []
+            taken = {column for columns in table_columns.values() for column in columns}
+            for (table, key), candidate in expressions.items():
+                if candidate['count'] < self.min_count:
+                    continue
+                # the key only matches calls, the column is defined by the text as it was written
+                expression = candidate.pop('expression')
+                column = self.expression_column_name(key, taken)
+                taken.add(column.lower())
+                statements = [
+                    f'ALTER TABLE {quote_identifier(table)} ADD COLUMN {quote_identifier(column)} GENERATED ALWAYS AS ({expression}) VIRTUAL'
+                ]
+                if candidate['filtered']:
+                    statements.append(f'CREATE INDEX IF NOT EXISTS {quote_identifier(f"idx_{table}_{column}")} ON {quote_identifier(table)} ({quote_identifier(column)})')
+                recommendations.append({
+                    'kind': 'generated_column',
+                    'name': column,
+                    'table': table,
+                    'statements': statements,
+                    'reason': f'{expression} is computed in {candidate["count"]} queries',
+                    'rule': {'kind': 'expression', 'table': table, 'expression': key, 'column': column},
+                    **candidate
+                })
+
+            for kind, candidates in (('filter', filters), ('group', groupings)):
+                for (table, index_columns), candidate in candidates.items():
+                    if candidate['count'] < self.min_count:
+                        continue
+                    lowered = [column.lower() for column in index_columns]
+                    if any(prefix[:len(lowered)] == lowered for prefix in self.indexed_prefixes(connection, table)):
+                        continue
+                    name = f'idx_{table}_{"_".join(index_columns)}'
+                    recommendations.append({
+                        'kind': 'index',
+                        'name': name,
+                        'table': table,
+                        'statements': [
+                            f'CREATE INDEX IF NOT EXISTS {quote_identifier(name)} ON {quote_identifier(table)} ({", ".join(map(quote_identifier, index_columns))})'
+                        ],
+                        'reason': f'{"filtered" if kind == "filter" else "grouped"} on {", ".join(index_columns)} in {candidate["count"]} queries',
+                        'rule': None,
+                        **candidate
+                    })
+
+            for (table, grouped_by), candidate in summaries.items():
+                if candidate['count'] < self.min_count:
+                    continue
+                summary_table = f'summary_{table}_by_{"_".join(grouped_by)}'
+                texts = candidate.pop('aggregates')
+                aggregates = {key: f'agg_{i}' for i, key in enumerate(sorted(texts))}
+                group_list = ', '.join(map(quote_identifier, grouped_by))
+                select_list = ', '.join([group_list] + [f'{texts[key]} AS {quote_identifier(column)}' for key, column in aggregates.items()])
+                recommendations.append({
+                    'kind': 'summary_table',
+                    'name': summary_table,
+                    'table': table,
+                    'statements': [
+                        f'DROP TABLE IF EXISTS {quote_identifier(summary_table)}',
+                        f'CREATE TABLE {quote_identifier(summary_table)} AS SELECT {select_list} FROM {quote_identifier(table)} GROUP BY {group_list}'
+                    ],
+                    'reason': f'grouped by {", ".join(grouped_by)} without a filter in {candidate["count"]} queries',
+                    'rule': {
+                        'kind': 'summary',
+                        'table': table,
+                        'group': [column.lower() for column in grouped_by],
+                        'aggregates': aggregates,
+                        'summary_table': summary_table
+                    },
+                    **candidate
+                })
+
+        return sorted(recommendations, key=lambda recommendation: recommendation['seconds'], reverse=True)
+
+    def time_query(self, query, repeats=3) -> float:
+        '''Median seconds to run a query to completion, on a fresh read-only connection.'''
+        timings = []
+        with self._connect(read_only=True) as connection:
+            for _ in range(repeats):
+                start = time.perf_counter()
+                connection.execute(query).fetchall()
+                timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
+
+    def _executed(self, query) -> str:
+        return self.rewriter.rewrite(self.database, query, database_version(self.db)) or query
+
+    def apply(self, recommendations=None, repeats=3, keep_slower=False) -> list:
+        '''
+        Create the recommended objects, register their rewrite rules and time the affected
+        queries before and after. Returns one report entry per recommendation.
+        '''
+        # keep the rules an earlier run saved, they're written back with ours
+        self.rewriter.load(self.db)
+        current = {database_version(self.db)}
+        if recommendations is None:
+            recommendations = self.recommend()
+        # generated columns first, indexes and summary tables may be built on them
+        order = {'generated_column': 0, 'index': 1, 'summary_table': 2}
+        recommendations = sorted(recommendations, key=lambda recommendation: order[recommendation['kind']])
+
+        report = []
+        for recommendation in recommendations:
+            queries = list(dict.fromkeys(recommendation['queries']))
+            before = {query: self.time_query(self._executed(query), repeats) for query in queries}
+            entry = {
+                'kind': recommendation['kind'],
+                'name': recommendation['name'],
+                'reason': recommendation['reason'],
+                'statements': recommendation['statements'],
+                'status': 'applied',
+                'queries': [],
+            }
+            try:
+                with self._connect() as connection:
+                    for statement in recommendation['statements']:
+                        connection.execute(statement)
+            except sqlite3.Error as e:
+                entry['status'] = f'failed: {e}'
+                report.append(entry)
+                continue
+
+            rule = recommendation['rule']
+            if rule is not None:
+                version = database_version(self.db) if rule['kind'] == 'summary' else None
+                current.add(version)
+                self.rewriter.add(self.database, rule, version=version)
+
+            for query in queries:
+                executed = self._executed(query)
+                entry['queries'].append({
+                    'query': query,
+                    'rewritten': executed if executed != query else None,
+                    'before': before[query],
+                    'after': self.time_query(executed, repeats),
+                })
+
+            slower = sum(item['after'] for item in entry['queries']) > 1.1 * sum(before.values())
+            if recommendation['kind'] == 'index' and slower and not keep_slower:
+                with self._connect() as connection:
+                    connection.execute(f'DROP INDEX IF EXISTS {quote_identifier(recommendation["name"])}')
+                entry['status'] = 'reverted, it made the queries slower'
+            report.append(entry)
+
+        # our own changes bumped the database version, the summary tables are still current
+        self.rewriter.restamp(self.database, database_version(self.db), current)
+        self.rewriter.save(self.db)
+        return report
+
+
+def print_report(report):
+    if not report:
+        print('No recommendations, the query log has no query shapes repeated often enough.')
+        return
+    for entry in report:
+        print(f'\n[{entry["status"]}] {entry["kind"]} {entry["name"]}: {entry["reason"]}')
+        for statement in entry['statements']:
+            print(f'    {statement}')
+        for item in entry['queries']:
+            speedup = item['before'] / item['after'] if item['after'] else float('inf')
+            print(f'    {item["before"] * 1000:9.2f} ms -> {item["after"] * 1000:9.2f} ms ({speedup:.1f}x)  {item["query"][:80]}')
+            if item['rewritten']:
+                print(f'    {"":>28}rewritten: {item["rewritten"][:80]}')
+
+
+# shared by every QuerySQLLimitedDataBaseTool, set QUERY_LOG_PATH to also keep the log on disk
+shared_query_log = QueryLog(path=os.environ.get('QUERY_LOG_PATH'))
+shared_query_rewriter = QueryRewriter()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recommend (and optionally create) indexes, generated columns and summary tables from a query log.')
+    parser.add_argument('db_uri', help='e.g. sqlite:///./spaceship_titanic.db')
+    parser.add_argument('query_log', help='a JSONL query log written with QUERY_LOG_PATH set')
+    parser.add_argument('--min-count', type=int, default=3)
+    parser.add_argument('--apply', action='store_true', help='create the recommended objects and time the queries before and after')
+    args = parser.parse_args()
+
+    from tools.db_registry import get_database
+
+    db = get_database(args.db_uri)
+    log = QueryLog.load(args.query_log)
+    # the log records the database as the tools opened it, read-only
+    advisor = QueryAdvisor(db, log=log, min_count=args.min_count)
+    if args.apply:
+        print_report(advisor.apply())
+    else:
+        for recommendation in advisor.recommend():
+            print(f'{recommendation["kind"]} {recommendation["name"]}: {recommendation["reason"]}')
+            for statement in recommendation['statements']:
+                print(f'    {statement}')
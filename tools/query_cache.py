@@ -0,0 +1,191 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+
+SQL_KEYWORDS = {
+    'select', 'from', 'where', 'group', 'by', 'order', 'having', 'limit', 'offset', 'as', 'and', 'or',
+    'not', 'in', 'is', 'null', 'like', 'between', 'case', 'when', 'then', 'else', 'end', 'join', 'inner',
+    'left', 'right', 'outer', 'full', 'cross', 'on', 'using', 'union', 'all', 'distinct', 'with', 'asc',
+    'desc', 'exists', 'intersect', 'except', 'cast', 'count', 'sum', 'avg', 'min', 'max', 'round',
+    'coalesce', 'ifnull', 'nullif', 'substr', 'substring', 'length', 'lower', 'upper', 'abs', 'total',
+    'true', 'false', 'glob', 'escape', 'collate', 'nocase', 'integer', 'real', 'text', 'float',
+}
+
+_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<quoted>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    | (?P<space>\s+)
+    | (?P<other>.)
+    """,
+    re.VERBOSE | re.DOTALL
+)
+
+_PUNCTUATION = set('(),;=<>+-*/%|.')
+
+
+def sql_tokens(query: str) -> list:
+    '''Split SQL text into (kind, value) tokens, kind is comment, string, quoted, word, space or other.'''
+    return [(match.lastgroup, match.group()) for match in _TOKEN_PATTERN.finditer(query)]
+
+
+def normalize_sql(query: str) -> str:
+    '''
+    Normalize SQL text so trivially different queries share a cache key.
+
+    Comments are dropped, whitespace is collapsed, keywords are lowercased and trailing
+    semicolons are removed. String literals and quoted identifiers are left untouched.
+    '''
+    tokens = []
+    pending_space = False
+    for kind, value in sql_tokens(query):
+        if kind in ('comment', 'space'):
+            pending_space = True
+            continue
+        if kind == 'word' and value.lower() in SQL_KEYWORDS:
+            value = value.lower()
+        if pending_space and tokens and value not in _PUNCTUATION and tokens[-1] not in _PUNCTUATION:
+            tokens.append(' ')
+        pending_space = False
+        tokens.append(value)
+
+    while tokens and tokens[-1] in (';', ' '):
+        tokens.pop()
+    return ''.join(tokens)
+
+
+def is_read_only_query(query: str) -> bool:
+    '''Only plain reads are safe to cache.'''
+    normalized = normalize_sql(query)
+    return normalized.startswith(('select', 'with')) and ';' not in normalized
+
+
+def database_identity(db) -> str:
+    '''A stable identity for a langchain SQLDatabase.'''
+    return db._engine.url.render_as_string(hide_password=True)
+
+
+def sqlite_path(db):
+    '''The file of a SQLite database, or None for other databases and in-memory SQLite.'''
+    url = db._engine.url
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    path = url.database
+    return path[len('file:'):] if path.startswith('file:') else path
+
+
+def quote_identifier(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def database_version(db, epoch=None):
+    '''
+    A stamp that changes whenever the database contents may have changed.
+
+    SQLite files are stamped with their mtime and size (and those of the WAL file, if any).
+    Other databases have no cheap stamp, so callers pass an epoch they bump themselves.
+    '''
+    if epoch is not None:
+        return str(epoch)
+
+    path = sqlite_path(db)
+    if path is not None:
+        stamps = []
+        for file_path in (path, path + '-wal'):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            stamps.append(f'{stat.st_mtime_ns}:{stat.st_size}')
+        return '|'.join(stamps)
+
+    return 'static'
+
+
+class QueryResultCache:
+    '''
+    In-memory LRU cache of query results, bounded by the total size of the cached results.
+
+    Keys are (database identity, database version, normalized SQL, extra). When a database's
+    version changes, all of its older entries are dropped.
+    '''
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(key, value) -> int:
+        return len(value.encode('utf-8')) + len(key[2].encode('utf-8'))
+
+    def make_key(self, identity, version, query, extra=None):
+        return (identity, version, normalize_sql(query), extra)
+
+    def _check_version(self, identity, version):
+        # invalidate everything cached for this database under an older version
+        if self._versions.get(identity) == version:
+            return
+        self._versions[identity] = version
+        stale = [key for key in self._entries if key[0] == identity and key[1] != version]
+        for key in stale:
+            self._remove(key)
+
+    def _remove(self, key):
+        value, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def get(self, key):
+        with self._lock:
+            self._check_version(key[0], key[1])
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        size = self._size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(key[0], key[1])
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+        }
+
+
+# shared by every QuerySQLLimitedDataBaseTool unless a tool is given its own cache
+shared_query_cache = QueryResultCache()
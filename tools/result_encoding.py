@@ -0,0 +1,106 @@
+import csv
+import io
+import math
+from collections import Counter
+
+import tracing
+
+
+class ResultEncoder:
+    '''
+    Encodes query results for an LLM's context as compactly as possible.
+
+    Rows are written once under a single header line, as CSV or TSV, whichever the token
+    estimator says is cheaper, with floats rounded to float_digits decimals. When even the
+    cheapest table is over token_budget, the result is summarised instead: the row count,
+    then per column the null count and either count/mean/min/max or the top_k values,
+    followed by as many sample rows as still fit.
+    '''
+
+    def __init__(self, formats=('csv', 'tsv'), float_digits=4, token_budget=1500, top_k=5, null='NULL', estimate_tokens=tracing.estimate_tokens):
+        self.formats = formats
+        self.float_digits = float_digits
+        self.token_budget = token_budget
+        self.top_k = top_k
+        self.null = null
+        self.estimate_tokens = estimate_tokens
+
+    def cache_key(self) -> tuple:
+        '''The settings that change the output, for result caches.'''
+        return (tuple(self.formats), self.float_digits, self.token_budget, self.top_k, self.null)
+
+    def format_value(self, value) -> str:
+        if value is None:
+            return self.null
+        if isinstance(value, float):
+            if math.isnan(value) or math.isinf(value):
+                return str(value)
+            if value == int(value) and abs(value) < 1e15:
+                return str(int(value))
+            return f'{value:.{self.float_digits}f}'.rstrip('0').rstrip('.')
+        if isinstance(value, bytes):
+            return f'<{len(value)} bytes>'
+        return str(value)
+
+    def to_csv(self, columns, rows) -> str:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(columns)
+        writer.writerows([self.format_value(value) for value in row] for row in rows)
+        return buffer.getvalue().rstrip('\n')
+
+    def to_tsv(self, columns, rows) -> str:
+        def cell(value):
+            return self.format_value(value).replace('\t', ' ').replace('\n', ' ')
+        lines = ['\t'.join(str(column) for column in columns)]
+        lines += ['\t'.join(cell(value) for value in row) for row in rows]
+        return '\n'.join(lines)
+
+    def encode_table(self, columns, rows):
+        '''The cheapest of the table formats, as (text, tokens).'''
+        encoders = {'csv': self.to_csv, 'tsv': self.to_tsv}
+        candidates = [encoders[name](columns, rows) for name in self.formats]
+        return min(((text, self.estimate_tokens(text)) for text in candidates), key=lambda candidate: candidate[1])
+
+    def summarize_column(self, name, values) -> str:
+        present = [value for value in values if value is not None]
+        nulls = len(values) - len(present)
+        numbers = [value for value in present if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        if present and len(numbers) == len(present):
+            return (
+                f'{name}: numeric, {len(numbers)} values, {nulls} null, '
+                f'mean {self.format_value(sum(numbers) / len(numbers))}, '
+                f'min {self.format_value(min(numbers))}, max {self.format_value(max(numbers))}'
+            )
+        counts = Counter(self.format_value(value) for value in present)
+        top = ', '.join(f'{value} ({count})' for value, count in counts.most_common(self.top_k))
+        return f'{name}: {len(counts)} distinct, {nulls} null, top: {top}'
+
+    def summarize(self, columns, rows) -> str:
+        lines = [f'{len(rows)} rows, too large to show in full. Summary per column:']
+        lines += [
+            self.summarize_column(column, [row[i] for row in rows])
+            for i, column in enumerate(columns)
+        ]
+        summary = '\n'.join(lines)
+
+        # add as many sample rows as still fit in the budget
+        remaining = self.token_budget - self.estimate_tokens(summary)
+        low, high = 0, len(rows)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.encode_table(columns, rows[:middle])[1] + 10 <= remaining:
+                low = middle
+            else:
+                high = middle - 1
+        if low:
+            summary += f'\nFirst {low} rows:\n' + self.encode_table(columns, rows[:low])[0]
+        return summary
+
+    def encode(self, columns, rows) -> str:
+        if not rows:
+            return (','.join(str(column) for column in columns) + '\n(no rows)') if columns else '(no rows)'
+        text, tokens = self.encode_table(columns, rows)
+        if self.token_budget is None or tokens <= self.token_budget:
+            return text
+        return self.summarize(columns, rows)
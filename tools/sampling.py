@@ -0,0 +1,304 @@
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+
+from tools.schema_profile import shared_profile_store
+from tools.query_cache import sqlite_path, quote_identifier
+from tools.query_advisor import AGGREGATES, parse_simple_select, table_of, calls_in, token_text, strip_spaces, split_items, render
+from tools.db_registry import get_database
+
+
+# queries with this marker always run on the full tables
+EXACT_MARKER = re.compile(r'(--\s*exact\b|/\*\s*exact\s*\*/)', re.IGNORECASE)
+WEIGHT = '"_weight"'
+Z_95 = 1.96
+
+
+def wants_exact(query: str) -> bool:
+    return bool(EXACT_MARKER.search(query))
+
+
+def weighted_aggregate(name, argument):
+    '''
+    The sample estimate of an aggregate and the SQL for its variance, or None for the variance
+    when there's no error bound (min, max, count distinct...). Rows are weighted by the inverse
+    of their inclusion probability and the variance is the Horvitz-Thompson estimate,
+    sum(w * (w - 1) * y^2).
+    '''
+    w = WEIGHT
+    if argument.lower().startswith('distinct') or name not in ('count', 'sum', 'total', 'avg'):
+        return None, None
+    if name == 'count':
+        if argument == '*':
+            return f'total({w})', f'total({w}*({w}-1))'
+        present = f'({argument}) is not null'
+        return f'total(case when {present} then {w} else 0 end)', f'total(case when {present} then {w}*({w}-1) else 0 end)'
+    x = f'({argument})'
+    if name in ('sum', 'total'):
+        return f'{name}({x}*{w})', f'total({x}*{x}*{w}*({w}-1))'
+
+    # avg is a ratio estimate, its variance is linearised around the estimate r
+    weight_sum = f'total(case when {x} is not null then {w} end)'
+    r = f'(total({x}*{w})/nullif({weight_sum},0))'
+    variance = (
+        f'((total({x}*{x}*{w}*({w}-1)) - 2*{r}*total({x}*{w}*({w}-1)) '
+        f'+ {r}*{r}*total(case when {x} is not null then {w}*({w}-1) end))/nullif({weight_sum}*{weight_sum},0))'
+    )
+    return r, variance
+
+
+class SampleStore:
+    '''
+    Keeps stratified samples of the large tables of SQLite databases, in a sidecar file next
+    to the database (<db>.samples.sqlite), and plans approximate queries against them.
+
+    Tables with more than threshold_rows rows are sampled down to about sample_rows rows,
+    stratified on up to two low-cardinality columns from the schema profile, with at least
+    min_per_stratum rows from every stratum so rare groups still show up. Each sampled row
+    carries a _weight (the number of rows it stands for). Samples are rebuilt when the table's
+    profile fingerprint changes.
+    '''
+
+    def __init__(self, profile_store=None, threshold_rows=1_000_000, sample_rows=100_000, min_per_stratum=100, max_strata=200):
+        self.profile_store = profile_store if profile_store is not None else shared_profile_store
+        self.threshold_rows = threshold_rows
+        self.sample_rows = sample_rows
+        self.min_per_stratum = min_per_stratum
+        self.max_strata = max_strata
+        self.approximate_queries = 0
+        self.exact_queries = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def sidecar_path(db):
+        path = sqlite_path(db)
+        if path is None:
+            return None
+        return path, path + '.samples.sqlite'
+
+    def strata_columns(self, table_profile) -> list:
+        '''Up to two low-cardinality, mostly non-null columns, with at most max_strata combinations.'''
+        candidates = sorted(
+            (column['distinct'], name)
+            for name, column in table_profile['columns'].items()
+            if 1 < column['distinct'] <= 50 and column['null_rate'] < 0.5
+        )
+        strata, combinations = [], 1
+        for distinct, name in candidates:
+            if len(strata) == 2 or combinations * (distinct + 1) > self.max_strata:
+                break
+            strata.append(name)
+            combinations *= distinct + 1
+        return strata
+
+    def _build(self, source_path, sidecar, table, table_profile, fingerprint):
+        strata = self.strata_columns(table_profile)
+        rows = table_profile['row_count']
+        fraction = min(1.0, self.sample_rows / max(rows, 1))
+        columns = ', '.join(quote_identifier(name) for name in table_profile['columns'])
+        partition = f'PARTITION BY {", ".join(map(quote_identifier, strata))}' if strata else ''
+        keep = f'max(min(_stratum_rows, {int(self.min_per_stratum)}), cast(round(_stratum_rows * {fraction!r}) as integer))'
+
+        print(f'Building a stratified sample of {table} ({rows} rows, strata {strata})...')
+        start = time.perf_counter()
+        # a uri connection, so the source can be attached read-only
+        connection = sqlite3.connect(f'file:{sidecar}', uri=True)
+        try:
+            connection.execute('ATTACH DATABASE ? AS source', (f'file:{source_path}?mode=ro',))
+            with connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS _samples ('
+                    'table_name TEXT PRIMARY KEY, fingerprint TEXT, strata TEXT, '
+                    'rows INTEGER, sample_rows INTEGER, built_at REAL)'
+                )
+                connection.execute(f'DROP TABLE IF EXISTS main.{quote_identifier(table)}')
+                connection.execute(
+                    f'CREATE TABLE main.{quote_identifier(table)} AS '
+                    f'SELECT {columns}, _stratum_rows * 1.0 / {keep} AS _weight FROM ('
+                    f'  SELECT *, row_number() OVER ({partition} ORDER BY random()) AS _row, '
+                    f'  count(*) OVER ({partition}) AS _stratum_rows FROM source.{quote_identifier(table)}'
+                    f') WHERE _row <= {keep}'
+                )
+                sample_rows = connection.execute(f'SELECT count(*) FROM main.{quote_identifier(table)}').fetchone()[0]
+                connection.execute(
+                    'INSERT OR REPLACE INTO _samples VALUES (?, ?, ?, ?, ?, ?)',
+                    (table, json.dumps(fingerprint), json.dumps(strata), rows, sample_rows, time.time())
+                )
+        finally:
+            connection.close()
+        print(f'Sampled {sample_rows} of {rows} rows from {table} in {time.perf_counter() - start:.1f}s')
+
+    @staticmethod
+    def estimated_rows(source_path, table):
+        '''
+        A cheap upper estimate of a table's row count: max(rowid), which is an index lookup, or
+        sqlite_stat1 for WITHOUT ROWID tables. None if there's no such table.
+        '''
+        try:
+            connection = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True)
+        except sqlite3.Error:
+            return None
+        try:
+            row = connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ? COLLATE NOCASE", (table,)
+            ).fetchone()
+            if row is None:
+                return None
+            table = row[0]
+            try:
+                return connection.execute(f'SELECT max(rowid) FROM {quote_identifier(table)}').fetchone()[0] or 0
+            except sqlite3.Error:
+                pass
+            try:
+                stat = connection.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1', (table,)).fetchone()
+            except sqlite3.Error:
+                stat = None
+            # without statistics only the profile knows
+            return int(stat[0].split()[0]) if stat and stat[0] else math.inf
+        except sqlite3.Error:
+            return None
+        finally:
+            connection.close()
+
+    def sample_for(self, db, table):
+        '''The sample of a table, built or refreshed if needed, or None if the table isn't sampled.'''
+        paths = self.sidecar_path(db)
+        if paths is None:
+            return None
+        # most tables are small, decide that without profiling the whole database
+        estimate = self.estimated_rows(paths[0], table)
+        if estimate is None or estimate <= self.threshold_rows:
+            return None
+        tables = self.profile_store.get(db)['tables']
+        table = next((name for name in tables if name.lower() == table.lower()), None)
+        if table is None or tables[table]['row_count'] <= self.threshold_rows:
+            return None
+        table_profile = tables[table]
+
+        source_path, sidecar = paths
+        with self._lock:
+            try:
+                with sqlite3.connect(sidecar) as connection:
+                    row = connection.execute(
+                        'SELECT fingerprint, strata, rows, sample_rows FROM _samples WHERE table_name = ?', (table,)
+                    ).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is None or json.loads(row[0]) != table_profile['fingerprint']:
+                self._build(source_path, sidecar, table, table_profile, table_profile['fingerprint'])
+                with sqlite3.connect(sidecar) as connection:
+                    row = connection.execute(
+                        'SELECT fingerprint, strata, rows, sample_rows FROM _samples WHERE table_name = ?', (table,)
+                    ).fetchone()
+
+        return {
+            'table': table,
+            'columns': list(table_profile['columns']),
+            'strata': json.loads(row[1]),
+            'rows': row[2],
+            'sample_rows': row[3],
+            'version': row[0],
+            'db': get_database(f'sqlite:///{sidecar}'),
+        }
+
+    def plan(self, db, query):
+        '''
+        An approximate version of the query, to run against a sample, or None if the query
+        should run on the full table: it's marked `-- exact`, isn't a simple single-table
+        SELECT, or its table is below the size threshold.
+        '''
+        if wants_exact(query):
+            self.exact_queries += 1
+            return None
+        clauses = parse_simple_select(query)
+        if clauses is None:
+            return None
+        sample = self.sample_for(db, table_of(clauses))
+        if sample is None:
+            return None
+
+        select_items = split_items(clauses['select'])
+        estimates, variances, bounded = [], [], {}
+        for index, item in enumerate(select_items):
+            item = strip_spaces(item)
+            if token_text(item) == '*':
+                estimates.append([('quoted', ', '.join(map(quote_identifier, sample['columns'])))])
+                continue
+            spans = calls_in(item, AGGREGATES)
+            whole_call = len(spans) == 1 and spans[0] == (0, len(item))
+            # aggregates inside larger expressions are estimated too, but get no error bound
+            rewritten = self._weigh(item)
+            if whole_call:
+                rewritten.append(('quoted', f' as {quote_identifier(token_text(item))}'))
+                name = item[0][1].lower()
+                estimate, variance = weighted_aggregate(name, token_text(item[2:-1]).strip())
+                if variance is not None:
+                    bounded[index] = len(variances)
+                    variances.append(variance)
+            estimates.append(rewritten)
+
+        variance_items = [[('quoted', f'{variance} as "__variance_{i}"')] for i, variance in enumerate(variances)]
+        items = estimates + variance_items
+        clauses = dict(clauses)
+        clauses['select'] = [token for i, item in enumerate(items) for token in ([('other', ',')] if i else []) + item]
+        for name in ('having', 'order'):
+            if name in clauses:
+                clauses[name] = self._weigh(clauses[name])
+
+        self.approximate_queries += 1
+        return {
+            'query': render(clauses),
+            'bounded': bounded,
+            'variance_columns': len(variances),
+            'sample': sample,
+        }
+
+    @staticmethod
+    def _weigh(tokens) -> list:
+        '''Replace the aggregate calls in a token list with their weighted estimates.'''
+        out, last = [], 0
+        for start, end in calls_in(tokens, AGGREGATES):
+            name = tokens[start][1].lower()
+            estimate, variance = weighted_aggregate(name, token_text(tokens[start + 2:end - 1]).strip())
+            if estimate is None:
+                continue
+            out += tokens[last:start] + [('quoted', estimate)]
+            last = end
+        return out + tokens[last:]
+
+    @staticmethod
+    def attach_bounds(plan, columns, rows, format_value=str):
+        '''Turn the variance columns into "estimate ± 95% margin" values and drop them.'''
+        n = plan['variance_columns']
+        if not n:
+            return columns, rows
+        columns = columns[:-n]
+        bounded_rows = []
+        for row in rows:
+            values, variances = list(row[:-n]), row[-n:]
+            for index, variance_index in plan['bounded'].items():
+                variance = variances[variance_index]
+                if values[index] is not None and variance is not None:
+                    margin = Z_95 * math.sqrt(max(variance, 0.0))
+                    values[index] = f'{format_value(values[index])} ± {format_value(margin)}'
+            bounded_rows.append(tuple(values))
+        return columns, bounded_rows
+
+    @staticmethod
+    def describe(plan) -> str:
+        sample = plan['sample']
+        strata = f', stratified on {", ".join(sample["strata"])}' if sample['strata'] else ''
+        note = (
+            f"(Approximate: computed on a {sample['sample_rows']} row sample of the {sample['rows']} rows "
+            f"in {sample['table']}{strata}."
+        )
+        if plan['bounded']:
+            note += ' ± values are 95% confidence intervals.'
+        return note + ' Add -- exact to the query to run it on the full table.)'
+
+
+# shared by every QuerySQLLimitedDataBaseTool unless a tool is given its own store
+shared_sample_store = SampleStore()
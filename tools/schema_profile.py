@@ -0,0 +1,186 @@
+import json
+import threading
+
+from sqlalchemy import inspect, text
+
+from tools.query_cache import database_identity, database_version, sqlite_path, quote_identifier
+
+
+PROFILE_FORMAT_VERSION = 1
+
+
+def _short(value, length=50):
+    if isinstance(value, str) and len(value) > length:
+        return value[:length] + '...'
+    if isinstance(value, bytes):
+        return f'<{len(value)} bytes>'
+    return value
+
+
+def table_fingerprint(execute, table, dialect, columns) -> list:
+    '''A cheap stamp that changes when a table's rows or columns change.'''
+    if dialect == 'sqlite':
+        row = execute(f'SELECT COUNT(*), MAX(rowid) FROM {quote_identifier(table)}')[0]
+    else:
+        row = execute(f'SELECT COUNT(*) FROM {quote_identifier(table)}')[0]
+    return [list(row), [[column['name'], column['type']] for column in columns]]
+
+
+def profile_table(execute, table, columns, top_k=5, histogram_bins=10) -> dict:
+    '''
+    Profile every column of a table: null rate, distinct count, min/max, top-k values
+    and an equal-width histogram for numeric columns.
+    '''
+    quoted_table = quote_identifier(table)
+
+    # one pass for the per-column aggregates
+    aggregates = ['COUNT(*)']
+    for column in columns:
+        quoted = quote_identifier(column['name'])
+        aggregates += [f'COUNT({quoted})', f'COUNT(DISTINCT {quoted})', f'MIN({quoted})', f'MAX({quoted})']
+    row = execute(f'SELECT {", ".join(aggregates)} FROM {quoted_table}')[0]
+    row_count = row[0]
+
+    column_profiles = {}
+    for i, column in enumerate(columns):
+        non_null, distinct, min_value, max_value = row[1 + 4 * i: 5 + 4 * i]
+        quoted = quote_identifier(column['name'])
+        top_values = execute(
+            f'SELECT {quoted}, COUNT(*) AS n FROM {quoted_table} WHERE {quoted} IS NOT NULL '
+            f'GROUP BY {quoted} ORDER BY n DESC LIMIT {int(top_k)}'
+        )
+        profile = {
+            'type': column['type'],
+            'null_rate': round(1 - non_null / row_count, 4) if row_count else 0.0,
+            'distinct': distinct,
+            'min': _short(min_value),
+            'max': _short(max_value),
+            'top_values': [[_short(value), count] for value, count in top_values],
+        }
+
+        numeric = isinstance(min_value, (int, float)) and isinstance(max_value, (int, float))
+        if numeric and distinct > histogram_bins and max_value > min_value:
+            width = (max_value - min_value) / histogram_bins
+            bins = execute(
+                f'SELECT CAST(({quoted} - {min_value}) / {width} AS INTEGER) AS bin, COUNT(*) '
+                f'FROM {quoted_table} WHERE {quoted} IS NOT NULL GROUP BY bin'
+            )
+            counts = [0] * histogram_bins
+            for bin_index, count in bins:
+                counts[min(int(bin_index), histogram_bins - 1)] += count
+            profile['histogram'] = {'bin_width': width, 'counts': counts}
+
+        column_profiles[column['name']] = profile
+
+    return {'row_count': row_count, 'columns': column_profiles}
+
+
+def profile_database(db, previous=None, top_k=5, histogram_bins=10) -> dict:
+    '''
+    Build the profile index for a langchain SQLDatabase.
+
+    If a previous profile is given, it is reused as-is when the database version hasn't changed,
+    and otherwise only the tables whose fingerprint changed are reprofiled.
+    '''
+    version = database_version(db)
+    if (
+        previous is not None
+        and previous.get('format_version') == PROFILE_FORMAT_VERSION
+        and previous.get('version') == version
+    ):
+        return previous
+
+    previous_tables = (previous or {}).get('tables', {})
+    dialect = db._engine.dialect.name
+    tables = {}
+    with db._engine.connect() as connection:
+        execute = lambda query: [tuple(row) for row in connection.execute(text(query))]
+        # a fresh inspector, the database's own one caches columns from when it was created
+        inspector = inspect(connection)
+        for table in db.get_usable_table_names():
+            columns = [
+                {'name': column['name'], 'type': str(column['type'])}
+                for column in inspector.get_columns(table, schema=db._schema)
+            ]
+            fingerprint = table_fingerprint(execute, table, dialect, columns)
+            if table in previous_tables and previous_tables[table]['fingerprint'] == fingerprint:
+                tables[table] = previous_tables[table]
+                continue
+
+            print(f'Profiling table {table}...')
+            tables[table] = {
+                'fingerprint': fingerprint,
+                'table_info': db.get_table_info_no_throw([table]),
+                **profile_table(execute, table, columns, top_k=top_k, histogram_bins=histogram_bins),
+            }
+
+    return {'format_version': PROFILE_FORMAT_VERSION, 'version': version, 'tables': tables}
+
+
+def format_table_profile(table, table_profile) -> str:
+    '''Render a table's schema and column profile as text for an agent.'''
+    lines = [table_profile['table_info'].strip(), '', f'/*\nColumn profile for {table} ({table_profile["row_count"]} rows):']
+    for name, column in table_profile['columns'].items():
+        line = f'{name} ({column["type"]}): {column["null_rate"]:.1%} null, {column["distinct"]} distinct'
+        if column['min'] is not None:
+            line += f', min {column["min"]!r}, max {column["max"]!r}'
+        if column['top_values']:
+            top_values = ', '.join(f'{value!r} ({count})' for value, count in column['top_values'])
+            line += f', top values: {top_values}'
+        if 'histogram' in column:
+            line += f', histogram (bin width {column["histogram"]["bin_width"]:.4g}): {column["histogram"]["counts"]}'
+        lines.append(line)
+    lines.append('*/')
+    return '\n'.join(lines)
+
+
+class SchemaProfileStore:
+    '''
+    Keeps one profile index per database, persisted as a JSON file next to SQLite databases.
+    The profile is refreshed (incrementally) only when the database version changes.
+    '''
+
+    def __init__(self):
+        self._profiles = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _profile_path(db):
+        path = sqlite_path(db)
+        return path + '.profile.json' if path is not None else None
+
+    def _load(self, db):
+        path = self._profile_path(db)
+        if path is None:
+            return None
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, db, profile):
+        path = self._profile_path(db)
+        if path is None:
+            return
+        try:
+            with open(path, 'w') as f:
+                json.dump(profile, f)
+        except OSError:
+            pass
+
+    def get(self, db) -> dict:
+        identity = database_identity(db)
+        with self._lock:
+            previous = self._profiles.get(identity)
+            if previous is None:
+                previous = self._load(db)
+            profile = profile_database(db, previous=previous)
+            if profile is not previous:
+                self._save(db, profile)
+            self._profiles[identity] = profile
+        return profile
+
+
+# shared by the info tools so each database is profiled once per version
+shared_profile_store = SchemaProfileStore()
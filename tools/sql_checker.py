@@ -0,0 +1,87 @@
+import difflib
+import re
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+
+VALID = 'valid'
+INVALID = 'invalid'
+UNRESOLVED = 'unresolved'
+
+# error messages we know how to explain, for sqlite and postgres
+_MISSING_COLUMN_PATTERNS = [
+    re.compile(r'no such column: ([\w."]+)'),
+    re.compile(r'column "?([\w.]+)"? does not exist'),
+    re.compile(r"Unknown column '([\w.]+)'"),
+]
+_MISSING_TABLE_PATTERNS = [
+    re.compile(r'no such table: ([\w."]+)'),
+    re.compile(r'relation "?([\w.]+)"? does not exist'),
+    re.compile(r"Table '([\w.]+)' doesn't exist"),
+]
+_SYNTAX_ERROR_PATTERNS = [
+    re.compile(r'(near "[^"]*": syntax error)'),
+    re.compile(r'(incomplete input)'),
+    re.compile(r'(syntax error at or near "[^"]*")'),
+    re.compile(r'(misuse of aggregate[^\n]*)'),
+    re.compile(r'(wrong number of arguments to function [^\n]*)'),
+    re.compile(r'(no such function: [^\n]*)'),
+]
+
+
+def _first_line(error: Exception) -> str:
+    message = str(getattr(error, 'orig', None) or error)
+    return message.strip().split('\n')[0]
+
+
+def _suggest(name, candidates) -> str:
+    matches = difflib.get_close_matches(name, candidates, n=3, cutoff=0.6)
+    lowered = {candidate.lower(): candidate for candidate in candidates}
+    if name.lower() in lowered and lowered[name.lower()] not in matches:
+        matches.insert(0, lowered[name.lower()])
+    if not matches:
+        return ''
+    return ' Did you mean ' + ' or '.join(repr(match) for match in matches) + '?'
+
+
+def check_query(connection, query, profile):
+    '''
+    Validate a query locally, without an LLM.
+
+    The query is compiled with EXPLAIN (which plans it without running it), and errors about
+    unknown tables or columns are explained with close matches from the profile index.
+    Returns (status, message), where status is VALID, INVALID, or UNRESOLVED when the error
+    isn't one we can explain and the query should go to the LLM checker instead.
+    '''
+    stripped = query.strip().rstrip(';').strip()
+    if not stripped:
+        return INVALID, 'The query is empty.'
+
+    try:
+        connection.execute(text('EXPLAIN ' + stripped)).fetchall()
+    except SQLAlchemyError as e:
+        error = _first_line(e)
+    else:
+        return VALID, stripped
+
+    tables = profile['tables']
+    for pattern in _MISSING_TABLE_PATTERNS:
+        match = pattern.search(error)
+        if match:
+            name = match.group(1).strip('"').split('.')[-1]
+            return INVALID, f'Error: {error}. Known tables: {", ".join(tables)}.{_suggest(name, list(tables))}'
+
+    for pattern in _MISSING_COLUMN_PATTERNS:
+        match = pattern.search(error)
+        if match:
+            name = match.group(1).strip('"').split('.')[-1]
+            columns = sorted({column for table in tables.values() for column in table['columns']})
+            return INVALID, f'Error: {error}.{_suggest(name, columns)}'
+
+    for pattern in _SYNTAX_ERROR_PATTERNS:
+        match = pattern.search(error)
+        if match:
+            return INVALID, f'Error: {match.group(1)}.'
+
+    return UNRESOLVED, f'Error: {error}'
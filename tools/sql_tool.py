@@ -1,36 +1,85 @@
+import time
 from typing import List, Optional
-from uuid import UUID
-from pydantic.v1 import BaseModel, Field
-from langchain_core.pydantic_v1 import Field
-
-# from langchain_community.callbacks import Callback
-from langchain.sql_database import SQLDatabase
-from langchain.tools import StructuredTool
-from langchain_openai import ChatOpenAI
-from langchain_core.callbacks import CallbackManagerForToolRun
-from langchain_community.agent_toolkits import create_sql_agent
-from langchain_community.tools import BaseTool
-from langchain.sql_database import SQLDatabase
-from langchain.tools import StructuredTool
-from langchain_openai import ChatOpenAI
-from langchain_core.callbacks import CallbackManagerForToolRun
-from langchain_community.agent_toolkits import create_sql_agent
-from langchain_community.tools import BaseTool
-from langchain_core.tools import BaseTool
+
+from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.callbacks import CallbackManagerForToolRun, AsyncCallbackManagerForToolRun
+from langchain_core.tools import BaseTool, StructuredTool
 from langchain_community.tools.sql_database.tool import (
     InfoSQLDatabaseTool,
     ListSQLDatabaseTool,
     QuerySQLCheckerTool,
     BaseSQLDatabaseTool
 )
-from langchain_community.utilities.sql_database import SQLDatabase
+from langchain_community.utilities.sql_database import truncate_word
 from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+import crew_events
+import tracing
+from tools.query_cache import (
+    QueryResultCache,
+    shared_query_cache,
+    database_identity,
+    database_version,
+    is_read_only_query
+)
+from tools.schema_profile import SchemaProfileStore, shared_profile_store, format_table_profile
+from tools.sql_checker import check_query, VALID, UNRESOLVED
+from tools.db_registry import get_database, get_llm, database_executor, DatabaseExecutor, DatabaseBusyError
+from tools.result_encoding import ResultEncoder
+from tools.query_advisor import QueryLog, QueryRewriter, shared_query_log, shared_query_rewriter
+from tools.sampling import SampleStore, shared_sample_store
 
 
 
+def fetch_limited(connection, query, max_rows, batch_size=50):
+    '''
+    Execute a query and stream at most max_rows rows from the cursor.
+    
+    Returns the column names, the rows, and whether the result was truncated. Only
+    max_rows + 1 rows are ever fetched, so memory and latency stay bounded no
+    matter how large the full result set is.
+    '''
+    result = connection.execution_options(stream_results=True).execute(text(query))
+    if not result.returns_rows:
+        return [], [], False
+    
+    columns = list(result.keys())
+    rows = []
+    try:
+        while len(rows) <= max_rows:
+            batch = result.fetchmany(min(batch_size, max_rows + 1 - len(rows)))
+            if not batch:
+                break
+            rows.extend(tuple(row) for row in batch)
+    finally:
+        result.close()
+    
+    truncated = len(rows) > max_rows
+    return columns, rows[:max_rows], truncated
+
 class QuerySQLLimitedDataBaseTool(BaseSQLDatabaseTool, BaseTool):
     """Tool for querying a SQL database with a limit on the output."""
     
+    max_rows: int = 100
+    # counting the full result means running the query a second time, so it's opt-in
+    count_truncated_total: bool = False
+    # results are cached per normalized query and database version, set to None to disable
+    result_cache: Optional[QueryResultCache] = Field(default_factory=lambda: shared_query_cache)
+    # a user-supplied version stamp, for databases where a file stamp isn't available
+    db_epoch: Optional[str] = None
+    # compact, token-budgeted encoding of the rows, set to None for the raw list of tuples
+    encoder: Optional[ResultEncoder] = Field(default_factory=ResultEncoder)
+    # executed queries and their timings, for the query advisor, set to None to disable
+    query_log: Optional[QueryLog] = Field(default_factory=lambda: shared_query_log)
+    # rewrites queries to use the generated columns and summary tables the advisor created
+    rewriter: Optional[QueryRewriter] = Field(default_factory=lambda: shared_query_rewriter)
+    # exploratory queries on large tables run against stratified samples, set to None to always run exact
+    sample_store: Optional[SampleStore] = Field(default_factory=lambda: shared_sample_store)
+    # runs the async calls, with its per-database limits on running and waiting queries
+    executor: DatabaseExecutor = Field(default_factory=lambda: database_executor)
+    
     name: str = "sql_db_query"
     description: str = """
     Input to this tool is a detailed and correct SQL query, output is a result from the database.
@@ -45,28 +94,254 @@ class QuerySQLLimitedDataBaseTool(BaseSQLDatabaseTool, BaseTool):
     ) -> str:
         """Execute the query, return the results or an error message."""
         
-        result = self.db.run_no_throw(query)
+        with tracing.span('sql.query', query=query[:200]) as span:
+            plan = None
+            if self.sample_store is not None and is_read_only_query(query):
+                try:
+                    plan = self.sample_store.plan(self.db, query)
+                except Exception as e:
+                    # the sample is only a shortcut (its sidecar may not be writable, the table
+                    # may be locked), the query still runs exactly
+                    span.set(sample_error=f'{type(e).__name__}: {e}'[:200])
+            span.set(approximate=plan is not None)
+            
+            cache_key = None
+            if self.result_cache is not None and is_read_only_query(query):
+                cache_key = self.result_cache.make_key(
+                    database_identity(self.db),
+                    database_version(self.db, self.db_epoch),
+                    query,
+                    extra=(
+                        self.max_rows,
+                        self.count_truncated_total,
+                        self.encoder and self.encoder.cache_key(),
+                        plan and plan['sample']['version']
+                    )
+                )
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    span.set(cache='hit')
+                    return cached
+            span.set(cache='miss' if cache_key is not None else 'bypass')
+            
+            output = self._execute(query) if plan is None else self._execute_approximate(query, plan)
+            span.set(error=output.startswith('Error:'), output_tokens=tracing.estimate_tokens(output))
+            
+            if cache_key is not None and not output.startswith('Error:'):
+                self.result_cache.set(cache_key, output)
+            
+            return output
+    
+    async def _arun(
+        self,
+        query: str,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+    ) -> str:
+        """Execute the query on the shared database executor, without blocking the event loop."""
+        try:
+            return await self.executor.run(database_identity(self.db), self._run, query)
+        except DatabaseBusyError as e:
+            return f"Error: {e}"
+    
+    def _execute(self, query: str) -> str:
+        identity = database_identity(self.db)
+        executed = query
+        if self.rewriter is not None:
+            # rules saved by the advisor, possibly from another process
+            self.rewriter.load(self.db)
+            executed = self.rewriter.rewrite(identity, query, database_version(self.db, self.db_epoch)) or query
+        
+        try:
+            with self.db._engine.connect() as connection:
+                start = time.perf_counter()
+                try:
+                    columns, results_list, truncated = fetch_limited(connection, executed, self.max_rows)
+                except SQLAlchemyError:
+                    if executed == query:
+                        raise
+                    # the rewrite didn't work out, run the query as written
+                    executed = query
+                    columns, results_list, truncated = fetch_limited(connection, executed, self.max_rows)
+                if self.query_log is not None:
+                    self.query_log.record(
+                        identity, query, time.perf_counter() - start,
+                        rows=len(results_list), rewritten=executed if executed != query else None
+                    )
+                
+                total_rows = None
+                if truncated and self.count_truncated_total:
+                    total_rows = connection.execute(
+                        text(f'SELECT COUNT(*) FROM ({query.strip().rstrip(";")}) AS limited_query')
+                    ).scalar()
+        except SQLAlchemyError as e:
+            if self.query_log is not None:
+                self.query_log.record(identity, query, 0.0, error=str(e).splitlines()[0])
+            return f"Error: {e}"
+        
+        results_list = [
+            tuple(truncate_word(value, length=self.db._max_string_length) for value in row)
+            for row in results_list
+        ]
+        
+        output = str(results_list) if self.encoder is None else self.encoder.encode(columns, results_list)
         
-        results_list = eval(result)        
-        if len(results_list) > 100:
-            results_list = results_list[:100]
+        if not truncated:
+            return output
+        if total_rows is not None:
+            return f"{output}\n(Showing the first {self.max_rows} of {total_rows} rows.)"
+        return f"{output}\n(Showing the first {self.max_rows} rows, the query returned more.)"
+    
+    def _execute_approximate(self, query: str, plan: dict) -> str:
+        sample_db = plan['sample']['db']
+        try:
+            with sample_db._engine.connect() as connection:
+                start = time.perf_counter()
+                columns, results_list, truncated = fetch_limited(connection, plan['query'], self.max_rows)
+        except SQLAlchemyError:
+            # anything the approximate rewrite can't handle runs exactly
+            return self._execute(query)
+        if self.query_log is not None:
+            self.query_log.record(
+                database_identity(self.db), query, time.perf_counter() - start,
+                rows=len(results_list), rewritten=plan['query']
+            )
+        
+        format_value = self.encoder.format_value if self.encoder is not None else str
+        columns, results_list = self.sample_store.attach_bounds(plan, columns, results_list, format_value)
+        results_list = [
+            tuple(truncate_word(value, length=self.db._max_string_length) for value in row)
+            for row in results_list
+        ]
+        output = str(results_list) if self.encoder is None else self.encoder.encode(columns, results_list)
+        if truncated:
+            output += f"\n(Showing the first {self.max_rows} rows, the query returned more.)"
+        return f"{output}\n{self.sample_store.describe(plan)}"
+    
+class ProfiledInfoSQLDatabaseTool(InfoSQLDatabaseTool):
+    """Tool for getting the schema and column profile of tables, answered from the profile index."""
+    
+    profile_store: SchemaProfileStore = Field(default_factory=lambda: shared_profile_store)
+    executor: DatabaseExecutor = Field(default_factory=lambda: database_executor)
+    
+    def _run(
+        self,
+        table_names: str,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        """Get the schema and column profile for tables in a comma-separated list."""
+        tables = self.profile_store.get(self.db)['tables']
+        requested = [t.strip() for t in table_names.split(",") if t.strip()]
+        
+        missing = [t for t in requested if t not in tables]
+        if missing:
+            return f"Error: table_names {set(missing)} not found in database"
         
-        return str(results_list)
+        return "\n\n".join(format_table_profile(t, tables[t]) for t in requested)
+    
+    async def _arun(
+        self,
+        table_names: str,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+    ) -> str:
+        # the first call for a database version profiles it, which blocks
+        return await self.executor.run(database_identity(self.db), self._run, table_names)
+
+class ProfiledListSQLDatabaseTool(ListSQLDatabaseTool):
+    """Tool for getting table names, answered from the profile index."""
+    
+    profile_store: SchemaProfileStore = Field(default_factory=lambda: shared_profile_store)
+    executor: DatabaseExecutor = Field(default_factory=lambda: database_executor)
+    
+    def _run(
+        self,
+        tool_input: str = "",
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        """Get the names of the tables in the database."""
+        return ", ".join(self.profile_store.get(self.db)['tables'])
     
+    async def _arun(
+        self,
+        tool_input: str = "",
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+    ) -> str:
+        return await self.executor.run(database_identity(self.db), self._run, tool_input)
+    
+class LocalQuerySQLCheckerTool(QuerySQLCheckerTool):
+    """
+    Check queries locally against the database and the profile index, and only
+    use the LLM for queries that fail in a way the local checker can't explain.
+    """
+    
+    profile_store: SchemaProfileStore = Field(default_factory=lambda: shared_profile_store)
+    executor: DatabaseExecutor = Field(default_factory=lambda: database_executor)
+    local_checks: int = 0
+    llm_checks: int = 0
+    
+    @property
+    def llm_checks_avoided(self) -> int:
+        return self.local_checks
+    
+    def _check_locally(self, query: str):
+        try:
+            with self.db._engine.connect() as connection:
+                status, message = check_query(connection, query, self.profile_store.get(self.db))
+        except Exception as e:
+            return UNRESOLVED, f"Error: {e}"
+        
+        if status == UNRESOLVED:
+            self.llm_checks += 1
+        else:
+            self.local_checks += 1
+        return status, message
+    
+    def _run(
+        self,
+        query: str,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        """Check the query locally, falling back to the LLM."""
+        status, message = self._check_locally(query)
+        if status == UNRESOLVED:
+            return super()._run(query, run_manager=run_manager)
+        if status == VALID:
+            return message
+        return f"{message} Rewrite the query and check it again."
+    
+    async def _arun(
+        self,
+        query: str,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+    ) -> str:
+        try:
+            status, message = await self.executor.run(database_identity(self.db), self._check_locally, query)
+        except DatabaseBusyError as e:
+            return f"Error: {e}"
+        if status == UNRESOLVED:
+            return await super()._arun(query, run_manager=run_manager)
+        if status == VALID:
+            return message
+        return f"{message} Rewrite the query and check it again."
+
 class SQLDatabaseToolkitLimited(SQLDatabaseToolkit):
     
+    # check queries locally, only sending the ones that can't be resolved to the LLM
+    local_checker: bool = True
+    executor: DatabaseExecutor = Field(default_factory=lambda: database_executor)
+    
     def get_tools(self) -> List[BaseTool]:
         """Get the tools in the toolkit."""
-        list_sql_database_tool = ListSQLDatabaseTool(db=self.db)
+        list_sql_database_tool = ProfiledListSQLDatabaseTool(db=self.db, executor=self.executor)
         info_sql_database_tool_description = (
             "Input to this tool is a comma-separated list of tables, output is the "
-            "schema and sample rows for those tables. "
+            "schema, sample rows and a column profile (null rates, distinct counts, "
+            "min/max, top values and histograms) for those tables. "
             "Be sure that the tables actually exist by calling "
             f"{list_sql_database_tool.name} first! "
             "Example Input: table1, table2, table3"
         )
-        info_sql_database_tool = InfoSQLDatabaseTool(
-            db=self.db, description=info_sql_database_tool_description
+        info_sql_database_tool = ProfiledInfoSQLDatabaseTool(
+            db=self.db, description=info_sql_database_tool_description, executor=self.executor
         )
         query_sql_database_tool_description = (
             "Input to this tool is a detailed and correct SQL query, output is a "
@@ -74,21 +349,28 @@ class SQLDatabaseToolkitLimited(SQLDatabaseToolkit):
             "will be returned. If an error is returned, rewrite the query, check the "
             "query, and try again. If you encounter an issue with Unknown column "
             f"'xxxx' in 'field list', use {info_sql_database_tool.name} "
-            "to query the correct table fields."
+            "to query the correct table fields. Queries on very large tables are answered "
+            "from a sample and marked as approximate, add the comment -- exact to a query "
+            "when you need the exact numbers for a final answer."
         )
 
         # Note that we're using the limited version of the query tool
         query_sql_database_tool = QuerySQLLimitedDataBaseTool(
-            db=self.db, description=query_sql_database_tool_description
+            db=self.db, description=query_sql_database_tool_description, executor=self.executor
         )
         query_sql_checker_tool_description = (
             "Use this tool to double check if your query is correct before executing "
             "it. Always use this tool before executing a query with "
             f"{query_sql_database_tool.name}!"
         )
-        query_sql_checker_tool = QuerySQLCheckerTool(
-            db=self.db, llm=self.llm, description=query_sql_checker_tool_description
-        )
+        if self.local_checker:
+            query_sql_checker_tool = LocalQuerySQLCheckerTool(
+                db=self.db, llm=self.llm, description=query_sql_checker_tool_description, executor=self.executor
+            )
+        else:
+            query_sql_checker_tool = QuerySQLCheckerTool(
+                db=self.db, llm=self.llm, description=query_sql_checker_tool_description
+            )
         return [
             query_sql_database_tool,
             info_sql_database_tool,
@@ -98,40 +380,130 @@ class SQLDatabaseToolkitLimited(SQLDatabaseToolkit):
 
 
 
-def build_sql_tool(db_uri, description, name='query_sql_db_tool', llm=None) -> StructuredTool:
-    '''Builds a tool that can run sql queries against a database.'''
+def build_sql_tool(db_uri, description, name='query_sql_db_tool', llm=None, mode='hybrid', executor=None) -> StructuredTool:
+    '''
+    Builds a tool that can run sql queries against a database.
+    
+    In 'hybrid' mode, input that is already valid SQL against known tables is run directly,
+    and only natural-language questions or failing queries go to the nested sql agent.
+    In 'agent' mode every input goes to the nested sql agent. The number of calls taking each
+    path is kept in the tool's metadata['path_counts'].
     
+    Async calls run their database work on executor, the shared database_executor by default,
+    whose limits decide how many queries may run and wait per database before callers get
+    a 'too many queries waiting' error.
+    '''
+    if mode not in ('hybrid', 'agent'):
+        raise ValueError(f"mode must be 'hybrid' or 'agent', not {mode!r}")
 
+    # the agent constructors pull in most of langchain, so only import them once a tool is built
+    from langchain_community.agent_toolkits import create_sql_agent
+    
+    # the database and llm clients are shared, so building more tools for the same uri is cheap
+    db = get_database(db_uri)
+    executor = executor or database_executor
     toolkit = SQLDatabaseToolkitLimited(
-        llm=ChatOpenAI(model='gpt-4', temperature=0), 
-        db=SQLDatabase.from_uri(db_uri)
+        llm=get_llm('gpt-4', temperature=0), 
+        db=db,
+        executor=executor
     )
     
-    sql_agent = create_sql_agent(
-        llm=llm or ChatOpenAI(model='gpt-4', temperature=0), 
-        toolkit=toolkit,
-        agent_type="openai-tools", 
-        verbose=True
-    )
+    def make_sql_agent(verbose):
+        return create_sql_agent(
+            llm=llm or get_llm('gpt-4', temperature=0), 
+            toolkit=toolkit,
+            agent_type="openai-tools", 
+            verbose=verbose
+        )
+    
+    sql_agent = make_sql_agent(verbose=True)
+    # when the calling task streams its events, the nested agent's steps go there instead of stdout
+    quiet_sql_agent = make_sql_agent(verbose=False)
     
     class SqlAgentInput(BaseModel):
         sql_query: str = Field()
     
-    def sql_agent_run_wrapper(*args, **kwargs):
-        '''Runs a sql query against the spaceship titanic database and returns the results.'''
-        result = sql_agent.invoke(*args, **kwargs)
-
+    direct_query_tool = QuerySQLLimitedDataBaseTool(db=db, executor=executor)
+    path_counts = {'direct': 0, 'escalated': 0, 'agent': 0}
+    
+    def run_direct(sql_query):
+        '''Run input that is already valid SQL. Returns None if the agent should handle it.'''
+        if mode != 'hybrid' or not is_read_only_query(sql_query):
+            return None, None
+        
+        with db._engine.connect() as connection:
+            status, message = check_query(connection, sql_query, shared_profile_store.get(db))
+        if status != VALID:
+            return None, message
+        
+        result = direct_query_tool.run(sql_query)
+        if result.startswith('Error:'):
+            return None, result
+        return result, None
+    
+    def agent_input_for(sql_query, error, span):
+        '''Count the path a call that wasn't answered directly takes, and build the nested agent's input.'''
+        if error is None:
+            path_counts['agent'] += 1
+            span.set(path='agent')
+            return sql_query
+        path_counts['escalated'] += 1
+        span.set(path='escalated')
+        return (
+            f'{sql_query}\n\nRunning this query failed with: {error}\n'
+            'Fix the query and return its results.'
+        )
+    
+    def agent_and_config():
+        callbacks = crew_events.nested_callbacks(name)
+        if callbacks is None:
+            return sql_agent, None
+        return quiet_sql_agent, {'callbacks': callbacks}
+    
+    def agent_output(result):
         if isinstance(result, dict):
             return result['output']
         return str(result)
+    
+    def sql_agent_run_wrapper(sql_query: str) -> str:
+        '''Runs a sql query against the spaceship titanic database and returns the results.'''
+        with tracing.span('sql_tool.run', tool=name, input=sql_query[:200]) as span:
+            result, error = run_direct(sql_query)
+            if result is not None:
+                path_counts['direct'] += 1
+                span.set(path='direct')
+                return result
+            
+            agent_input = agent_input_for(sql_query, error, span)
+            agent, config = agent_and_config()
+            return agent_output(agent.invoke({'input': agent_input}, config=config))
+    
+    async def sql_agent_arun_wrapper(sql_query: str) -> str:
+        '''The async version: database work goes through the executor, the nested agent runs with ainvoke.'''
+        with tracing.span('sql_tool.run', tool=name, input=sql_query[:200], mode='async') as span:
+            try:
+                result, error = await executor.run(database_identity(db), run_direct, sql_query)
+            except DatabaseBusyError as e:
+                return f'Error: {e}'
+            if result is not None:
+                path_counts['direct'] += 1
+                span.set(path='direct')
+                return result
+            
+            agent_input = agent_input_for(sql_query, error, span)
+            agent, config = agent_and_config()
+            return agent_output(await agent.ainvoke({'input': agent_input}, config=config))
             
     sql_agent_tool = StructuredTool.from_function(
         func=sql_agent_run_wrapper,
+        coroutine=sql_agent_arun_wrapper,
         name=name, 
         description=description,
-        verbose=True,
+        # printed when the agent calling the tool is verbose, crew runs streaming events aren't
+        verbose=False,
         return_direct=True,
-        args_schema=SqlAgentInput
+        args_schema=SqlAgentInput,
+        metadata={'path_counts': path_counts}
     )
     
     return sql_agent_tool
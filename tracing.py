@@ -0,0 +1,184 @@
+import contextvars
+import itertools
+import json
+import math
+import os
+import threading
+import time
+
+
+_enabled = os.environ.get('CREW_TRACE') == '1'
+_current_span = contextvars.ContextVar('current_span', default=None)
+_span_ids = itertools.count(1)
+_finished_spans = []
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled() -> bool:
+    return _enabled
+
+def reset():
+    with _lock:
+        _finished_spans.clear()
+
+
+def estimate_tokens(text) -> int:
+    '''Rough token count for a piece of text, about 4 characters per token.'''
+    if text is None:
+        return 0
+    return math.ceil(len(str(text)) / 4)
+
+
+class Span:
+    '''A timed, nestable unit of work. Use it through span() as a context manager.'''
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.span_id = next(_span_ids)
+        self.parent_id = None
+        self.start = None
+        self.end = None
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent is not None else None
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attributes['error'] = f'{exc_type.__name__}: {exc}'
+        _record(self)
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'thread_id': self.thread_id,
+            'start': self.start,
+            'duration': self.end - self.start,
+            'attributes': self.attributes,
+        }
+
+
+class _NoopSpan:
+    '''Returned by span() when tracing is disabled, so instrumentation costs next to nothing.'''
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _record(finished_span):
+    finished_span.thread_id = threading.get_ident()
+    with _lock:
+        _finished_spans.append(finished_span)
+
+
+def span(name, **attributes):
+    '''
+    Time a block of code:
+
+        with tracing.span('generate', template='gen_agent_config_prompt') as s:
+            ...
+            s.set(cache='miss')
+
+    Spans opened inside the block (in the same thread or context) are recorded as its children.
+    '''
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def record_span(name, start, end, **attributes):
+    '''Record a span after the fact, for work we only hear about once it's done (e.g. crew callbacks).'''
+    if not _enabled:
+        return
+    finished_span = Span(name, attributes)
+    parent = _current_span.get()
+    finished_span.parent_id = parent.span_id if parent is not None else None
+    finished_span.start = start
+    finished_span.end = end
+    _record(finished_span)
+
+
+def finished_spans() -> list:
+    with _lock:
+        return [finished_span.to_dict() for finished_span in _finished_spans]
+
+
+def export_jsonl(path):
+    '''Write one JSON object per finished span.'''
+    with open(path, 'w') as f:
+        for finished_span in finished_spans():
+            f.write(json.dumps(finished_span, default=str) + '\n')
+
+
+def export_chrome_trace(path):
+    '''Write the finished spans in Chrome trace-event format (open in chrome://tracing or Perfetto).'''
+    events = [
+        {
+            'name': finished_span['name'],
+            'cat': finished_span['name'].split('.')[0],
+            'ph': 'X',
+            'ts': finished_span['start'] * 1e6,
+            'dur': finished_span['duration'] * 1e6,
+            'pid': _pid,
+            'tid': finished_span['thread_id'],
+            'args': finished_span['attributes'],
+        }
+        for finished_span in finished_spans()
+    ]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+def print_summary(limit=10):
+    '''Print the slowest spans and the total time spent per span name.'''
+    spans = finished_spans()
+    if not spans:
+        print('No spans were recorded (set CREW_TRACE=1 or call tracing.enable()).')
+        return
+
+    print(f'\nSlowest {min(limit, len(spans))} spans:')
+    print(f'{"duration (s)":>12}  {"name":<28} attributes')
+    for finished_span in sorted(spans, key=lambda s: s['duration'], reverse=True)[:limit]:
+        attributes = json.dumps(finished_span['attributes'], default=str)
+        if len(attributes) > 80:
+            attributes = attributes[:77] + '...'
+        print(f'{finished_span["duration"]:>12.3f}  {finished_span["name"]:<28} {attributes}')
+
+    totals = {}
+    for finished_span in spans:
+        count, total = totals.get(finished_span['name'], (0, 0.0))
+        totals[finished_span['name']] = (count + 1, total + finished_span['duration'])
+    print(f'\n{"total (s)":>12}  {"count":>6}  name')
+    for name, (count, total) in sorted(totals.items(), key=lambda item: item[1][1], reverse=True):
+        print(f'{total:>12.3f}  {count:>6}  {name}')